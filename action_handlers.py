@@ -73,7 +73,7 @@ def Open(context, item):
         context.items.ListItems(item["contents"], indent=2)
       else:
         context.PrintItemInString("You open @.", item)
-      item["is_open?"] = True
+      context.items.SetOpen(item, True)
     else:
       context.PrintItemInString("@ is already open.", item)
   else:
@@ -83,7 +83,7 @@ def Close(context, item):
   if item.get("openable?"):
     if item.get("is_open?"):
       context.PrintItemInString("You close @.", item)
-      item["is_open?"] = False
+      context.items.SetOpen(item, False)
     else:
       context.PrintItemInString("@ isn't open.", item)
   else:
@@ -132,7 +132,7 @@ def PrintAction(context, action_key):
     context.Print(print_string)
 
 def Actions(context):
-    print("Movement:")
+    context.Print("Movement:")
     for action_key in context.actions.actions_dictionary:
         if context.actions[action_key].get("suppress_in_actions_list?"):
             continue
@@ -141,7 +141,7 @@ def Actions(context):
 
         PrintAction(context, action_key)
     
-    print("\nOther actions:")
+    context.Print("\nOther actions:")
     for action_key in sorted(context.actions.actions_dictionary):
         if context.actions[action_key].get("suppress_in_actions_list?"):
             continue
@@ -188,8 +188,7 @@ def PutIn(context, item, second_item):
             context.PrintItemInString("The @ is closed.", second_item)
         else:
             context.Print("Done.")
-            context.player.inventory.remove(item["key"])
-            second_item["contents"].append(item["key"])
+            context.items.MoveItemTo(item, second_item["key"])
     else:
       context.Print("You can't do that.")
 
@@ -0,0 +1,174 @@
+### THIS FILE BENCHMARKS THE GAME ENGINE ###
+
+# Run "python benchmark.py" to time the engine headless (no console, no server) on a set of workloads, each a script
+#  of commands played over and over in one session:
+#   parse      the parser alone (ParseCommand, including ParseItem, with the action itself skipped)
+#   turn       full turns of a mix of commands, including moving between rooms
+#   look       LOOK and INVENTORY, which are mostly describing and listing items
+#   containers putting items into containers, taking them out and examining them
+#   save       saving the game to a slot (SaveToSlot) and restoring it again (RestoreFromSlot)
+# For each workload it prints commands per second and the p50/p99 latency of a command, and it writes the results to
+#  a JSON file (benchmark_results.json unless --output says otherwise). "--compare old.json" shows how the results
+#  have changed since an earlier run. Timings on a busy machine vary a lot from run to run; "--repeat 5" runs each
+#  workload five times and keeps the fastest run.
+#
+# The workloads only use the sample world's items and locations, so they also run on worlds made by
+#  world_generator.py (which include the sample world): "python benchmark.py --world generated_world".
+
+import argparse
+import json
+import platform
+import tempfile
+import time
+from pathlib import Path
+
+import game
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+# Each workload: commands to get the session ready, then the commands that are played over and over
+WORKLOADS = {
+    "parse": (["open backpack"],
+              ["take coin", "put coin in backpack", "examine red flowers", "look at jukebox", "open door",
+               "take coin from backpack", "turn on flashlight", "get all", "x pot", "drop coin"]),
+    "turn": ([],
+             ["look", "inventory", "open backpack", "examine coin", "take coin", "open door", "n", "examine jukebox",
+              "s", "w", "e"]),
+    "look": (["open backpack", "take coin"],
+             ["look", "inventory"]),
+    "containers": (["open backpack"],
+                   ["take coin from backpack", "put coin in backpack", "examine backpack", "close backpack",
+                    "open backpack", "inventory"]),
+    "save": (["open backpack", "take coin", "open door", "n"],
+             ["save", "restore"]),
+}
+
+
+######################### RUNNING #########################
+
+
+# Starts a session for a workload and plays its setup commands (the output is thrown away)
+def StartWorkloadSession(engine, workload_name, save_dir):
+    context = engine.NewSession(save_dir = save_dir)
+    context.StartGame()
+    for command in WORKLOADS[workload_name][0]:
+        context.RunTurn(command)
+
+    # The parse workload only times the parser, so the parsed action is never carried out
+    if workload_name == "parse":
+        context.actions.ParseAction = lambda parsed_command: None
+    return context
+
+# Runs one command of a workload
+def RunWorkloadCommand(context, workload_name, command):
+    if workload_name == "parse":
+        context.actions.ParseCommand(command)
+        context.state.ClearPending()
+        context.Flush()
+    elif workload_name == "save":
+        if command == "save":
+            context.SaveToSlot("1")
+        else:
+            context.RestoreFromSlot("1")
+        context.Flush()
+    else:
+        context.RunTurn(command)
+
+# Times a workload for a number of commands (after warming up), and returns its results
+def RunWorkload(engine, workload_name, commands, warmup):
+    with tempfile.TemporaryDirectory() as save_dir:
+        context = StartWorkloadSession(engine, workload_name, save_dir)
+        script = WORKLOADS[workload_name][1]
+        for i in range(warmup):
+            RunWorkloadCommand(context, workload_name, script[i % len(script)])
+
+        timings = []
+        clock = time.perf_counter
+        for i in range(commands):
+            start_time = clock()
+            RunWorkloadCommand(context, workload_name, script[i % len(script)])
+            timings.append(clock() - start_time)
+    return SummarizeTimings(timings)
+
+# Turns a list of command timings (in seconds) into results
+def SummarizeTimings(timings):
+    total_time = sum(timings)
+    timings = sorted(timings)
+    results = {}
+    results["commands"] = len(timings)
+    results["seconds"] = total_time
+    results["commands_per_sec"] = len(timings) / total_time if total_time > 0 else 0.0
+    results["mean_us"] = 1000000 * total_time / len(timings)
+    results["p50_us"] = 1000000 * Percentile(timings, 50)
+    results["p99_us"] = 1000000 * Percentile(timings, 99)
+    results["max_us"] = 1000000 * timings[-1]
+    return results
+
+# Returns a percentile of a sorted list (nearest rank)
+def Percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, max(0, (len(sorted_values) * percent + 99) // 100 - 1))
+    return sorted_values[index]
+
+# Runs the named workloads (each repeats times, keeping the fastest run) and returns all of the results, with a
+#  description of the run
+def RunBenchmarks(world_dir = None, workload_names = None, commands = 5000, warmup = 200, repeats = 1):
+    if workload_names == None:
+        workload_names = list(WORKLOADS)
+    engine = game.Engine(world_dir)
+
+    # Load (or compile) the world first, so that isn't counted in the first workload
+    context = engine.NewSession()
+    context.StartGame()
+
+    run = {}
+    run["world"] = str(engine.world_dir)
+    run["locations"] = len(context.locations.locations_dictionary)
+    run["items"] = len(context.items.items_dictionary)
+    run["python"] = platform.python_version()
+    run["platform"] = platform.platform()
+    run["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    run["workloads"] = {}
+    run["repeats"] = repeats
+    for workload_name in workload_names:
+        results = [RunWorkload(engine, workload_name, commands, warmup) for i in range(max(1, repeats))]
+        run["workloads"][workload_name] = max(results, key=lambda r: r["commands_per_sec"])
+    return run
+
+
+######################### REPORTING #########################
+
+
+def PrintResults(run, baseline = None):
+    print("World: " + run["world"] + " (" + str(run["locations"]) + " locations, " + str(run["items"]) + " items)")
+    print("%-12s %12s %10s %10s %10s" % ("workload", "commands/s", "p50 us", "p99 us", "change"))
+    for workload_name, results in run["workloads"].items():
+        change = ""
+        if (baseline != None) and (workload_name in baseline["workloads"]):
+            old_rate = baseline["workloads"][workload_name]["commands_per_sec"]
+            if old_rate > 0:
+                change = "%+.1f%%" % (100 * (results["commands_per_sec"] / old_rate - 1))
+        print("%-12s %12.0f %10.1f %10.1f %10s" % (workload_name, results["commands_per_sec"], results["p50_us"], results["p99_us"], change))
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Benchmark the game engine on a set of workloads")
+    parser.add_argument("--world", default=None, help="directory holding the world's JSON files (default: current directory)")
+    parser.add_argument("--workload", action="append", choices=list(WORKLOADS), help="run only this workload (can be repeated)")
+    parser.add_argument("--commands", type=int, default=5000, help="commands to time per workload")
+    parser.add_argument("--warmup", type=int, default=200, help="commands to run before timing each workload")
+    parser.add_argument("--repeat", type=int, default=1, help="run each workload this many times and keep the fastest run")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="file to write the results to (JSON)")
+    parser.add_argument("--compare", default=None, help="results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare != None:
+        baseline = json.loads(Path(args.compare).read_text())
+    run = RunBenchmarks(args.world, args.workload, args.commands, args.warmup, args.repeat)
+    PrintResults(run, baseline)
+    Path(args.output).write_text(json.dumps(run, indent=2) + "\n")
+    print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    Main()
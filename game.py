@@ -4,31 +4,408 @@
 # You probably don't need to modify this file unless you want to change something about the deep logic of the game
 
 import json
+import heapq
+import string
+import copy
 import action_handlers
 import globals
 import item_handlers
 import location_handlers
 import textwrap
-import pickle
+import save_format
+import sys
+import threading
+import collections
+import functools
+import bisect
+import time
+import base64
+import hashlib
+import itertools
+import os
+import types
+import world_bundle
 from pathlib import Path
 
+######################### INPUT/OUTPUT #########################
+
+
+# The game never calls input() or print() itself: each session reads and writes through an I/O object, so the same
+#  game can run on a console, behind a socket, in tests or in replays. An I/O object needs two methods:
+#   ReadLine(prompt) shows the prompt and returns the player's next command (raising EOFError if there are no more)
+#   Write(text) sends text to the player (the game writes each turn's output in one call)
+
+# I/O for playing in a terminal
+class ConsoleIO:
+    def ReadLine(self, prompt):
+        return input(prompt)
+
+    def Write(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
+# I/O that keeps everything written in memory, and takes commands from a list (useful for tests and replays)
+class BufferIO:
+    def __init__(self, commands = None):
+        self.commands = list(commands) if commands != None else []
+        self.command_index = 0
+        self.written = []
+
+    def ReadLine(self, prompt):
+        self.written.append(prompt)
+        if self.command_index >= len(self.commands):
+            raise EOFError
+        command = self.commands[self.command_index]
+        self.command_index += 1
+        self.written.append(command + "\n")
+        return command
+
+    def Write(self, text):
+        self.written.append(text)
+
+    # Returns (and forgets) everything written so far
+    def TakeOutput(self):
+        output = "".join(self.written)
+        self.written = []
+        return output
+
+
+######################### LAYOUT #########################
+
+
+# Everything the game prints is wrapped to the session's width, a line at a time. Most of it is the same text turn
+#  after turn (room and item descriptions, standard responses), so wrapped lines are kept in a bounded LRU cache
+#  shared by all sessions.
+DEFAULT_WIDTH = 75
+LAYOUT_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def WrapLine(line, width):
+    return textwrap.fill(line, width) + "\n"
+
+
+######################### TURN TIMING #########################
+
+
+# Turn timing is off unless Engine.EnableTurnTiming() is called. Then each turn is split into phases, and each phase
+#  is timed without the phases nested inside it (e.g. a ParseItem() called from an item handler counts as parse_item):
+#   unknown_words      ActionsMaster.CheckForUnknownWords()
+#   parse_item         ActionsMaster.ParseItem()
+#   when_here_handler  the location's when_here_handler
+#   item_handler       the items' handlers
+#   action_handler     the action's handler (or the built in move and LOOK, including any enter_handler they call)
+#   events             EventsMaster.CheckEvents()
+#   output             sending the turn's output to the player (Context.Flush())
+#   other              everything else: the parser itself, default responses, restarts and so on
+# Every turn slower than the slow turn threshold is logged with its command and this breakdown, and the engine keeps
+#  a histogram of each phase's time per turn (see TurnTimer.Stats()).
+TURN_PHASES = ["unknown_words", "parse_item", "when_here_handler", "item_handler", "action_handler", "events", "output", "other"]
+DEFAULT_SLOW_TURN_MS = 100
+
+# The upper bounds (in microseconds) of the histogram buckets; the last bucket holds everything slower
+HISTOGRAM_BOUNDS_US = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000]
+
+
+# The phase times of the turn that is running
+class TurnTiming:
+    def __init__(self, command, turn_number):
+        self.command = command
+        self.turn_number = turn_number
+        self.phases = {}
+        self.nested_times = []
+        self.start_time = time.perf_counter()
+
+    # Calls func(*args) as part of a phase, adding its time (less that of any phases nested in it) to the phase.
+    #  (If func raises an exception the turn's timings are simply dropped, as the turn never finishes.)
+    def Call(self, phase, func, args):
+        nested_times = self.nested_times
+        nested_times.append(0.0)
+        start_time = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start_time
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed - nested_times.pop()
+        if nested_times:
+            nested_times[-1] += elapsed
+        return result
+
+
+# Keeps the timings of all of an engine's turns (its sessions may run in several threads), and logs the slow ones
+class TurnTimer:
+    def __init__(self, slow_turn_ms = DEFAULT_SLOW_TURN_MS, log_path = None):
+        self.slow_turn_ms = slow_turn_ms
+        self.log_file = sys.stderr if log_path == None else open(log_path, "a", buffering=1)
+        self.lock = threading.Lock()
+        self.turn_count = 0
+        self.slow_turn_count = 0
+        self.histograms = {}
+        self.total_times = {}
+        for phase in ["turn"] + TURN_PHASES:
+            self.histograms[phase] = [0] * (len(HISTOGRAM_BOUNDS_US) + 1)
+            self.total_times[phase] = 0.0
+
+    # Records a finished turn (this runs every turn, so it is kept lean)
+    def FinishTurn(self, timing):
+        turn_time = time.perf_counter() - timing.start_time
+        phases = timing.phases
+        phases["other"] = max(0.0, turn_time - sum(phases.values()))
+        phases["turn"] = turn_time
+        histograms = self.histograms
+        total_times = self.total_times
+        with self.lock:
+            self.turn_count += 1
+            for phase, phase_time in phases.items():
+                histograms[phase][bisect.bisect_left(HISTOGRAM_BOUNDS_US, 1000000 * phase_time)] += 1
+                total_times[phase] += phase_time
+            if 1000 * turn_time >= self.slow_turn_ms:
+                self.slow_turn_count += 1
+                del phases["turn"]
+                self.LogSlowTurn(timing, turn_time, phases)
+
+    def LogSlowTurn(self, timing, turn_time, phases):
+        breakdown = ["%s %.1fms" % (phase, 1000 * phase_time) for phase, phase_time in sorted(phases.items(), key=lambda p: -p[1])]
+        self.log_file.write("SLOW TURN: %.1fms for %s (turn %d): %s\n" % (1000 * turn_time, json.dumps(timing.command), timing.turn_number, ", ".join(breakdown)))
+
+    # Returns the timings so far as plain data: for each phase (and the whole turn), the number of turns it ran in,
+    #  its total time, and a histogram of its time per turn (counts for the buckets in "bounds_us", then a count of
+    #  slower ones)
+    def Stats(self):
+        with self.lock:
+            stats = {}
+            stats["turns"] = self.turn_count
+            stats["slow_turns"] = self.slow_turn_count
+            stats["slow_turn_ms"] = self.slow_turn_ms
+            stats["bounds_us"] = list(HISTOGRAM_BOUNDS_US)
+            stats["phases"] = {}
+            for phase in self.histograms:
+                phase_stats = {}
+                phase_stats["turns"] = sum(self.histograms[phase])
+                phase_stats["total_ms"] = 1000 * self.total_times[phase]
+                phase_stats["histogram"] = list(self.histograms[phase])
+                stats["phases"][phase] = phase_stats
+            return stats
+
+# Adds up the Stats() of several timers (e.g. one per worker process)
+def MergeTimingStats(stats_list):
+    merged = None
+    for stats in stats_list:
+        if stats == None:
+            continue
+        if merged == None:
+            merged = copy.deepcopy(stats)
+            continue
+        merged["turns"] += stats["turns"]
+        merged["slow_turns"] += stats["slow_turns"]
+        for phase, phase_stats in stats["phases"].items():
+            merged_phase = merged["phases"][phase]
+            merged_phase["turns"] += phase_stats["turns"]
+            merged_phase["total_ms"] += phase_stats["total_ms"]
+            merged_phase["histogram"] = [a + b for a, b in zip(merged_phase["histogram"], phase_stats["histogram"])]
+    return merged
+
+# Returns the histogram bucket bound that a percentile of the turns falls under ("+" past the last bound)
+def HistogramPercentile(bounds_us, histogram, percent):
+    rank = (sum(histogram) * percent + 99) // 100
+    count = 0
+    for index, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if (count >= rank) and (bucket_count > 0):
+            return "<" + str(bounds_us[index]) if index < len(bounds_us) else ">" + str(bounds_us[-1])
+    return "-"
+
+# Returns a table of the timings in Stats() (or MergeTimingStats()), with the mean time of each phase per turn and
+#  its p50/p99 (as histogram buckets, in microseconds)
+def FormatTimingStats(stats):
+    lines = [str(stats["turns"]) + " turns, " + str(stats["slow_turns"]) + " over " + str(stats["slow_turn_ms"]) + "ms"]
+    lines.append("%-18s %8s %10s %10s %10s" % ("phase", "turns", "mean us", "p50 us", "p99 us"))
+    for phase, phase_stats in stats["phases"].items():
+        if phase_stats["turns"] == 0:
+            continue
+        lines.append("%-18s %8d %10.1f %10s %10s" % (phase, phase_stats["turns"], 1000 * phase_stats["total_ms"] / phase_stats["turns"],
+                                                   HistogramPercentile(stats["bounds_us"], phase_stats["histogram"], 50),
+                                                   HistogramPercentile(stats["bounds_us"], phase_stats["histogram"], 99)))
+    return "\n".join(lines)
+
+
+######################### HANDLER PROFILING #########################
+
+
+# Handler profiling is off unless Engine.EnableHandlerProfiling() is called. Then every handler registered through
+#  AddActionHandler(), AddItemHandler(), AddItemLookHandler(), AddEnterHandler(), AddWhenHereHandler() or
+#  AddLookHandler() is wrapped, and each call is recorded: how many times each handler is called, how often it returns
+#  True (i.e. it handled the command), and its time, both in total and without the handlers it calls. The own time of
+#  every chain of handlers calling handlers is kept too, for flame graphs (see CollapsedStacks()).
+# A handler is named by its function, plus the kind of handler and what it is registered on, e.g.
+#  "item_handlers.Coin [item COIN]".
+
+class HandlerProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        # handler name -> [calls, calls that returned True, total time, own time]
+        self.handlers = {}
+
+        # chain of handler names joined by ";" (outermost first) -> own time of the last handler in the chain
+        self.stacks = {}
+
+    # Returns a function that calls handler and records the call
+    def Wrap(self, kind, entry_key, handler):
+        name = getattr(handler, "__module__", "?") + "." + getattr(handler, "__qualname__", repr(handler)) + " [" + kind + " " + entry_key + "]"
+        def ProfiledHandler(*args):
+            return self.Call(name, handler, args)
+        ProfiledHandler.handler = handler
+        return ProfiledHandler
+
+    def Call(self, name, handler, args):
+        frames = getattr(self.local, "frames", None)
+        if frames == None:
+            frames = self.local.frames = []
+        frames.append([name, 0.0])
+        result = None
+        start_time = time.perf_counter()
+        try:
+            result = handler(*args)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start_time
+            stack = ";".join(frame[0] for frame in frames)
+            own_time = elapsed - frames.pop()[1]
+            if frames:
+                frames[-1][1] += elapsed
+            with self.lock:
+                record = self.handlers.get(name)
+                if record == None:
+                    record = self.handlers[name] = [0, 0, 0.0, 0.0]
+                record[0] += 1
+                if result == True:
+                    record[1] += 1
+                record[2] += elapsed
+                record[3] += own_time
+                self.stacks[stack] = self.stacks.get(stack, 0.0) + own_time
+
+    # Returns everything recorded so far as plain data (which MergeHandlerProfiles() can add up)
+    def Profile(self):
+        with self.lock:
+            profile = {}
+            profile["handlers"] = {name: list(record) for name, record in self.handlers.items()}
+            profile["stacks"] = dict(self.stacks)
+            return profile
+
+# Adds up the Profile() of several profilers (e.g. one per worker process)
+def MergeHandlerProfiles(profiles):
+    merged = None
+    for profile in profiles:
+        if profile == None:
+            continue
+        if merged == None:
+            merged = copy.deepcopy(profile)
+            continue
+        for name, record in profile["handlers"].items():
+            merged_record = merged["handlers"].setdefault(name, [0, 0, 0.0, 0.0])
+            for index in range(len(record)):
+                merged_record[index] += record[index]
+        for stack, own_time in profile["stacks"].items():
+            merged["stacks"][stack] = merged["stacks"].get(stack, 0.0) + own_time
+    return merged
+
+# Returns a table of the handlers in a profile that took the most time (limit = None for all of them)
+def FormatHandlerProfile(profile, limit = 20):
+    records = sorted(profile["handlers"].items(), key=lambda item: -item[1][2])
+    lines = ["%10s %8s %12s %12s %10s  %s" % ("calls", "true %", "total ms", "own ms", "mean us", "handler")]
+    for name, (calls, true_count, total_time, own_time) in records[:limit]:
+        lines.append("%10d %8.1f %12.1f %12.1f %10.1f  %s" % (calls, 100 * true_count / calls, 1000 * total_time, 1000 * own_time,
+                                                            1000000 * total_time / calls, name))
+    return "\n".join(lines)
+
+# Returns a profile's stacks in the collapsed format that flame graph tools read ("outer;inner <count>" per line),
+#  with each stack's own time in microseconds as its count
+def CollapsedStacks(profile):
+    lines = []
+    for stack, own_time in sorted(profile["stacks"].items()):
+        lines.append(stack + " " + str(int(round(1000000 * own_time))))
+    return "\n".join(lines) + "\n"
+
+
 ######################### CONTEXT #########################
 
 
-# This class is a package of all of the major object containers which can easily be passed to action handlers
+# This class is a package of all of the major object containers which can easily be passed to action handlers.
+# Each game session has its own context, and every master object refers back to the context it belongs to
+#  (rather than to module globals), so any number of sessions can run side by side in one process.
 class Context:
-    def __init__(self, player, locations, actions, items, state, events):
+    def __init__(self, player, locations, actions, items, state, events, engine = None, io = None, save_dir = None):
+        self.engine = engine
+        self.io = io
+        self.save_dir = save_dir
+        self.saves_enabled = True
+        self.width = DEFAULT_WIDTH
+        self.output = []
+        self.pending_prompt = None
+        self.turn_timing = None
+        self.transcript = None
+        self.SetMasters(player, locations, actions, items, state, events)
+
+    # Binds this session to a set of master objects (e.g. a freshly loaded world on restart)
+    def SetMasters(self, player, locations, actions, items, state, events):
         self.player = player
         self.locations = locations
         self.actions = actions
         self.items = items
         self.state = state
         self.events = events
+        for master in [player, locations, actions, items, state, events]:
+            master.context = self
 
+    # Everything the game prints for a turn is collected here, and sent to the player in one write by Flush()
+    def Write(self, text):
+        self.output.append(text)
+
+    # Writes text wrapped to this session's width (which can be changed at any time, e.g. to suit a client's screen)
     def Print(self, print_string):
-        strings = print_string.split('\n')
-        for string in strings:
-            print(textwrap.fill(string, 75))
+        for line in print_string.split('\n'):
+            self.output.append(WrapLine(line, self.width))
+
+    # Sends this turn's output to the I/O object (if the session has one), and returns it
+    def Flush(self):
+        output = "".join(self.output)
+        self.output = []
+        if output and (self.io != None):
+            self.io.Write(output)
+        return output
+
+    # Starts recording this session's game to a transcript file (see TRANSCRIPTS). Call it before StartGame() to record
+    #  the whole game; if the game has already begun, the transcript starts from a copy of the session as it is now.
+    def StartRecording(self, path, from_start = False):
+        recorder = TranscriptRecorder(path, self.width)
+        try:
+            recorder.WriteHeader(self, None if from_start else self.SerializeSession())
+        except OSError as e:
+            sys.stderr.write("ERROR: couldn't start the transcript " + str(path) + ": " + str(e) + "\n")
+            return
+        self.transcript = recorder
+
+    # Adds a turn to the transcript (a transcript that can't be written stops, rather than ending the game). Transcript
+    #  errors go to stderr, like slow turns, since the game only talks to the player through the session's I/O.
+    def RecordTranscript(self, record_func, *args):
+        try:
+            record_func(self, *args)
+        except OSError as e:
+            sys.stderr.write("ERROR: couldn't write to the transcript " + str(self.transcript.path) + ": " + str(e) + "\n")
+            self.transcript = None
+
+    # Calls func(*args) as part of a phase of the turn (see TURN TIMING), or just calls it if turn timing is off
+    def CallTimed(self, phase, func, *args):
+        if self.turn_timing == None:
+            return func(*args)
+        return self.turn_timing.Call(phase, func, args)
+
+    # Returns the handler to register for an item, location or action: the handler itself, or a wrapper that records
+    #  its calls if the engine is profiling handlers (see HANDLER PROFILING)
+    def ProfileHandler(self, kind, entry_key, handler):
+        if (self.engine == None) or (self.engine.handler_profiler == None) or (handler == None):
+            return handler
+        return self.engine.handler_profiler.Wrap(kind, entry_key, handler)
 
     def PrintItemInString(self, default_string, item):
         default_string = default_string.replace("@", "the " + item.get("name"))
@@ -36,72 +413,115 @@ class Context:
             default_string = "T" + default_string[1:]
         self.Print(default_string)
 
-    # Prompts the user to enter a slot to save their game.
-    # If the boolean argument is set to true, the user's entered slot must already exist
-    def PromptForFilename(self, slot_must_exist = False):
-        # Determine path
-        filepath = Path.cwd() / "save_data"
+    # Returns the directory for this session's saves (save_data, unless the session was given its own), creating it if necessary
+    def SaveDirectory(self):
+        filepath = Path.cwd() / "save_data" if self.save_dir == None else Path(self.save_dir)
         if (not filepath.exists()) or (not filepath.is_dir()):
-            filepath.mkdir(parents=False, exist_ok=True)
+            filepath.mkdir(parents=(self.save_dir != None), exist_ok=True)
+        return filepath
 
-        # Display saves
-        slots_str = "Save slots used (* = most recent): "
+    # Returns the list of slots that hold a save, and the most recently saved slot
+    def ListSaveSlots(self):
+        filepath = self.SaveDirectory()
         most_recent_time = 0
         most_recent_slot = None
         slots_used = []
         for i in range(20):
-            slot_file = filepath / ("game_data" + ("0" if i < 10 else "") + str(i) + ".pickle")
-            if slot_file.exists():
-                slots_used.append(i)
-                if slot_file.stat().st_mtime > most_recent_time:
-                    most_recent_time = slot_file.stat().st_mtime
-                    most_recent_slot = i
+            for slot_file in [self.SlotFilepath(filepath, i), self.SlotFilepath(filepath, i, legacy = True)]:
+                if slot_file.exists():
+                    if not i in slots_used:
+                        slots_used.append(i)
+                    if slot_file.stat().st_mtime > most_recent_time:
+                        most_recent_time = slot_file.stat().st_mtime
+                        most_recent_slot = i
+        return slots_used, most_recent_slot
+
+    # Shows the save slots and asks the user to enter one. The next command the user types is the answer, and is passed
+    #  to answer_func. If slot_must_exist is set to true, the user's entered slot must already exist.
+    def PromptForSlot(self, answer_func, slot_must_exist = False):
+        slots_used, most_recent_slot = self.ListSaveSlots()
+        slots_str = "Save slots used (* = most recent): "
         for i in slots_used:
             slots_str += ("*" if most_recent_slot == i else " ") + str(i) + " "
-        Print(slots_str)
-
-        # Prompt for slot number
-        user_slot = input("  Enter save slot (1-20) [blank = cancel] >> ")
-        Print("")
+        self.Print(slots_str)
+        self.pending_prompt = (answer_func, slot_must_exist)
 
-        # Is it valid?
+    # Returns the save file for the slot the user entered, or None if it isn't valid
+    def SlotFromAnswer(self, user_slot, slot_must_exist = False):
+        filepath = self.SaveDirectory()
+        user_slot = user_slot.strip()
         if (not user_slot.isdigit()) or (int(user_slot) < 1) or (int(user_slot) > 20):
             return None
 
-        if slot_must_exist and not int(user_slot) in slots_used:
+        if slot_must_exist and not int(user_slot) in self.ListSaveSlots()[0]:
             return None
 
-        return filepath / ("game_data" + ("0" if int(user_slot) < 10 else "") + user_slot + ".pickle")
+        # Slots saved before the current save format was introduced are still old pickle files
+        slot_file = self.SlotFilepath(filepath, int(user_slot))
+        if slot_must_exist and not slot_file.exists():
+            slot_file = self.SlotFilepath(filepath, int(user_slot), legacy = True)
+        return slot_file
+
+    # Returns the path of the file for a save slot (legacy = the old pickle file for that slot)
+    def SlotFilepath(self, filepath, slot, legacy = False):
+        return filepath / ("game_data" + ("0" if slot < 10 else "") + str(slot) + (".pickle" if legacy else ".sav"))
 
     # Simple encryption so our save files don't include strings that give away game elements
+    # (a Caesar shift of the letters, done through a translation table that is built once per offset)
+    cipher_tables = {}
+
+    def GetCipherTable(self, offset):
+        table = Context.cipher_tables.get(offset)
+        if table == None:
+            shift = offset % 26
+            upper = string.ascii_uppercase
+            lower = string.ascii_lowercase
+            table = str.maketrans(upper + lower, upper[shift:] + upper[:shift] + lower[shift:] + lower[:shift])
+            Context.cipher_tables[offset] = table
+        return table
+
     def EncryptString(self, text, offset):
-        result = ""
-        for i in range(len(text)):
-            char = text[i]
-            if not char.isalpha():
-                result += char
-            elif char.isupper():
-                result += chr((ord(char) + offset - 65) % 26 + 65)
-            else:
-                result += chr((ord(char) + offset - 97) % 26 + 97)
-        return result
+        return text.translate(self.GetCipherTable(offset))
 
+    # Encrypts every string (including dictionary keys) in a tree of dicts and lists, without recursion.
+    # Lists that hold no strings, lists or dicts (e.g. a list of numbers) are reused rather than copied.
     def DoEncryptObject(self, obj, offset):
-        if isinstance(obj,dict):
-            encrypted = {}
-            for key in obj.keys():
-                encrypted[self.EncryptString(key,offset)] = self.DoEncryptObject(obj[key], offset)
-            return encrypted
-        elif isinstance(obj,list):
-            encrypted = []
-            for entry in obj:
-                encrypted.append(self.DoEncryptObject(entry, offset))
-            return encrypted
-        elif isinstance(obj,str):
-            return self.EncryptString(obj, offset)
-        else:
+        table = self.GetCipherTable(offset)
+        if isinstance(obj, str):
+            return obj.translate(table)
+        if not isinstance(obj, (dict, list)):
             return obj
 
+        encrypted_root = {} if isinstance(obj, dict) else []
+        stack = [(obj, encrypted_root)]
+        while stack:
+            source, encrypted = stack.pop()
+            if isinstance(source, dict):
+                entries = source.items()
+            else:
+                entries = enumerate(source)
+            for key, value in entries:
+                if isinstance(value, str):
+                    value = value.translate(table)
+                elif isinstance(value, dict):
+                    encrypted_value = {}
+                    stack.append((value, encrypted_value))
+                    value = encrypted_value
+                elif isinstance(value, list):
+                    for entry in value:
+                        if isinstance(entry, (str, dict, list)):
+                            encrypted_value = []
+                            stack.append((value, encrypted_value))
+                            value = encrypted_value
+                            break
+                if isinstance(encrypted, dict):
+                    if isinstance(key, str):
+                        key = key.translate(table)
+                    encrypted[key] = value
+                else:
+                    encrypted.append(value)
+        return encrypted_root
+
     def EncryptObject(self, obj):
         return self.DoEncryptObject(obj,9)
 
@@ -110,19 +530,50 @@ class Context:
 
     # This is part one of the restore process: attempt to load a save from file. If successful,
     #  a restore package is returned.
-    def LoadRestorePackage(self):
-        filepath = self.PromptForFilename(True)
+    def LoadRestorePackage(self, filepath):
         if not filepath:
-            Print("Restore cancelled.")
+            self.Print("Restore cancelled.")
             return None
-        save_state = {}
-        events_list = []
-        with open(filepath, "rb") as f:
-            save_state = pickle.load(f)
-            events_list = pickle.load(f)
-        if save_state:
-            return [self.DecryptObject(save_state), self.DecryptObject(events_list)]
-        return None
+        try:
+            sections = save_format.ReadSaveFile(filepath)
+            save_state = {}
+            for section_name in ["player", "locations", "items", "state"]:
+                save_state[section_name] = self.DecryptObject(sections[section_name])
+            restore_package = [save_state, self.DecryptObject(sections["events"])]
+            self.CheckRestorePackage(restore_package)
+        except (save_format.SaveFormatError, OSError) as e:
+            self.Print("Restore failed: " + str(e))
+            return None
+        return restore_package
+
+    # Checks that a restore package fits this world, so that a save from another version of the game fails before
+    #  the session is reset rather than part way through setting it up (raises SaveFormatError). Its events are
+    #  turned back into Event objects here, which checks that their functions still exist.
+    def CheckRestorePackage(self, restore_package):
+        save_state = restore_package[0]
+        restore_package[1] = [Event.Deserialize(record) for record in restore_package[1]]
+
+        saved_items = save_state["items"]
+        for item_key in saved_items:
+            if (not item_key in self.items.items_dictionary) and (not "words" in saved_items[item_key]):
+                raise save_format.SaveFormatError("save file refers to an unknown item: " + str(item_key))
+        for loc_key in save_state["locations"]:
+            if not loc_key in self.locations.locations_dictionary:
+                raise save_format.SaveFormatError("save file refers to an unknown location: " + str(loc_key))
+        player_location = save_state["player"].get("location")
+        if player_location and (not player_location in self.locations.locations_dictionary):
+            raise save_format.SaveFormatError("save file refers to an unknown location: " + str(player_location))
+
+        # Every item the save puts somewhere must be in the world, or be one of the save's own added items
+        item_lists = [save_state["player"].get("inventory", [])]
+        for loc_key in save_state["locations"]:
+            item_lists.append(save_state["locations"][loc_key].get("items", []))
+        for item_key in saved_items:
+            item_lists.append(saved_items[item_key].get("contents", []))
+        for item_list in item_lists:
+            for item_key in item_list:
+                if (not item_key in self.items.items_dictionary) and (not item_key in saved_items):
+                    raise save_format.SaveFormatError("save file refers to an unknown item: " + str(item_key))
 
     # Method is called during a restore, when a save has been successfully loaded from disk
     # All initialization of player, items, locations, etc MUST have already taken place
@@ -139,27 +590,235 @@ class Context:
         for key in save_state["state"].keys():
             self.state.__dict__[key] = save_state["state"][key]
         for item_key in save_state["items"].keys():
+            if not item_key in self.items.items_dictionary:
+                # This item was added while the game was running, so it isn't in the freshly loaded world
+                self.items.RestoreItem(item_key, save_state["items"][item_key])
+                continue
             for attr_key in save_state["items"][item_key].keys():
                 self.items[item_key][attr_key] = save_state["items"][item_key][attr_key]
         for loc_key in save_state["locations"].keys():
             for attr_key in save_state["locations"][loc_key].keys():
                 self.locations[loc_key][attr_key] = save_state["locations"][loc_key][attr_key]
-        self.events.events = events_list
-
+        self.events.Deserialize(events_list)
+        self.items.RebuildHolders()
+
+    # Writes the game to a save file without asking the user anything (raises SaveFormatError or OSError if it fails)
+    def WriteSave(self, filepath):
+        save_state = self.SaveSections()
+        sections = {}
+        for section_name in save_state:
+            sections[section_name] = self.EncryptObject(save_state[section_name])
+        save_format.WriteSaveFile(filepath, sections)
+
+    # Returns the sections of a save (see save_format.SAVE_SCHEMA), before encryption
+    def SaveSections(self):
+        sections = {}
+        sections["player"] = self.player.Serialize()
+        sections["locations"] = self.locations.Serialize()
+        sections["items"] = self.items.Serialize()
+        sections["state"] = self.state.Serialize()
+        sections["events"] = self.events.Serialize()
+        return sections
+
+    # Packs up the whole running session (a save plus everything a save leaves out, like a pending question or
+    #  what "AGAIN" would repeat), so it can be moved to another process or put aside. Engine.LoadSession() unpacks it.
+    def SerializeSession(self, compress = True):
+        sections = self.SaveSections()
+        session = {"state": self.state.SerializeTransient()}
+        if self.pending_prompt != None:
+            session["prompt"] = [self.pending_prompt[0].__name__, self.pending_prompt[1]]
+        if self.save_dir != None:
+            session["save_dir"] = str(self.save_dir)
+        if self.width != DEFAULT_WIDTH:
+            session["width"] = self.width
+        if self.transcript != None:
+            session["transcript"] = str(self.transcript.path)
+        sections["session"] = session
+        return save_format.EncodeSave(sections, compress, save_format.SESSION_SCHEMA)
+
+    # Returns roughly how many bytes of memory this session holds of its own (its masters, with their overlays, events
+    #  and so on), leaving out the shared world they are overlaid on. It follows the objects the session refers to, so
+    #  it costs about as much as the session is big; SessionManager uses it now and then to keep within its budget.
+    def MemorySize(self):
+        shared = [self, self.engine, self.io, self.locations.pristine, self.items.pristine, self.items.static_holders,
+                  self.items.static_inventory, self.actions.dispatch_table]
+        if self.items.indexes_shared:
+            shared.extend([self.items.word_index, self.items.item_order])
+        if self.items.lexicon.shared:
+            shared.append(self.items.lexicon.roles)
+        return DeepSizeOf(list(self.__dict__.values()), shared)
+
+    # Asks for a save slot; the game is saved once the user answers
+    # (Sessions that don't own a save directory, like the stateless HTTP ones, turn saving off with saves_enabled.)
     def SaveGame(self):
-        filepath = self.PromptForFilename(False)
+        if not self.saves_enabled:
+            self.Print("Saving isn't available in this game.")
+            return
+        self.PromptForSlot(self.SaveToSlot)
+
+    def SaveToSlot(self, user_slot):
+        filepath = self.SlotFromAnswer(user_slot)
         if not filepath:
-            Print("Save cancelled.")
+            self.Print("Save cancelled.")
+            return
+        try:
+            self.WriteSave(filepath)
+        except (save_format.SaveFormatError, OSError) as e:
+            self.Print("Save failed: " + str(e))
             return
-        save_state = {}
-        save_state["player"] = self.player.Serialize()
-        save_state["locations"] = locations.Serialize()
-        save_state["items"] = items.Serialize()
-        save_state["state"] = self.state.Serialize()
-        with open(filepath, "wb") as f:
-            pickle.dump( self.EncryptObject(save_state), f)
-            pickle.dump(self.EncryptObject(self.events.Serialize()), f)
-        Print("Game saved.")
+
+        # This slot is now in the current format, so any old pickle save in it is out of date
+        legacy_filepath = filepath.with_suffix(".pickle")
+        if legacy_filepath.exists():
+            legacy_filepath.unlink()
+        self.Print("Game saved.")
+
+    # Asks for a save slot to restore; the game is restored once the user answers
+    def RestoreGame(self):
+        if not self.saves_enabled:
+            self.Print("Restoring isn't available in this game.")
+            return
+        self.PromptForSlot(self.RestoreFromSlot, True)
+
+    def RestoreFromSlot(self, user_slot):
+        restore_package = self.LoadRestorePackage(self.SlotFromAnswer(user_slot, True))
+        if restore_package:
+            self.engine.ResetSession(self)
+            self.SetUpGame(restore_package)
+
+    # Begins the session's game, returning the introduction and the description of the starting location
+    def StartGame(self):
+        self.SetUpGame()
+        output = self.Flush()
+        if self.transcript != None:
+            self.RecordTranscript(self.transcript.RecordStart, output)
+        return output
+
+    # Sets up a new game (or a restored one, if a restore package is passed in) and describes the starting location
+    def SetUpGame(self, restore_package = None):
+        globals.InitialSetup(self)
+        if restore_package:
+            self.ProcessRestorePackage(restore_package)
+        else:
+            globals.IntroText(self)
+        self.locations.DoLook()
+
+    # Returns the prompt to show before the user's next command
+    def Prompt(self):
+        if self.pending_prompt != None:
+            return "  Enter save slot (1-20) [blank = cancel] >> "
+        return "\n> "
+
+    # Has the user quit?
+    def IsFinished(self):
+        return self.state.quit_confirmed
+
+    # Runs one turn: the command is either the answer to a pending prompt (e.g. a save slot) or a new command.
+    # Returns everything printed during the turn (which is also sent to the session's I/O object, if it has one).
+    def RunTurn(self, command):
+        if self.transcript == None:
+            return self.PlayTurn(command)
+
+        # A turn that crashes is recorded too (with no output), so the crash can be reproduced
+        turn_number = self.state.turn_counter
+        answered_prompt = self.pending_prompt != None
+        try:
+            output = self.PlayTurn(command)
+        except Exception:
+            self.RecordTranscript(self.transcript.RecordTurn, turn_number, command, answered_prompt, None)
+            raise
+        self.RecordTranscript(self.transcript.RecordTurn, turn_number, command, answered_prompt, output)
+        return output
+
+    def PlayTurn(self, command):
+        turn_timer = self.engine.turn_timer if self.engine != None else None
+        self.turn_timing = TurnTiming(command, self.state.turn_counter) if turn_timer != None else None
+        if self.pending_prompt != None:
+            answer_func = self.pending_prompt[0]
+            self.pending_prompt = None
+            self.Print("")
+            answer_func(command)
+        else:
+            self.actions.ParseCommand(command)
+            if self.state.restore_requested:
+                self.RestoreGame()
+
+        # A command that asks a question (e.g. SAVE asking for a slot) only finishes its turn once it has been answered
+        if self.pending_prompt == None:
+            self.state.PostProcess()
+            self.state.restore_requested = False
+
+        if self.state.restart_confirmed:
+            self.engine.ResetSession(self)
+            self.SetUpGame()
+        output = self.CallTimed("output", self.Flush)
+        if turn_timer != None:
+            turn_timer.FinishTurn(self.turn_timing)
+            self.turn_timing = None
+        return output
+
+# Returns roughly how many bytes objects take up, counting everything they refer to through lists, dictionaries, sets,
+#  tuples and attributes (each object once), except functions, classes, modules and the objects in skip
+def DeepSizeOf(objects, skip = ()):
+    seen = set(id(obj) for obj in skip)
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if (id(obj) in seen) or callable(obj) or isinstance(obj, types.ModuleType):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            # (dict's own methods, so a WorldEntry's shared fields aren't counted)
+            stack.extend(dict.keys(obj))
+            stack.extend(dict.values(obj))
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+    return size
+
+
+######################### LEXICON #########################
+
+
+# This class maps every word the parser knows to the roles it can play in a command.
+# It is built once when the world is loaded, so checking a word is a single dictionary lookup.
+class Lexicon:
+    VERB = "verb"
+    PREPOSITION = "preposition"
+    NOUN = "noun"
+    ADJECTIVE = "adjective"
+    STOPWORD = "stopword"
+
+    # (If roles is shared with other games, pass shared = True: the lexicon then copies it before adding any words.)
+    def __init__(self, roles = None, shared = False):
+        self.roles = roles if roles != None else {}
+        self.shared = shared
+
+    # Register a word under a role (a word can have several roles, e.g. "IN" is both a verb and a preposition)
+    def AddWord(self, word, role):
+        if self.shared:
+            self.roles = {known_word: set(word_roles) for known_word, word_roles in self.roles.items()}
+            self.shared = False
+        word_roles = self.roles.get(word)
+        if word_roles == None:
+            self.roles[word] = {role}
+        else:
+            word_roles.add(role)
+
+    def AddWords(self, words, role):
+        for word in words:
+            self.AddWord(word, role)
+
+    def HasRole(self, word, role):
+        word_roles = self.roles.get(word)
+        return (word_roles != None) and (role in word_roles)
+
+    # Is this a word the parser understands? (numbers are always understood)
+    def IsKnown(self, word):
+        return (word in self.roles) or word.isdigit()
 
 
 ######################### TOKEN #########################
@@ -178,29 +837,33 @@ class Token:
 
 # This class contains player status information
 class Player:
-    def __init__(self):
+    def __init__(self, inventory = None):
+        self.context = None
         self.hp = 100
-        self.inventory = []
+        self.inventory = inventory if inventory != None else []
         self.location = ""
 
     def Serialize(self):
-        return self.__dict__
+        serialize_dict = dict(self.__dict__)
+        del serialize_dict["context"]
+        return serialize_dict
 
     def IsAlive(self):
         return self.hp > 0
 
     def SetPlayerLocation(self, new_location):
         self.location = new_location
+        self.context.items.InvalidateScope()
 
     def GetPlayerLocation(self):
-        return locations[self.location]
+        return self.context.locations[self.location]
 
     def Kill(self, death_text = "*** YOU HAVE DIED! ***"):
         if death_text:
-            Print("\n" + death_text)
-        Print("")
-        Print("Do you want to restart (Y/N)?")
-        state.restart_pending = True
+            self.context.Print("\n" + death_text)
+        self.context.Print("")
+        self.context.Print("Do you want to restart (Y/N)?")
+        self.context.state.restart_pending = True
         self.hp = 0
 
 
@@ -211,6 +874,7 @@ class Player:
 class State:
     def __init__(self):
         # Start by setting all non-serialized state vars (stuff you don't want saved/restored)
+        self.context = None
         self.quit_confirmed = False
         self.quit_pending = False
         self.restart_confirmed = False
@@ -240,6 +904,25 @@ class State:
                 serialize_dict[key] = self.__dict__[key]
         return serialize_dict
 
+    # Returns the non-serialized state vars that a running session needs (but a save leaves out), as plain data
+    def SerializeTransient(self):
+        transient = {}
+        for key in self.nonserialize_attributes:
+            if key == "context":
+                continue
+            value = self.__dict__[key]
+            if key in ["this_parsed_command", "last_parsed_command"]:
+                value = [None if token == None else [token.type, token.key, token.user_words] for token in value]
+            transient[key] = value
+        return transient
+
+    def DeserializeTransient(self, transient):
+        for key in transient:
+            value = transient[key]
+            if key in ["this_parsed_command", "last_parsed_command"]:
+                value = [None if token == None else Token(token[0], token[1], token[2]) for token in value]
+            self.__dict__[key] = value
+
     def ClearPending(self):
         self.quit_pending = False
         self.restart_pending = False
@@ -252,8 +935,8 @@ class State:
 
     # This is called at the end of each turn; it remembers this period's user input and commands for recall next period
     def PostProcess(self):
-        if self.parse_successful and (not state.restart_pending) and (not state.quit_pending) and (not state.restore_requested):
-            events.CheckEvents(self.turn_counter)
+        if self.parse_successful and (not self.restart_pending) and (not self.quit_pending) and (not self.restore_requested):
+            self.context.CallTimed("events", self.context.events.CheckEvents, self.turn_counter)
             self.turn_counter += 1
             self.last_parsed_command = self.this_parsed_command
             self.last_user_input = self.this_user_input
@@ -263,164 +946,557 @@ class State:
             self.disambiguate_list = []
 
 
+######################### WORLD ENTRIES #########################
+
+
+# Each location, item and action is stored as a WorldEntry: a dictionary that remembers (in its master's changed_keys
+#  set) that it has been modified. Saves only need to look at these entries, and only store how they differ from
+#  the pristine world as it was loaded.
+#
+# Every game loaded from the world bundle shares one read-only copy of the compiled world. A game's WorldEntry is an
+#  overlay on its entry in that shared world (static): it holds only the fields this game has set, and looks up every
+#  other field in the shared entry. A shared list (e.g. a location's "items") is read through a SharedList, which only
+#  copies it into the overlay when the game changes it. A shared dictionary, or a list holding lists or dictionaries
+#  (nested_fields, found when the world is compiled), is copied into the overlay the first time it is read instead,
+#  and the entry is marked as changed, since the game may change it in place.
+class WorldEntry(dict):
+    __slots__ = ["entry_key", "changed_keys", "static", "nested_fields"]
+
+    def __init__(self, entry_key, data, changed_keys, static = None, nested_fields = ()):
+        dict.__init__(self, data)
+        self.entry_key = entry_key
+        self.changed_keys = changed_keys
+        self.static = static if static != None else EMPTY_ENTRY
+        self.nested_fields = nested_fields
+
+    # Called by dict when a field isn't in the overlay: look it up in the shared entry instead
+    def __missing__(self, key):
+        value = self.static[key]
+        if key in self.nested_fields:
+            return self.EditableValue(key)
+        if isinstance(value, list):
+            return SharedList(self, key)
+        return value
+
+    def get(self, key, default = None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self.static:
+            return self.__missing__(key)
+        return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key in self.static)
+
+    def keys(self):
+        keys = [key for key in self.static if not dict.__contains__(self, key)]
+        keys.extend(dict.keys(self))
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    # Does this game have its own value for the field (rather than the shared world's)?
+    def HasOwnValue(self, key):
+        return dict.__contains__(self, key)
+
+    # Returns the shared world's value for a field (which must not be changed)
+    def StaticValue(self, key, default = None):
+        return self.static.get(key, default)
+
+    # Returns a field's value for reading only: a list the game hasn't changed is the shared world's own list (not a
+    #  SharedList), so it must not be changed. This is quicker for code that only looks, like listing a room's items.
+    def ReadValue(self, key, default = None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        return self.static.get(key, default)
+
+    # Returns this game's own copy of a field, copying it from the shared world the first time. The entry is marked as
+    #  changed, since the copy may be changed in place.
+    def EditableValue(self, key):
+        if not dict.__contains__(self, key):
+            dict.__setitem__(self, key, copy.deepcopy(self.static[key]))
+        self.changed_keys.add(self.entry_key)
+        return dict.__getitem__(self, key)
+
+    # Returns the fields this game has set itself
+    def OwnItems(self):
+        return dict.items(self)
+
+    # Sets a field that saves leave out (like a handler) without marking the entry as changed
+    def SetUnsaved(self, key, value):
+        dict.__setitem__(self, key, value)
+
+    # Copies every shared field into the overlay, so that fields can be removed from this entry
+    def Detach(self):
+        for key, value in self.static.items():
+            if not dict.__contains__(self, key):
+                dict.__setitem__(self, key, copy.deepcopy(value))
+        self.static = EMPTY_ENTRY
+
+    def __setitem__(self, key, value):
+        # Storing a shared list (e.g. the result of "+=" on one) stores this game's own copy of it
+        if isinstance(value, SharedList):
+            value = value.Editable()
+        dict.__setitem__(self, key, value)
+        self.changed_keys.add(self.entry_key)
+
+    def __delitem__(self, key):
+        if key in self.static:
+            self.Detach()
+        dict.__delitem__(self, key)
+        self.changed_keys.add(self.entry_key)
+
+    def setdefault(self, key, default = None):
+        self.changed_keys.add(self.entry_key)
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.changed_keys.add(self.entry_key)
+
+    def pop(self, *args):
+        self.changed_keys.add(self.entry_key)
+        self.Detach()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.changed_keys.add(self.entry_key)
+        self.Detach()
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self.static = EMPTY_ENTRY
+        self.changed_keys.add(self.entry_key)
+
+# The shared entry of a WorldEntry that isn't backed by the shared world (e.g. an item added while the game is running)
+EMPTY_ENTRY = {}
+
+
+# A list field of a WorldEntry that the game hasn't changed yet. It reads the shared world's list, and the first change
+#  (through this or any other SharedList for the same field) copies the list into the entry's overlay and marks the
+#  entry as changed. After that, looking the field up returns the game's own copy (a plain list).
+class SharedList:
+    __slots__ = ["entry", "key"]
+    __hash__ = None
+
+    def __init__(self, entry, key):
+        self.entry = entry
+        self.key = key
+
+    # Returns the list as it is now: the game's own copy if it has one, or else the shared world's (not to be changed)
+    def Current(self):
+        if dict.__contains__(self.entry, self.key):
+            return dict.__getitem__(self.entry, self.key)
+        return self.entry.StaticValue(self.key, [])
+
+    # Returns the game's own copy of the list, to change
+    def Editable(self):
+        return self.entry.EditableValue(self.key)
+
+    def __len__(self):
+        return len(self.Current())
+
+    def __getitem__(self, index):
+        return self.Current()[index]
+
+    def __iter__(self):
+        return iter(self.Current())
+
+    def __reversed__(self):
+        return reversed(self.Current())
+
+    def __contains__(self, value):
+        return value in self.Current()
+
+    def __eq__(self, other):
+        if isinstance(other, SharedList):
+            other = other.Current()
+        return self.Current() == other
+
+    def __add__(self, other):
+        if isinstance(other, SharedList):
+            other = other.Current()
+        return self.Current() + other
+
+    def __radd__(self, other):
+        return other + self.Current()
+
+    def __mul__(self, count):
+        return self.Current() * count
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(self.Current())
+
+    def index(self, *args):
+        return self.Current().index(*args)
+
+    def count(self, value):
+        return self.Current().count(value)
+
+    def copy(self):
+        return list(self.Current())
+
+    def __copy__(self):
+        return list(self.Current())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.Current(), memo)
+
+    def __setitem__(self, index, value):
+        self.Editable()[index] = value
+
+    def __delitem__(self, index):
+        del self.Editable()[index]
+
+    def __iadd__(self, other):
+        self.Editable().extend(other)
+        return self
+
+    def __imul__(self, count):
+        self.Editable()[:] = self.Current() * count
+        return self
+
+    def append(self, value):
+        self.Editable().append(value)
+
+    def extend(self, values):
+        self.Editable().extend(values)
+
+    def insert(self, index, value):
+        self.Editable().insert(index, value)
+
+    def remove(self, value):
+        self.Editable().remove(value)
+
+    def pop(self, *args):
+        return self.Editable().pop(*args)
+
+    def clear(self):
+        self.Editable().clear()
+
+    def reverse(self):
+        self.Editable().reverse()
+
+    def sort(self, *args, **kwargs):
+        self.Editable().sort(*args, **kwargs)
+
+# Is this a list of item keys (a plain list, or a SharedList)?
+def IsItemList(value):
+    return isinstance(value, (list, SharedList))
+
+# Are these the same list? (A SharedList is the same as the list it reads.)
+def IsSameList(list_a, list_b):
+    if isinstance(list_a, SharedList):
+        list_a = list_a.Current()
+    if isinstance(list_b, SharedList):
+        list_b = list_b.Current()
+    return list_a is list_b
+
+
+# The entries of a master (locations or items), by key. When the master is loaded from the world bundle, the shared
+#  world's entries (static) are all there from the start, but a game's WorldEntry overlay for one is only created when
+#  the game first looks it up: a fresh game holds nothing for the thousands of entries it never touches, and starting
+#  a game (or restarting or restoring one) doesn't depend on the size of the world.
+class WorldEntries(dict):
+    __slots__ = ["static", "changed_keys", "nested_fields"]
+
+    def __init__(self, static, changed_keys, nested_fields = None):
+        dict.__init__(self)
+        self.static = static
+        self.changed_keys = changed_keys
+        self.nested_fields = nested_fields if nested_fields != None else {}
+
+    # Called by dict when an entry hasn't been looked up yet: create its overlay
+    def __missing__(self, key):
+        entry = WorldEntry(key, {}, self.changed_keys, self.static[key], self.nested_fields.get(key, ()))
+        dict.__setitem__(self, key, entry)
+        return entry
+
+    def get(self, key, default = None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self.static:
+            return self.__missing__(key)
+        return default
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key in self.static)
+
+    # Entries added while the game is running (so they aren't in the shared world)
+    def AddedKeys(self):
+        return [key for key in dict.keys(self) if not key in self.static]
+
+    def keys(self):
+        keys = list(self.static)
+        keys.extend(self.AddedKeys())
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.static) + len(self.AddedKeys())
+
+    # (Looking at every entry creates every overlay, so the game itself only does this while compiling the world)
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    # Returns the entries this game has looked up or added: the only ones that can differ from the shared world
+    def OwnEntries(self):
+        return dict.items(self)
+
+# Returns entry key -> the fields of that entry that WorldEntry must copy when they are read: dictionaries, and lists
+#  that hold lists or dictionaries (only entries that have such fields are included)
+def FindNestedFields(entries):
+    nested_fields = {}
+    for entry_key, entry in entries.items():
+        for key, value in entry.items():
+            if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(v, (list, dict)) for v in value)):
+                nested_fields.setdefault(entry_key, []).append(key)
+    return nested_fields
+
+# Returns the serializable fields of the changed entries that differ from the pristine world
+def DiffEntries(dictionary, changed_keys, pristine, exclude_keys):
+    serialize_dict = {}
+    for entry_key in changed_keys:
+        entry = dictionary.get(entry_key)
+        if entry == None:
+            continue
+        pristine_entry = pristine.get(entry_key)
+        entry_diff = {}
+        for key, value in entry.OwnItems():
+            if key in exclude_keys:
+                continue
+            if (pristine_entry == None) or (not key in pristine_entry) or (pristine_entry[key] != value):
+                entry_diff[key] = value
+        if entry_diff:
+            serialize_dict[entry_key] = entry_diff
+    return serialize_dict
+
+
 ######################### LOCATIONS #########################
 
 
 # Master object container for locations
 class LocationsMaster:
-    # Constructor
-    def __init__(self):
-        with open('locations.json') as data_file:
-            self.locations_dictionary = json.load(data_file)
-        for loc_key in self.locations_dictionary:
-            self.locations_dictionary[loc_key]["key"] = loc_key
-            self.locations_dictionary[loc_key]["touched?"] = False
-            self.locations_dictionary[loc_key]["items"] = []
-            self.locations_dictionary[loc_key]["enter_handler"] = None
-            self.locations_dictionary[loc_key]["when_here_handler"] = None
-            self.locations_dictionary[loc_key]["look_handler"] = None
+    # Descriptions, direction attributes, and immutable stuff that never needs to be saved
+    serialize_exclude = ["brief_desc","long_desc","north","south","east","west","northeast","northwest",
+                         "southeast","southwest","up","down","in","out","enter_handler",
+                         "when_here_handler","look_handler","key"]
+
+    # Constructor (world is the compiled world from the bundle cache, or None to load locations.json from world_dir)
+    def __init__(self, world = None, world_dir = "."):
+        self.context = None
+        self.changed_keys = set()
+        self.pristine = {}
+        if world != None:
+            # The compiled locations are shared with the other games; this game's entries only hold what it changes
+            self.pristine = world["locations"]
+            self.locations_dictionary = WorldEntries(self.pristine, self.changed_keys, world["nested_fields"]["locations"])
+            return
+
+        self.locations_dictionary = WorldEntries({}, self.changed_keys)
+        with open(Path(world_dir) / 'locations.json') as data_file:
+            locations_data = json.load(data_file)
+        for loc_key in locations_data:
+            locations_data[loc_key]["key"] = loc_key
+            locations_data[loc_key]["touched?"] = False
+            locations_data[loc_key]["items"] = []
+            locations_data[loc_key]["enter_handler"] = None
+            locations_data[loc_key]["when_here_handler"] = None
+            locations_data[loc_key]["look_handler"] = None
+            self.locations_dictionary[loc_key] = WorldEntry(loc_key, locations_data[loc_key], self.changed_keys)
 
     # This allows you to type "locations[<key>]" for convenience
     def __getitem__(self, key): return self.locations_dictionary[key]
 
-    # Convert locations to dictionary, excluding any descriptions, direction attributes, and immutable stuff
+    # Convert locations to dictionary, holding only the saveable attributes that differ from the pristine world
     def Serialize(self):
-        serialize_dict = {}
-        for location in self.locations_dictionary.values():
-            location_entry = {}
-            for key, value in location.items():
-                if key not in ["brief_desc","long_desc","north","south","east","west","northeast","northwest",
-                               "southeast","southwest","up","down","in","out","enter_handler",
-                               "when_here_handler","look_handler","key"]:
-                    location_entry[key] = value
-            if location_entry:
-                serialize_dict[location["key"]] = location_entry
-        return(serialize_dict)
+        return DiffEntries(self.locations_dictionary, self.changed_keys, self.pristine, self.serialize_exclude)
 
     # Add a function to trigger on entering this location
     def AddEnterHandler(self, loc_key, handler):
-        self[loc_key]["enter_handler"] = handler
+        self[loc_key].SetUnsaved("enter_handler", self.context.ProfileHandler("enter", loc_key, handler))
 
     # Add a function to run as a handler whenever the player is at this location
     def AddWhenHereHandler(self, loc_key, handler):
-        self[loc_key]["when_here_handler"] = handler
+        self[loc_key].SetUnsaved("when_here_handler", self.context.ProfileHandler("when_here", loc_key, handler))
 
     # Add a function to run as a handler whenever the player is at this location
     def AddLookHandler(self, loc_key, handler):
-        self[loc_key]["look_handler"] = handler
+        self[loc_key].SetUnsaved("look_handler", self.context.ProfileHandler("look", loc_key, handler))
 
     # This function handles a move in a certain direction.
     def HandleMove(self, direction):
-        new_location_key = self[player.location].get(str.lower(direction))
+        new_location_key = self[self.context.player.location].get(str.lower(direction))
         
         # Test whether the location key in this location is a string description; if so, print it.
         if ' ' in new_location_key:
-          Print(new_location_key)
+          self.context.Print(new_location_key)
         
         # Test for a door (denoted with the "LOCATION|DOOR" notation)
         if '|' in new_location_key:
             new_loc_array = new_location_key.split('|')
-            if not items[new_loc_array[1]].get("is_open?"):
-                Print("The " + items[new_loc_array[1]].get("name") + " is closed.")
+            if not self.context.items[new_loc_array[1]].get("is_open?"):
+                self.context.Print("The " + self.context.items[new_loc_array[1]].get("name") + " is closed.")
             else:
                 self.EnterRoom(new_loc_array[0])
        
-        elif self.IsDark() and ((new_location_key == None) or (len(new_location_key) == 0) or not locations[new_location_key].get("touched?")):
-            Print("It's hard to tell in the dark if it's possible to move in that location.")
+        elif self.IsDark() and ((new_location_key == None) or (len(new_location_key) == 0) or not self[new_location_key].get("touched?")):
+            self.context.Print("It's hard to tell in the dark if it's possible to move in that location.")
 
         elif (new_location_key != None) and (len(new_location_key) > 0):
             self.EnterRoom(new_location_key)
         else:
-            Print("You can't go in that direction.")
+            self.context.Print("You can't go in that direction.")
 
     # This function moves the player to a new location and prints room location
     def EnterRoom(self, new_location_key):
         new_location = self[new_location_key]
         first_time_here = not new_location["touched?"]
         enter_handler = new_location.get("enter_handler")
-        if (enter_handler != None) and enter_handler(context, first_time_here):
+        if (enter_handler != None) and enter_handler(self.context, first_time_here):
             return True
         if not first_time_here:
-            player.SetPlayerLocation(new_location_key)
-            Print(new_location["brief_desc"])
+            self.context.player.SetPlayerLocation(new_location_key)
+            self.context.Print(new_location["brief_desc"])
             if not self.IsDark():
                 self.DescribeItemsInLocation()
         else:
-            player.SetPlayerLocation(new_location_key)
+            self.context.player.SetPlayerLocation(new_location_key)
             self.DoLook()
 
     # This function implements a LOOK action
     def DoLook(self):
-        location = self[player.location]
-        Print(location["brief_desc"])
+        location = self[self.context.player.location]
+        self.context.Print(location["brief_desc"])
         if self.IsDark():
-            Print("It is pitch dark in here.")
+            self.context.Print("It is pitch dark in here.")
         else:
             location["touched?"] = True
-            look_handler = locations[player.location].get("look_handler")
+            look_handler = self[self.context.player.location].get("look_handler")
             if look_handler:
-                look_handler(context)
+                look_handler(self.context)
             else:
-                Print(location["long_desc"])
+                self.context.Print(location["long_desc"])
             self.DescribeItemsInLocation()
 
     # Describes all items in a particular location
     def DescribeItemsInLocation(self):
-        items.ListItems(self[player.location]["items"], decorate = "There is @ here.", article = "a", indent = 0, blank_line = True, announce_if_nothing = False)
+        self.context.items.ListItems(self[self.context.player.location].ReadValue("items"), decorate = "There is @ here.", article = "a", indent = 0, blank_line = True, announce_if_nothing = False)
 
     # Is the current location dark (and is there no light source in the room or in player inventory?)
     def IsDark(self):
-        player_loc = player.GetPlayerLocation()
-        if not player_loc.get("dark?"):
-            return False
-
-        # Dark room ... need to check for light source in room or inventory
-        for item_key in items.ListItemsPresent():
-            item = items[item_key]
-            if (item.get("light_source?")):
-                return False
-        
-        return True
+        return self.context.items.GetScope().is_dark
 
 
 ######################### ACTIONS #########################
 
 
+# This class is one compiled entry of the verb table, holding the parts of an action the parser needs to split up the
+#  command. (The check for incomplete commands also runs when the player answers a prompt, when there is no entry,
+#  so it reads the action itself.)
+class DispatchEntry:
+    def __init__(self, action):
+        self.action_key = action["key"]
+        self.mimic = action.get("mimic")
+        self.no_second_item = bool(action.get("no_second_item?"))
+
+
 # Master object container for actions
 class ActionsMaster:
-    # Constructor
-    def __init__(self):
-        with open('actions.json') as data_file:
-            self.actions_dictionary = json.load(data_file)
+    # Constructor (world is the compiled world from the bundle cache, or None to load actions.json from world_dir).
+    # The verb table never changes once compiled, so sessions loaded from the same world can share one (dispatch_table).
+    def __init__(self, lexicon, world = None, world_dir = ".", dispatch_table = None):
+        self.context = None
         self.swear_words = []
         self.swear_response = "Hey, watch your language!"
-        self.all_prepositions = []
-        self.all_actions = []
+        self.lexicon = lexicon
+        if world != None:
+            # The lexicon already holds the action words, and the verb table just needs its entries rebuilt. The
+            #  compiled actions are shared with the other games, so this game's entries only hold its handlers.
+            self.actions_dictionary = {}
+            changed_keys = set()
+            nested_fields = world["nested_fields"]["actions"]
+            for action_key, static_entry in world["actions"].items():
+                self.actions_dictionary[action_key] = WorldEntry(action_key, {}, changed_keys, static_entry, nested_fields.get(action_key, ()))
+            self.dispatch_table = dispatch_table
+            if self.dispatch_table == None:
+                self.dispatch_table = {}
+                for dispatch_key, action_key in world["dispatch_table"].items():
+                    self.dispatch_table[dispatch_key] = DispatchEntry(self[action_key])
+            return
+
+        with open(Path(world_dir) / 'actions.json') as data_file:
+            self.actions_dictionary = json.load(data_file)
+        self.lexicon.AddWords(["GO", "THE", "A"], Lexicon.STOPWORD)
         for action_key in self.actions_dictionary:
             self.actions_dictionary[action_key]["key"] = action_key
             self.actions_dictionary[action_key]["handler"] = None
 
-            for action in self.actions_dictionary[action_key]["words"]:
-                if not action in self.all_actions:
-                    self.all_actions.append(action)
+            self.lexicon.AddWords(self.actions_dictionary[action_key]["words"], Lexicon.VERB)
 
             prepositions_list = self.actions_dictionary[action_key].get("prepositions")
             if prepositions_list != None:
-              for preposition in prepositions_list:
-                if not preposition in self.all_prepositions:
-                  self.all_prepositions.append(preposition)
+                self.lexicon.AddWords(prepositions_list, Lexicon.PREPOSITION)
+
+        self.CompileDispatchTable()
 
     # This allows you to type "actions[<key>]" for convenience
     def __getitem__(self, key): return self.actions_dictionary[key]
 
+    # Compiles actions.json into a table keyed by (action word, preposition or None), so the parser can resolve a verb
+    #  with a single lookup. Two actions sharing a word AND a preposition are ambiguous, so they are reported here.
+    def CompileDispatchTable(self):
+        self.dispatch_table = {}
+        first_action_for_word = {}
+        for action_key in self.actions_dictionary:
+            action = self.actions_dictionary[action_key]
+            prepositions_list = action.get("prepositions")
+            if not prepositions_list:
+                prepositions_list = [None]
+            for word in action["words"]:
+                if not word in first_action_for_word:
+                    first_action_for_word[word] = action_key
+                for preposition in prepositions_list:
+                    existing = self.dispatch_table.get((word, preposition))
+                    if existing != None:
+                        sys.stderr.write("ERROR: actions " + existing.action_key + " and " + action_key + " both match \"" + word + ("" if preposition == None else " " + preposition) + "\"\n")
+                        continue
+                    self.dispatch_table[(word, preposition)] = DispatchEntry(action)
+
+        # If the player leaves out the preposition for a verb that needs one (e.g. "TURN FLASHLIGHT"), assume the first action with that word
+        for word in first_action_for_word:
+            if not (word, None) in self.dispatch_table:
+                self.dispatch_table[(word, None)] = DispatchEntry(self[first_action_for_word[word]])
+
     # Add a function to handle an action
     def AddActionHandler(self, action_key, handler):
-        self[action_key]["handler"] = handler
+        self[action_key].SetUnsaved("handler", self.context.ProfileHandler("action", action_key, handler))
 
     # Is this word in the list of swears (defined in the globals)
     def CheckForSwear(self, word):
         if word in self.swear_words:
-            Print(self.swear_response)
+            self.context.Print(self.swear_response)
             return True
         return False
 
@@ -428,33 +1504,33 @@ class ActionsMaster:
     def CheckForUnknownWords(self, command_words):
         for x in range(len(command_words)):
             word = command_words[x]
-            if (not word in self.all_actions) and (not word in self.all_prepositions) and (not word in items.all_nouns) and (not word in items.all_adjectives) and (not word.isdigit()) and (not word in ["GO","THE","A"]):
-                Print("I don't understand the word \"" + word + "\".")
-                state.oops_index = x
+            if not self.lexicon.IsKnown(word):
+                self.context.Print("I don't understand the word \"" + word + "\".")
+                self.context.state.oops_index = x
                 oops_words = []
                 for xx in range(len(command_words)):
                   if not x == xx:
                     oops_words.append(command_words[xx])
-                state.oops_words = oops_words
+                self.context.state.oops_words = oops_words
                 return True
         return False
 
     # Given a list of words, attempt to resolve to a single item in the game. Complain and return None if this is impossible.
     def ParseItem(self, command_substring, expects_number = False):
-        if state.debug:
-            print("Parse Item: " + ' '.join(command_substring))
+        if self.context.state.debug:
+            self.context.Write("Parse Item: " + ' '.join(command_substring) + "\n")
         
         command_substring = [x for x in command_substring if not x in["THE","A"]]
         if command_substring == []:
-            Print("I don't understand that command.")
+            self.context.Print("I don't understand that command.")
             return None
         
         # Handle "IT"
         if (len(command_substring) == 1) and (command_substring[0] == "IT"):
-            if (len(state.last_parsed_command) > 1) and (not state.last_parsed_command[1] == None):
-                return state.last_parsed_command[1]
+            if (len(self.context.state.last_parsed_command) > 1) and (not self.context.state.last_parsed_command[1] == None):
+                return self.context.state.last_parsed_command[1]
             else:
-                Print("I don't understand what \"IT\" is referring to in that command.")
+                self.context.Print("I don't understand what \"IT\" is referring to in that command.")
                 return None
 
         # Handle "ALL"
@@ -469,21 +1545,14 @@ class ActionsMaster:
             item_candidates.append("NUMBER")
 
         # If we are waiting on the player to disambiguate between several items, narrow the search universe to just those items
-        item_universe = items.items_dictionary
-        if len(state.disambiguate_list) > 0:
-            item_universe = state.disambiguate_list
+        item_universe = None
+        if len(self.context.state.disambiguate_list) > 0:
+            item_universe = self.context.state.disambiguate_list
 
-        for item_key in item_universe:
-            mismatch = False
-            for word in command_substring:
-                if (not word in items[item_key]["words"]) and ((not items[item_key].get("adjectives")) or (not word in items[item_key]["adjectives"])):
-                    mismatch = True
-                    break
-            if not mismatch:
-                item_candidates.append(item_key)
+        item_candidates.extend(self.context.items.FindItemsMatchingWords(command_substring, item_universe))
 
         if len(item_candidates) == 0:
-            Print("I don't understand that command.")
+            self.context.Print("I don't understand that command.")
             return None
 
         if len(item_candidates) == 1:
@@ -501,10 +1570,9 @@ class ActionsMaster:
                 else:
                     item_candidates.remove("NUMBER")
 
-        item_candidates_here = []
-        for item_candidate in item_candidates:
-            if items.TestIfItemIsIn(item_candidate, player.inventory) or ((not locations.IsDark()) and items.TestIfItemIsIn(item_candidate, player.GetPlayerLocation()["items"])):
-                item_candidates_here.append(item_candidate)
+        # (The scope's visible set is the inventory, plus the room unless it's dark, each looking into open containers)
+        visible_items = self.context.items.GetScope().visible_items
+        item_candidates_here = [item_candidate for item_candidate in item_candidates if item_candidate in visible_items]
 
         if len(item_candidates_here) == 1:
             # Success!
@@ -518,7 +1586,7 @@ class ActionsMaster:
         item_candidates_here_nounsonly = []
         for item_candidate in item_candidates_here:
             for word in command_substring:
-                if word in items[item_candidate]["words"]:
+                if word in self.context.items[item_candidate].ReadValue("words"):
                     item_candidates_here_nounsonly.append(item_candidate)
                     break
         
@@ -533,21 +1601,22 @@ class ActionsMaster:
         for item_candidate in item_candidates_here:
             if item_candidate == item_candidates_here[len(item_candidates_here)-1]:
                 query_string += " or"
-            query_string += " the " + items[item_candidate]["name"]
+            query_string += " the " + self.context.items[item_candidate]["name"]
             if (not item_candidate == item_candidates_here[len(item_candidates_here)-1]) and (len(item_candidates_here) > 2):
                 query_string += ","
-        Print(query_string + "?")
-        state.disambiguate_list = []
+        self.context.Print(query_string + "?")
+        self.context.state.disambiguate_list = []
         for item_candidate in item_candidates_here:
-                state.disambiguate_list.append(item_candidate)
+                self.context.state.disambiguate_list.append(item_candidate)
         
-        state.waiting_for_item = True
+        self.context.state.waiting_for_item = True
         return None
     
     # Here is the main command parser function. You pass in a string and it parses it into known tokens and then reacts to them.
     def ParseCommand(self, command_string):
-        state.this_user_input = command_string
-        state.parse_successful = False
+        self.context.items.InvalidateScope()
+        self.context.state.this_user_input = command_string
+        self.context.state.parse_successful = False
         command_string = str.upper(command_string).strip()
         command_words = command_string.split(' ')
 
@@ -556,60 +1625,60 @@ class ActionsMaster:
                 return
         
         if len(command_string) == 0:
-            Print("Eh?")
+            self.context.Print("Eh?")
             return
             
-        if self.CheckForUnknownWords(command_words):
+        if self.context.CallTimed("unknown_words", self.CheckForUnknownWords, command_words):
             return
 
         # Handle OOPS
         if (command_words[0] == "OOPS"):
-            if (len(command_words)>1) and (not state.oops_index == None):
+            if (len(command_words)>1) and (not self.context.state.oops_index == None):
                 new_command_words = []
-                for word in state.oops_words:
+                for word in self.context.state.oops_words:
                     new_command_words.append(word)
                 for x in range(len(command_words)-1):
-                    new_command_words.insert(state.oops_index + x, command_words[x+1])
+                    new_command_words.insert(self.context.state.oops_index + x, command_words[x+1])
                 command_words = new_command_words
             else:
-                Print("You can use 'OOPS' to correct typing mistakes. Just type 'OOPS' and then the word you meant to type.")
+                self.context.Print("You can use 'OOPS' to correct typing mistakes. Just type 'OOPS' and then the word you meant to type.")
                 return
 
         # Handle case where we're waiting to see if the user confirmed a QUIT (by typing Y or N)
-        if state.quit_pending and (len(command_words) == 1):
+        if self.context.state.quit_pending and (len(command_words) == 1):
             if (command_string == 'Y') or (command_string == 'YES'):
-                Print("Quitting...")
-                state.quit_confirmed = True
+                self.context.Print("Quitting...")
+                self.context.state.quit_confirmed = True
                 return
             if (command_string == 'N') or (command_string == 'NO'):
-                Print("Okay, Quit cancelled.")
-                state.quit_pending = False
+                self.context.Print("Okay, Quit cancelled.")
+                self.context.state.quit_pending = False
                 return
 
         # Handle case where we're waiting to see if the user confirmed a RESTART (by typing Y or N)
-        if state.restart_pending and (len(command_words) == 1):
+        if self.context.state.restart_pending and (len(command_words) == 1):
             if (command_string == 'Y') or (command_string == 'YES'):
-                Print("Restarting...\n")
-                state.restart_confirmed = True
+                self.context.Print("Restarting...\n")
+                self.context.state.restart_confirmed = True
                 return
             if (command_string == 'N') or (command_string == 'NO'):
-                if (player.hp <= 0):
-                    Print("Quitting...")
-                    state.quit_confirmed = True
+                if (self.context.player.hp <= 0):
+                    self.context.Print("Quitting...")
+                    self.context.state.quit_confirmed = True
                 else:
-                    Print("Okay, Restart cancelled.")
-                    state.restart_pending = False
+                    self.context.Print("Okay, Restart cancelled.")
+                    self.context.state.restart_pending = False
                 return
 
-        if player.hp <= 0:
-            Print("You can't do that on account of the fact that you're dead.")
-            player.Kill("")
+        if self.context.player.hp <= 0:
+            self.context.Print("You can't do that on account of the fact that you're dead.")
+            self.context.player.Kill("")
             return
 
         # Basically just ignore "GO" (e.g. "GO NORTH" or "GO INSIDE")
         if command_words[0] == "GO":
             if len(command_words) == 1:
-                Print("Where would you like to go?")
+                self.context.Print("Where would you like to go?")
                 return
             del command_words[0]
 
@@ -617,72 +1686,53 @@ class ActionsMaster:
         preposition_index = -1
         preps_found = 0
         for x in range(len(command_words)):
-            if command_words[x] in self.all_prepositions:
+            if self.lexicon.HasRole(command_words[x], Lexicon.PREPOSITION):
                 # If a preposition is also a command, then assume it's being used as a command if it's the first word
                 #  Example: 'IN' vs 'PUT COIN IN SLOT'
-                if (x == 0) and (command_words[x] in self.all_actions):
+                if (x == 0) and self.lexicon.HasRole(command_words[x], Lexicon.VERB):
                     continue
                 preposition_index = x
                 preps_found = preps_found + 1
         if preps_found > 1:
-            Print("There were too many prepositions in that command.")
+            self.context.Print("There were too many prepositions in that command.")
             return
 
-        # Check if first word is an action (the usual type of command)
-        action_matches = []
-        for action_key in self.actions_dictionary:
-            if command_words[0] in self[action_key]["words"]:
-                action_matches.append(action_key)
-
-        if len(action_matches) > 0:
+        # Check if first word is an action (the usual type of command), using the preposition (if any) to pick
+        #  between actions with overlapping words (e.g. "GET" vs "GET FROM")
+        preposition = None
+        if preps_found:
+            preposition = command_words[preposition_index]
+        dispatch = self.dispatch_table.get((command_words[0], preposition))
 
-            # First word matches at least one action ... may need to disambiguate using prepositions
-            final_action_matches = []
-
-            for potential_match in action_matches:
-                if preps_found and ((not self[potential_match].get("prepositions")) or (not command_words[preposition_index] in self[potential_match].get("prepositions"))):
-                    continue
-                if (not preps_found) and (self[potential_match].get("prepositions")):
-                    continue
-                # Action matched against both action words and prepositions (if any)
-                final_action_matches.append(potential_match)
+        # Did player type in a preposition that doesn't match this verb?
+        if (dispatch == None) and preps_found and self.lexicon.HasRole(command_words[0], Lexicon.VERB):
+            self.context.Print("I don't understand that command.")
+            return
 
-            if len(final_action_matches) == 0:
-                # Did player type in a preposition that doesn't match this verb?
-                if preps_found > 0:
-                    Print("I don't understand that command.")
-                    return
-                
-                # ... or did player just fail to type in a preposition at all ... then assume preposition and proceed
-                final_action_matches.append(action_matches[0])
-            
-            # We assume that the player's action can't be ambiguous at this point
-            # If it is ambiguous, then there are two actions with the same words and matching prepositions (not allowed)
-            # Just in case, we set the action to the first matched action.
-            action_key = final_action_matches[0]
+        if dispatch != None:
+            action_key = dispatch.action_key
 
             user_action_words = [command_words[0]]
             if preps_found:
                 user_action_words.append(command_words[preposition_index])
-            state.ClearPending()
-            state.this_parsed_command = [Token("Action", action_key, user_action_words)]
+            self.context.state.ClearPending()
+            self.context.state.this_parsed_command = [Token("Action", action_key, user_action_words)]
 
             # Handle actions that mimic other actions
-            mimic_action = self[action_key].get("mimic")
-            if mimic_action:
-                if state.debug:
-                    Print("MIMIC action detected")
-                state.this_parsed_command[0].key = mimic_action
+            if dispatch.mimic:
+                if self.context.state.debug:
+                    self.context.Print("MIMIC action detected")
+                self.context.state.this_parsed_command[0].key = dispatch.mimic
             
             if preps_found:
                 # Handle case with one object, e.g. TURN ON FLASHLIGHT
-                if self[action_key].get("no_second_item?"):
+                if dispatch.no_second_item:
                     user_item_words = []
                     for x in range(1,len(command_words)):
                         if not x == preposition_index:
                             user_item_words.append(command_words[x])
                     if len(user_item_words) > 0:
-                        state.this_parsed_command.append(self.ParseItem(user_item_words, self[action_key].get("expects_number?")))
+                        self.context.state.this_parsed_command.append(self.context.CallTimed("parse_item", self.ParseItem, user_item_words, self[action_key].get("expects_number?")))
                 
                 # Handle case with two objects, e.g. PUT X IN Y
                 else:
@@ -690,22 +1740,22 @@ class ActionsMaster:
                     # Can't have preposition right after action or last word in command
                     if (preposition_index < 2) or (preposition_index == len(command_words) - 1):
                         
-                        Print("I don't understand that command.")
+                        self.context.Print("I don't understand that command.")
                         return
                     
                     # Add tokens to parsed_command for objects on either side of the preposition:
-                    state.this_parsed_command.append(self.ParseItem(command_words[1:preposition_index], self[action_key].get("expects_number?")))
-                    if not state.this_parsed_command[1] == None:
-                        state.this_parsed_command.append(self.ParseItem(command_words[preposition_index+1:]))
+                    self.context.state.this_parsed_command.append(self.context.CallTimed("parse_item", self.ParseItem, command_words[1:preposition_index], self[action_key].get("expects_number?")))
+                    if not self.context.state.this_parsed_command[1] == None:
+                        self.context.state.this_parsed_command.append(self.context.CallTimed("parse_item", self.ParseItem, command_words[preposition_index+1:]))
 
             elif len(command_words) > 1:
-                state.this_parsed_command.append(self.ParseItem(command_words[1:], self[action_key].get("expects_number?")))
+                self.context.state.this_parsed_command.append(self.context.CallTimed("parse_item", self.ParseItem, command_words[1:], self[action_key].get("expects_number?")))
 
-            for this_token in state.this_parsed_command:
+            for this_token in self.context.state.this_parsed_command:
                 if not this_token:
                     return
 
-        elif state.waiting_for_item:
+        elif self.context.state.waiting_for_item:
             # First word was not an action.
             # If we reach this point in the code, there are only three valid possibilities:
             #  (1) We have prompted the player to disambiguate between several items by typing in a more specific item
@@ -713,130 +1763,130 @@ class ActionsMaster:
             #  (3) We have prompted the player to type in a number
 
             # In all three cases, we will parse the command as an item and then attempt to put it into the right spot in the previous parsed command
-            action_key = state.this_parsed_command[0].key
-            new_token = self.ParseItem(command_words, self[action_key].get("expects_number?"))
+            action_key = self.context.state.this_parsed_command[0].key
+            new_token = self.context.CallTimed("parse_item", self.ParseItem, command_words, self[action_key].get("expects_number?"))
             if not new_token:
                 return
-            if len(state.this_parsed_command) == 1:
-                state.this_parsed_command.append(new_token)
-            elif state.this_parsed_command[1] == None:
-                state.this_parsed_command[1] = new_token
-                if (len(state.this_parsed_command) == 3) and state.this_parsed_command[2] == None:
-                    del state.this_parsed_command[-1]
-            elif len(state.this_parsed_command) == 2:
-                state.this_parsed_command.append(new_token)
+            if len(self.context.state.this_parsed_command) == 1:
+                self.context.state.this_parsed_command.append(new_token)
+            elif self.context.state.this_parsed_command[1] == None:
+                self.context.state.this_parsed_command[1] = new_token
+                if (len(self.context.state.this_parsed_command) == 3) and self.context.state.this_parsed_command[2] == None:
+                    del self.context.state.this_parsed_command[-1]
+            elif len(self.context.state.this_parsed_command) == 2:
+                self.context.state.this_parsed_command.append(new_token)
             else:
-                state.this_parsed_command[2] = new_token
+                self.context.state.this_parsed_command[2] = new_token
 
         else:
-            Print("I don't understand that command.")
+            self.context.Print("I don't understand that command.")
             return
 
         # Check for incomplete commands, like "OPEN" or "PUT COIN", and prompt for more words if necessary
-        if actions[action_key].get("requires_object?") and (len(state.this_parsed_command) == 1):
-            prompt_string = "What do you want to " + state.this_parsed_command[0].user_words[0].lower()
-            if actions[action_key].get("no_second_item?"):
+        if self[action_key].get("requires_object?") and (len(self.context.state.this_parsed_command) == 1):
+            prompt_string = "What do you want to " + self.context.state.this_parsed_command[0].user_words[0].lower()
+            if self[action_key].get("no_second_item?"):
                 if preps_found:
                     prompt_string += " " + command_words[preposition_index].lower()
-                elif actions[action_key].get("prepositions"):
-                    prompt_string += " " + actions[action_key]["prepositions"][0].lower()
-            Print(prompt_string + "?")
-            state.waiting_for_item = True
-        elif actions[action_key].get("prepositions") and (not actions[action_key].get("no_second_item?")) and len(state.this_parsed_command) < 3:
-            prompt_string = "What do you want to " + state.this_parsed_command[0].user_words[0].lower()
-            if not items[state.this_parsed_command[1].key].get("no_article?"):
+                elif self[action_key].get("prepositions"):
+                    prompt_string += " " + self[action_key]["prepositions"][0].lower()
+            self.context.Print(prompt_string + "?")
+            self.context.state.waiting_for_item = True
+        elif self[action_key].get("prepositions") and (not self[action_key].get("no_second_item?")) and len(self.context.state.this_parsed_command) < 3:
+            prompt_string = "What do you want to " + self.context.state.this_parsed_command[0].user_words[0].lower()
+            if not self.context.items[self.context.state.this_parsed_command[1].key].get("no_article?"):
                 prompt_string += " the"
-            prompt_string += " " + ' '.join(state.this_parsed_command[1].user_words).lower() + " "
-            if len(state.this_parsed_command[0].user_words) == 2:
-                prompt_string += state.this_parsed_command[0].user_words[1].lower()
+            prompt_string += " " + ' '.join(self.context.state.this_parsed_command[1].user_words).lower() + " "
+            if len(self.context.state.this_parsed_command[0].user_words) == 2:
+                prompt_string += self.context.state.this_parsed_command[0].user_words[1].lower()
             else:
-                prompt_string += actions[action_key]["prepositions"][0].lower()
-            Print(prompt_string + "?")    
-            state.waiting_for_item = True
+                prompt_string += self[action_key]["prepositions"][0].lower()
+            self.context.Print(prompt_string + "?")    
+            self.context.state.waiting_for_item = True
         else:
             # Successful parse!
 
             # Handle AGAIN
-            if (action_key == "AGAIN") and (len(state.this_parsed_command) == 1):
-                if not state.last_parsed_command:
-                    Print("You can't type 'AGAIN' before doing something.")
+            if (action_key == "AGAIN") and (len(self.context.state.this_parsed_command) == 1):
+                if not self.context.state.last_parsed_command:
+                    self.context.Print("You can't type 'AGAIN' before doing something.")
                     return
-                state.this_parsed_command = []
-                for t in state.last_parsed_command:
-                    state.this_parsed_command.append(t)
+                self.context.state.this_parsed_command = []
+                for t in self.context.state.last_parsed_command:
+                    self.context.state.this_parsed_command.append(t)
 
-            self.ParseAction(state.this_parsed_command)
+            self.ParseAction(self.context.state.this_parsed_command)
 
     # Once we have parsed the command into tokens with at least one action, we continue to parse...
     def ParseAction(self, parsed_command):
         
-        state.parse_successful = True
+        self.context.state.parse_successful = True
         # (setting this flag means that this command is considered parsed and counts as a player turn)
 
         # Obtain objects for action and items (if any) and make sure any referenced items are present
         action = self[parsed_command[0].key]
-        if state.debug:
-            print("ACTION: " + action["key"])
+        if self.context.state.debug:
+            self.context.Write("ACTION: " + action["key"] + "\n")
         item1 = None
         if len(parsed_command) > 1:
             if not action.get("requires_object?"):
-                Print("I don't understand that command.")
+                self.context.Print("I don't understand that command.")
                 return
-            item1 = items[parsed_command[1].key]
-            if state.debug:
-                print("ITEM1: " + item1["key"])
-            if not items.TestIfItemIsHere(item1):
-                items.YouCantSeeItemHere(' '.join(parsed_command[1].user_words))
+            item1 = self.context.items[parsed_command[1].key]
+            if self.context.state.debug:
+                self.context.Write("ITEM1: " + item1["key"] + "\n")
+            if not self.context.items.TestIfItemIsHere(item1):
+                self.context.items.YouCantSeeItemHere(' '.join(parsed_command[1].user_words))
                 return
             if (item1["key"] == "ALL") and not action.get("supports_all?"):
                 self.PrintActionDefault(action)
                 return
         item2 = None
         if len(parsed_command) > 2:
-            item2 = items[parsed_command[2].key]
-            if state.debug:
-                print("ITEM2: " + item2["key"])
-            if not items.TestIfItemIsHere(item2):
-                items.YouCantSeeItemHere(' '.join(parsed_command[2].user_words))
+            item2 = self.context.items[parsed_command[2].key]
+            if self.context.state.debug:
+                self.context.Write("ITEM2: " + item2["key"] + "\n")
+            if not self.context.items.TestIfItemIsHere(item2):
+                self.context.items.YouCantSeeItemHere(' '.join(parsed_command[2].user_words))
                 return
             if item2["key"] == "ALL":
                 self.PrintActionDefault(action)
                 return
 
         # Check location handler
-        location_handler = player.GetPlayerLocation().get("when_here_handler")
-        if location_handler and location_handler(context, action, item1, item2):
+        location_handler = self.context.player.GetPlayerLocation().get("when_here_handler")
+        if location_handler and self.context.CallTimed("when_here_handler", location_handler, self.context, action, item1, item2):
             return
 
         # Handle 1-word commands
         if len(parsed_command) == 1:
             if not action["handler"] == None:
-                action["handler"](context)
+                self.context.CallTimed("action_handler", action["handler"], self.context)
             elif action.get("is_move?"):
-                locations.HandleMove(action["key"])
+                self.context.CallTimed("action_handler", self.context.locations.HandleMove, action["key"])
             elif action["key"] == "LOOK":
-                locations.DoLook()
+                self.context.CallTimed("action_handler", self.context.locations.DoLook)
             else:
                 self.PrintActionDefault(action)
             return
 
         # Next, test if there is an item handler for this item that handles the command...
         handler = item1["handler"]
-        if (not handler == None) and handler(context, action, item2, False):
+        if (not handler == None) and self.context.CallTimed("item_handler", handler, self.context, action, item2, False):
             return
 
         # Next, test if there is an item handler for the secondary item that handles the command...
         if not item2 == None:
             handler = item2["handler"]
-            if (not handler == None) and handler(context, action, item1, True):
+            if (not handler == None) and self.context.CallTimed("item_handler", handler, self.context, action, item1, True):
                 return
 
         # ...and if not, check for an action handler
         if not action["handler"] == None:
             if action.get("prepositions") and (not action.get("no_second_item?")):
-                action["handler"](context, item1, item2)
+                self.context.CallTimed("action_handler", action["handler"], self.context, item1, item2)
             else:
-                action["handler"](context, item1)
+                self.context.CallTimed("action_handler", action["handler"], self.context, item1)
 
         # If there is no item or action handler that covers this command, print the default result
         else:
@@ -846,71 +1896,222 @@ class ActionsMaster:
     def PrintActionDefault(self, action):
         default_result = action.get("default_result")
         if default_result == None:
-            Print("You can't do that.")
+            self.context.Print("You can't do that.")
         else:
-            Print(default_result)
+            self.context.Print(default_result)
 
 
 ######################### ITEMS #########################
 
 
+# This class holds what the player can reach and see: the items in inventory and in the room (looking into
+#  open containers), and whether it's dark. It is computed once per turn and thrown away by ItemsMaster.InvalidateScope()
+#  whenever an item moves, a container is opened or closed, a light is toggled, or the player moves.
+class Scope:
+    def __init__(self, items, inventory, location):
+        self.items = items
+        self.inventory = inventory
+        self.location_items_list = location.ReadValue("items")
+        self.items_present = items.FindItemsInside(list(inventory) + list(self.location_items_list))
+        self.inventory_items = set(items.FindItemsInside(list(inventory)))
+        self.location_items = set(items.FindItemsInside(list(self.location_items_list)))
+        self.container_items = {}
+
+        # Dark room ... need to check for light source in room or inventory
+        self.is_dark = False
+        if location.get("dark?"):
+            self.is_dark = True
+            for item_key in self.items_present:
+                if items[item_key].get("light_source?"):
+                    self.is_dark = False
+                    break
+
+        self.visible_items = set(self.inventory_items)
+        if not self.is_dark:
+            self.visible_items |= self.location_items
+
+    # Returns the set of items inside this container (looking into open containers inside it)
+    def GetContainerItems(self, container_key):
+        container_items = self.container_items.get(container_key)
+        if container_items == None:
+            contents = self.items[container_key].ReadValue("contents")
+            container_items = set(self.items.FindItemsInside(list(contents))) if contents else set()
+            self.container_items[container_key] = container_items
+        return container_items
+
+
 # Master object container for items
 class ItemsMaster:
-    # Constructor
-    def __init__(self):
-        self.all_adjectives = []
-        self.all_nouns = []
-        
-        with open('items.json') as data_file:
-            self.items_dictionary = json.load(data_file)
+    # Descriptions and immutable fields that never need to be saved
+    serialize_exclude = ["name","words","adjectives","init_loc","long_desc","examine_string",
+                         "handler","look_handler"]
+
+    # Constructor (world is the compiled world from the bundle cache, or None to load items.json from world_dir)
+    def __init__(self, lexicon, world = None, world_dir = "."):
+        self.context = None
+        self.changed_keys = set()
+        self.pristine = {}
+        self.lexicon = lexicon
+        self.word_index = {}
+        self.item_order = {}
+        self.indexes_shared = False
+        self.scope = None
+
+        # item key -> the keys of everywhere the item is. This game's holders only has the items that have moved;
+        #  the rest are looked up in static_holders (see HoldersOf()).
+        self.holders = {}
+        self.static_holders = {}
+        self.static_inventory = []
+
+        if world != None:
+            # Items have already been set up and placed (in the compiled locations and inventory). The compiled items
+            #  and indexes are shared with the other games; this game's entries only hold what it changes.
+            self.pristine = world["items"]
+            self.items_dictionary = WorldEntries(self.pristine, self.changed_keys, world["nested_fields"]["items"])
+            self.word_index = world["word_index"]
+            self.item_order = world["item_order"]
+            self.indexes_shared = True
+            self.static_holders = world["holders"]
+            self.static_inventory = world["inventory"]
+            return
+
+        self.items_dictionary = WorldEntries({}, self.changed_keys)
+        with open(Path(world_dir) / 'items.json') as data_file:
+            items_data = json.load(data_file)
+        for item_key in items_data:
+            items_data[item_key]["contents"] = []
+            self.items_dictionary[item_key] = WorldEntry(item_key, items_data[item_key], self.changed_keys)
         for item_key in self.items_dictionary:
-            self.items_dictionary[item_key]["contents"] = []
+            self.InitializeItem(item_key)
+
+    # Places each item loaded from items.json at its "init_loc" (the items master must already belong to a context)
+    def PlaceInitialItems(self):
         for item_key in self.items_dictionary:
-            adjectives_list = self.items_dictionary[item_key].get("adjectives")
-            if adjectives_list != None:
-              # If adjectives are defined, we add a unique identifier to words list (combine first adj + first noun)
-              #  This is for situations where there's a red button, a blue button, etc.
-              self.items_dictionary[item_key]["words"].append(adjectives_list[0] + "_" + self.items_dictionary[item_key]["words"][0])
-              for adjective in adjectives_list:
-                if not adjective in self.all_adjectives:
-                  self.all_adjectives.append(adjective)
-            for word in self.items_dictionary[item_key]["words"]:
-              if not word in self.all_nouns:
-                self.all_nouns.append(word)
-            self.items_dictionary[item_key]["key"] = item_key
-            self.items_dictionary[item_key]["handler"] = None
-
-            # Place item in location(s)
             item_loc = self.items_dictionary[item_key].get("init_loc")
             if isinstance(item_loc, str):
                 self.PlaceItemIn(item_key, item_loc)
             elif isinstance(item_loc, list):
                 if self.items_dictionary[item_key].get("takeable?") and (len(item_loc) > 1):
-                  print("ERROR: takeable items can't have multiple init_loc")
+                  sys.stderr.write("ERROR: takeable items can't have multiple init_loc\n")
                 for il in item_loc:
                   self.PlaceItemIn(item_key, il)
 
+    # Sets up the derived fields of an item and adds its words to the lexicon and the word index
+    def InitializeItem(self, item_key):
+        item = self.items_dictionary[item_key]
+        adjectives_list = item.get("adjectives")
+        if adjectives_list != None:
+          # If adjectives are defined, we add a unique identifier to words list (combine first adj + first noun)
+          #  This is for situations where there's a red button, a blue button, etc.
+          item["words"].append(adjectives_list[0] + "_" + item["words"][0])
+          self.lexicon.AddWords(adjectives_list, Lexicon.ADJECTIVE)
+          self.IndexItemWords(item_key, adjectives_list)
+        self.lexicon.AddWords(item["words"], Lexicon.NOUN)
+        self.IndexItemWords(item_key, item["words"])
+        item["key"] = item_key
+        item["handler"] = None
+        self.item_order[item_key] = len(self.item_order)
+
+    # Adds words to the inverted index that maps each noun/adjective to the keys of the items it can describe
+    def IndexItemWords(self, item_key, words):
+        self.MakeIndexesPrivate()
+        for word in words:
+            item_keys = self.word_index.get(word)
+            if item_keys == None:
+                self.word_index[word] = {item_key}
+            else:
+                item_keys.add(item_key)
+
+    # The word index and item order are shared with the other games until this game adds an item or a word: then it
+    #  gets its own copies
+    def MakeIndexesPrivate(self):
+        if self.indexes_shared:
+            self.word_index = {word: set(item_keys) for word, item_keys in self.word_index.items()}
+            self.item_order = dict(self.item_order)
+            self.indexes_shared = False
+
+    # Adds a new item to the game while it is running, and places it at location_key (defaults to the item's "init_loc")
+    def AddItem(self, item_key, item, location_key = None):
+        item["contents"] = []
+        self.items_dictionary[item_key] = WorldEntry(item_key, item, self.changed_keys)
+        self.InitializeItem(item_key)
+        if location_key == None:
+            location_key = item.get("init_loc")
+        if isinstance(location_key, list):
+            for il in location_key:
+                self.PlaceItemIn(item_key, il)
+        else:
+            self.PlaceItemIn(item_key, location_key)
+
+    # Puts back an item that was added while the game was running (from a saved game). The saved item already has
+    #  its derived fields and contents, so it only needs to be indexed; ProcessRestorePackage() places it.
+    def RestoreItem(self, item_key, item):
+        self.items_dictionary[item_key] = WorldEntry(item_key, item, self.changed_keys)
+        self.changed_keys.add(item_key)
+        self.items_dictionary[item_key]["handler"] = None
+        adjectives_list = item.get("adjectives")
+        if adjectives_list != None:
+            self.lexicon.AddWords(adjectives_list, Lexicon.ADJECTIVE)
+            self.IndexItemWords(item_key, adjectives_list)
+        self.lexicon.AddWords(item["words"], Lexicon.NOUN)
+        self.IndexItemWords(item_key, item["words"])
+        self.item_order[item_key] = len(self.item_order)
+
+    # Adds a noun to an item while the game is running (use this rather than changing "words" directly, so the parser sees it)
+    def AddItemWord(self, item, word):
+        item_key = self.ItemKey(item)
+        self[item_key]["words"].append(word)
+        self.lexicon.AddWord(word, Lexicon.NOUN)
+        self.IndexItemWords(item_key, [word])
+
+    # Adds an adjective to an item while the game is running
+    def AddItemAdjective(self, item, adjective):
+        item_key = self.ItemKey(item)
+        if self[item_key].get("adjectives") == None:
+            self[item_key]["adjectives"] = []
+        self[item_key]["adjectives"].append(adjective)
+        self.lexicon.AddWord(adjective, Lexicon.ADJECTIVE)
+        self.IndexItemWords(item_key, [adjective])
+
+    # Returns the keys of the items that every one of these words describes (as a noun or an adjective), in load order.
+    # If item_universe is passed in, only the items in that list are considered (in the list's order).
+    def FindItemsMatchingWords(self, words, item_universe = None):
+        word_matches = []
+        for word in words:
+            item_keys = self.word_index.get(word)
+            if not item_keys:
+                return []
+            word_matches.append(item_keys)
+
+        # Intersect starting from the rarest word, so the working set is as small as possible
+        word_matches.sort(key=len)
+        matches = set(word_matches[0])
+        for item_keys in word_matches[1:]:
+            matches &= item_keys
+            if not matches:
+                return []
+
+        if item_universe != None:
+            return [item_key for item_key in item_universe if item_key in matches]
+        return sorted(matches, key=self.item_order.get)
+
     # This allows you to type "actions[<key>]" for convenience
     def __getitem__(self, key): return self.items_dictionary[key]
 
     def AddItemHandler(self, item_key, handler):
-        self[item_key]["handler"] = handler
+        self[item_key].SetUnsaved("handler", self.context.ProfileHandler("item", item_key, handler))
 
     def AddItemLookHandler(self, item_key, handler):
-        self[item_key]["look_handler"] = handler
+        self[item_key].SetUnsaved("look_handler", self.context.ProfileHandler("item_look", item_key, handler))
 
-    # Serialize items to a dictionary, excluding descriptions and immutable fields
+    # Serialize items to a dictionary, holding only the saveable fields that differ from the pristine world.
+    # Items added while the game was running aren't in the pristine world, so all of their fields are saved.
     def Serialize(self):
-        serialize_dict = {}
-        for item in self.items_dictionary.values():
-            item_entry = {}
-            for key, value in item.items():
-                if key not in ["name","words","adjectives","init_loc","long_desc","examine_string",
-                               "handler","look_handler"]:
-                    item_entry[key] = value
-            if item_entry:
-                serialize_dict[item["key"]] = item_entry
-        return(serialize_dict)
+        serialize_dict = DiffEntries(self.items_dictionary, self.changed_keys, self.pristine, self.serialize_exclude)
+        for item_key in serialize_dict:
+            if not item_key in self.pristine:
+                serialize_dict[item_key] = DiffEntries(self.items_dictionary, [item_key], {}, ["handler","look_handler"])[item_key]
+        return serialize_dict
 
     # Returns the key of an item, checking first to see if the item is already a key
     # Point of this is to make it easy to create helper functions that take an item
@@ -921,14 +2122,19 @@ class ItemsMaster:
         else:
             return item["key"]
 
+    # Returns the scope (what the player can reach and see) for this turn, computing it if anything has changed
+    def GetScope(self):
+        if self.scope == None:
+            self.scope = Scope(self, self.context.player.inventory, self.context.player.GetPlayerLocation())
+        return self.scope
+
+    # Call this whenever something changes what the player can reach or see (items moving, containers opening, lights, etc.)
+    def InvalidateScope(self):
+        self.scope = None
+
     # return list of string keys of items that are available here (in inventory or in room, including open containers)
     def ListItemsPresent(self):
-        items_present = []
-        for item in player.inventory:
-            items_present.append(item)
-        for item in player.GetPlayerLocation()["items"]:
-            items_present.append(item)
-        return self.FindItemsInside(items_present)
+        return list(self.GetScope().items_present)
     
     # appends the item contents to the end of the item description
     def AppendItemContentsToDescription(self, item_string, item_key, indent):
@@ -938,18 +2144,19 @@ class ItemsMaster:
                 item_string += " It"
             else:
                 item_string += ", which"
-            if len(item["contents"]) == 0:
-                context.Print(item_string + " is empty")
+            contents = item.ReadValue("contents")
+            if len(contents) == 0:
+                self.context.Print(item_string + " is empty")
             else:
-                context.Print(item_string + " contains:")
-                self.ListItems(item["contents"], indent=indent+2)
+                self.context.Print(item_string + " contains:")
+                self.ListItems(contents, indent=indent+2)
         else:
-            context.Print(item_string)    
+            self.context.Print(item_string)    
 
     # List a set of items, passed in by key (e.g. player inventory), including container contents
     def ListItems(self, item_list, decorate = "@", article = "a", indent = 0, blank_line = False, announce_if_nothing = True):
         if (len(item_list) == 0) and announce_if_nothing:
-            Print(' ' * indent + "Nothing")
+            self.context.Print(' ' * indent + "Nothing")
         else:
             first_item = True
             if decorate == "":
@@ -961,10 +2168,10 @@ class ItemsMaster:
                     continue
                 if first_item:
                     if blank_line:
-                        print()
+                        self.context.Print("")
                     first_item = False
                 handler = self[item_key].get("look_handler")
-                if (not handler) or (not handler(context, indent)):
+                if (not handler) or (not handler(self.context, indent)):
                     item_string = ' ' * indent + decorate[0] + self.GetLongDescription(item_key, article) + decorate[1]
                     self.AppendItemContentsToDescription(item_string, item_key, indent)
 
@@ -973,26 +2180,37 @@ class ItemsMaster:
         return_list = items_list
         for item in items_list:
             if self[item].get("is_open?"):
-                for item_inside in self[item]["contents"]:
+                for item_inside in self[item].ReadValue("contents"):
                     return_list.append(item_inside)
         return return_list
 
     # is this item in the list of item keys (looking into containers)
     def TestIfItemIsIn(self, item, container, container_must_be_open = True):
         item_key = self.ItemKey(item)
+
+        # The usual questions (is it in the inventory, the room, or a container?) can be answered from this turn's scope
+        if container_must_be_open:
+            scope = self.GetScope()
+            if container is scope.inventory:
+                return item_key in scope.inventory_items
+            if IsSameList(container, scope.location_items_list):
+                return item_key in scope.location_items
+            if not IsItemList(container):
+                return item_key in scope.GetContainerItems(self.ItemKey(container))
+
         container_contents = []
-        if isinstance(container, list):
+        if IsItemList(container):
             container_contents = container
         else:
             container_key = self.ItemKey(container)
-            contents = self[container_key].get("contents")
+            contents = self[container_key].ReadValue("contents")
             if contents:
                 container_contents = contents
 
         if item_key in container_contents:
             return True
         for item in container_contents:
-            if self.TestIfItemIsIn(item_key, self[item]["contents"]) and ((not container_must_be_open) or self[item].get("is_open?")):
+            if self.TestIfItemIsIn(item_key, self[item].ReadValue("contents")) and ((not container_must_be_open) or self[item].get("is_open?")):
                 return True            
         return False
 
@@ -1001,15 +2219,11 @@ class ItemsMaster:
         item_key = self.ItemKey(item)
         if (item_key == "ALL") or (item_key == "NUMBER"):
             return True
-        if self.TestIfItemIsIn(item_key, player.inventory):
-            return True
-        if locations.IsDark() or (not self.TestIfItemIsIn(item_key, player.GetPlayerLocation()["items"])):
-            return False
-        return True
+        return item_key in self.GetScope().visible_items
 
     # Prints a warning that you can't see any such item at the moment
     def YouCantSeeItemHere(self, word):
-        Print("You can't see any " + str.lower(word) + " here!")
+        self.context.Print("You can't see any " + str.lower(word) + " here!")
 
     # Obtains a long description for the item (with backups if that field hasn't been specified in the locations file)
     def GetLongDescription(self, item, article = ""):
@@ -1034,18 +2248,18 @@ class ItemsMaster:
     def GetAll(self):
         # Need to make a copy of the list of items to get first (because we're updating loc["items"] in the loop
         get_list = []
-        for item_key in player.GetPlayerLocation()["items"]:
+        for item_key in self.context.player.GetPlayerLocation()["items"]:
             get_list.append(item_key)
 
         taken_items = 0
         for item_key in get_list:
-            if items[item_key].get("takeable?"):
-                print(items[item_key]["name"].capitalize() + " : ", end='')
+            if self[item_key].get("takeable?"):
+                self.context.Write(self[item_key]["name"].capitalize() + " : ")
                 self.GetItem(item_key)
                 taken_items += 1
 
         if taken_items == 0:
-            Print("There is nothing here to take!")
+            self.context.Print("There is nothing here to take!")
 
     # Does a "get all from"
     def GetAllFrom(self, container):
@@ -1053,7 +2267,7 @@ class ItemsMaster:
 
         # Is this a container?
         if (not self[container_key].get("is_container?")) and (not self[container_key].get("contents")):
-            Print("You can't do that.")
+            self.context.Print("You can't do that.")
             return
 
         # Need to make a copy of the list of items to get first (because we're updating loc["items"] in the loop
@@ -1064,85 +2278,91 @@ class ItemsMaster:
         taken_items = 0
         for item_key in get_list:
             if self[item_key].get("takeable?"):
-                print(self[item_key]["name"].capitalize() + " : ", end='')
+                self.context.Write(self[item_key]["name"].capitalize() + " : ")
                 self.GetItem(item_key)
                 taken_items += 1
 
         if taken_items == 0:
-            Print("There is nothing inside to take!")
+            self.context.Print("There is nothing inside to take!")
 
     # Does a get on one item
     def GetItem(self, item):
         item_key = self.ItemKey(item)
-        Print("Taken.")
-        if item_key in player.GetPlayerLocation()["items"]:
-            player.GetPlayerLocation()["items"].remove(item_key)
+        self.InvalidateScope()
+        self.context.Print("Taken.")
+        holders = self.GetItemHolders(item_key)
+        if self.context.player.location in holders:
+            self.RemoveItemFromHolder(item_key, self.context.player.location)
         else:
-            for container_key in self.items_dictionary:
-                if item_key in self[container_key]["contents"]:
-                    self[container_key]["contents"].remove(item_key)
-                    
-        player.inventory.append(item_key)
+            for holder_key in holders:
+                if (holder_key != "PLAYER") and (not holder_key in self.context.locations.locations_dictionary):
+                    self.RemoveItemFromHolder(item_key, holder_key)
+
+        self.PlaceItemIn(item_key, "PLAYER")
 
     # Does a "drop all"
     def DropAll(self):
         # Need to make a copy of the list of items to drop first (because we're updating player.inventory in the loop
         drop_list = []
-        for item_key in player.inventory:
+        for item_key in self.context.player.inventory:
             drop_list.append(item_key)
 
         if len(drop_list) == 0:
-            Print("You aren't carrying anything!")
+            self.context.Print("You aren't carrying anything!")
             return
 
         for item_key in drop_list:
-            print(items[item_key]["name"].capitalize() + " : ", end='')
+            self.context.Write(self[item_key]["name"].capitalize() + " : ")
             self.DropItem(item_key)
 
     def PutAllIn(self, container):
         container_key = self.ItemKey(container)
 
         if self[container_key].get("openable?") and not self[container_key].get("is_open?"):
-            context.PrintItemInString("The @ is closed.", self[container_key])
+            self.context.PrintItemInString("The @ is closed.", self[container_key])
             return
 
         # Need to make a copy of the list of items to put first (because we're updating player.inventory in the loop
         put_list = []
-        for item_key in player.inventory:
+        for item_key in self.context.player.inventory:
             if (not item_key == container_key) and (not self.TestIfItemIsIn(container_key, item_key)):
                 put_list.append(item_key)
 
         if len(put_list) == 0:
             print_str = "You aren't carrying anything"
-            if len(player.inventory) >= 1:
+            if len(self.context.player.inventory) >= 1:
                 print_str += " that you can place in that"
-            Print(print_str + "!")
+            self.context.Print(print_str + "!")
             return
 
         for item_key in put_list:
-            print(items[item_key]["name"].capitalize() + " : Done.")
+            self.context.Print(self[item_key]["name"].capitalize() + " : Done.")
             self.MoveItemTo(item_key, container_key)
 
     # Does a drop on one item
     def DropItem(self, item):
         item_key = self.ItemKey(item)
-        Print("Dropped.")
-        player.GetPlayerLocation()["items"].append(item_key)
-        player.inventory.remove(item_key)
+        self.InvalidateScope()
+        self.context.Print("Dropped.")
+        self.PlaceItemIn(item_key, self.context.player.location)
+        self.RemoveItemFromHolder(item_key, "PLAYER")
 
     # Removes an item from the game (can always be re-added to inventory or a location or container)
     def RemoveItemFromGame(self, item):
         item_key = self.ItemKey(item)
-        if item_key in player.inventory:
-            player.inventory.remove(item_key)
-        for container_key in self.items_dictionary:
-            contents = self[container_key].get("contents")
-            if contents and (item_key in contents):
-                self[container_key]["contents"].remove(item_key)
-        for location_key in locations.locations_dictionary:
-            contents = locations.locations_dictionary[location_key].get("items")
-            if contents and (item_key in contents):
-                locations[location_key]["items"].remove(item_key)
+        self.InvalidateScope()
+        for holder_key in self.GetItemHolders(item_key):
+            self.RemoveItemFromHolder(item_key, holder_key)
+
+    # Opens or closes a container or door (use this rather than setting "is_open?" directly, so the scope is refreshed)
+    def SetOpen(self, item, is_open):
+        self[self.ItemKey(item)]["is_open?"] = is_open
+        self.InvalidateScope()
+
+    # Turns a light source on or off (use this rather than setting "light_source?" directly, so darkness is refreshed)
+    def SetLightSource(self, item, is_light_source):
+        self[self.ItemKey(item)]["light_source?"] = is_light_source
+        self.InvalidateScope()
 
     # Moves an item from its current location to a new location (location can also be "PLAYER" or a container item key)
     def MoveItemTo(self, item, location_key):
@@ -1154,133 +2374,527 @@ class ItemsMaster:
     # (Doesn't remove item from any locations it may already be; location_key cannot be a list)
     def PlaceItemIn(self, item, location_key):
         item_key = self.ItemKey(item)
-        if location_key == "PLAYER":
-            player.inventory.append(item_key)
-        elif not location_key == None:
-            # Attempt to place item in location
-            item_placed = False
-            for place_key in locations.locations_dictionary:
-                if place_key == location_key:
-                    locations[place_key]["items"].append(item_key)
-                    item_placed = True
-                    break
+        self.InvalidateScope()
+        holder_list = self.GetHolderList(location_key)
+        if holder_list != None:
+            holder_list.append(item_key)
+            self.MarkHolderChanged(location_key)
+            self.EditableHolders(item_key).append(location_key)
+
+    # Returns the list that holds items for this key: the player's inventory ("PLAYER"), a location's items,
+    #  or a container's contents (or None if there is no such place)
+    def GetHolderList(self, holder_key):
+        if holder_key == "PLAYER":
+            return self.context.player.inventory
+        if holder_key in self.context.locations.locations_dictionary:
+            return self.context.locations[holder_key]["items"]
+        if holder_key in self.items_dictionary:
+            return self[holder_key]["contents"]
+        return None
 
-            # Attempt to place item in a container
-            if not item_placed:
-                for container_key in self.items_dictionary:
-                    if container_key == location_key:
-                        self.items_dictionary[container_key]["contents"].append(item_key)
-                        break
+    # Returns the keys of everywhere this item currently is: locations, containers, or "PLAYER" (usually just one place)
+    def GetItemHolders(self, item):
+        return list(self.HoldersOf(self.ItemKey(item)))
+
+    # Returns the list of this item's holders (which must not be changed; see EditableHolders())
+    def HoldersOf(self, item_key):
+        holders = self.holders.get(item_key)
+        if holders == None:
+            holders = self.static_holders.get(item_key, [])
+        return holders
+
+    # Returns this game's own list of the item's holders, copying it from the shared world the first time.
+    # (An item that is nowhere keeps an empty list, so the shared world's holders don't show through.)
+    def EditableHolders(self, item_key):
+        holders = self.holders.get(item_key)
+        if holders == None:
+            holders = list(self.static_holders.get(item_key, []))
+            self.holders[item_key] = holders
+        return holders
+
+    # Takes an item out of one particular place (a location key, a container item key, or "PLAYER")
+    def RemoveItemFromHolder(self, item, holder_key):
+        item_key = self.ItemKey(item)
+        self.InvalidateScope()
+        if holder_key in self.HoldersOf(item_key):
+            self.EditableHolders(item_key).remove(holder_key)
+        holder_list = self.GetHolderList(holder_key)
+        if (holder_list != None) and (item_key in holder_list):
+            holder_list.remove(item_key)
+            self.MarkHolderChanged(holder_key)
+
+    # Records that a location's items or a container's contents have changed, so the next save includes them
+    # (the player's inventory is always saved in full)
+    def MarkHolderChanged(self, holder_key):
+        if holder_key in self.context.locations.locations_dictionary:
+            self.context.locations.changed_keys.add(holder_key)
+        elif holder_key in self.items_dictionary:
+            self.changed_keys.add(holder_key)
+
+    # Rebuilds the item -> holders index from the inventory, location items and container contents.
+    # This is needed after those lists have been replaced wholesale (e.g. by a restore). Lists this game hasn't
+    #  changed are still as in the shared world, so only the items in changed lists need their holders worked out again.
+    def RebuildHolders(self):
+        changed_lists = {"PLAYER": (self.static_inventory, self.context.player.inventory)}
+        for location_key, location in self.context.locations.locations_dictionary.OwnEntries():
+            if location.HasOwnValue("items"):
+                changed_lists[location_key] = (location.StaticValue("items", []), location["items"])
+        for container_key, container in self.items_dictionary.OwnEntries():
+            if container.HasOwnValue("contents"):
+                changed_lists[container_key] = (container.StaticValue("contents", []), container["contents"])
+
+        affected_items = set()
+        for static_list, current_list in changed_lists.values():
+            affected_items.update(static_list)
+            affected_items.update(current_list)
+        self.holders = {}
+        for item_key in affected_items:
+            holders = [holder_key for holder_key in self.static_holders.get(item_key, []) if not holder_key in changed_lists]
+            for holder_key, (static_list, current_list) in changed_lists.items():
+                if item_key in current_list:
+                    holders.append(holder_key)
+            self.holders[item_key] = holders
+        self.InvalidateScope()
 
 
 ######################### EVENTS #########################
 
 
 class Event:
+    # Events restored from older saves only have trigger_turn and event_func, so the newer attributes default here
+    name = None
+    interval = None
+    message = None
+    cancelled = False
+
     # Constructor
-    def __init__(self, trigger_turn, event_func):
+    # (an event either calls event_func(context) or, if event_func is None, prints its message)
+    def __init__(self, trigger_turn, event_func, name = None, interval = None, message = None):
         self.trigger_turn = trigger_turn
         self.event_func = event_func
+        self.name = name
+        self.interval = interval
+        self.message = message
+        self.cancelled = False
+
+    # Convert to a dictionary for saving. The function is saved by name, so it must be a plain function
+    #  defined in one of the handler modules (not a lambda or a nested function).
+    def Serialize(self):
+        record = {"trigger_turn": self.trigger_turn}
+        if self.event_func != None:
+            record["function"] = EventFunctionName(self.event_func)
+        if self.name != None:
+            record["name"] = self.name
+        if self.interval != None:
+            record["interval"] = self.interval
+        if self.message != None:
+            record["message"] = self.message
+        return record
+
+    # Rebuild an event from a saved dictionary (or from an event object in an old pickle save)
+    @staticmethod
+    def Deserialize(record):
+        if not isinstance(record, dict):
+            record = record.__dict__
+        event_func = record.get("function", record.get("event_func"))
+        if isinstance(event_func, str):
+            event_func = FindEventFunction(event_func)
+        return Event(record["trigger_turn"], event_func, record.get("name"), record.get("interval"), record.get("message"))
+
+# The modules that saved events are allowed to call functions from
+def EventModules():
+    return {"action_handlers": action_handlers, "item_handlers": item_handlers,
+            "location_handlers": location_handlers, "globals": globals, "game": sys.modules[__name__]}
+
+# Returns the "module.function" name a saved event uses to refer to its function
+def EventFunctionName(event_func):
+    module_name = getattr(event_func, "__module__", None)
+    if module_name == "__main__":
+        module_name = "game"
+    function_name = getattr(event_func, "__qualname__", "")
+    module = EventModules().get(module_name)
+    if (module == None) or (not function_name.isidentifier()) or (not getattr(module, function_name, None) is event_func):
+        raise save_format.SaveFormatError("events can only be saved if they call a function defined at the top level of a handler module")
+    return module_name + "." + function_name
+
+# Finds the function for a saved event's "module.function" name
+def FindEventFunction(function_name):
+    module_name, _, name = function_name.partition(".")
+    module = EventModules().get(module_name)
+    event_func = None
+    if (module != None) and name.isidentifier():
+        event_func = getattr(module, name, None)
+    if not callable(event_func):
+        raise save_format.SaveFormatError("save file refers to an unknown event function: " + function_name)
+    return event_func
 
 class EventsMaster:
     # Constructor
     def __init__(self):
-        self.events = []
+        self.context = None
 
-    def Serialize(self):
-        return self.events
+        # The queue is a heap of (trigger_turn, sequence, event); the sequence number keeps events that trigger
+        #  on the same turn in the order they were created
+        self.event_queue = []
+        self.named_events = {}
+        self.next_sequence = 0
+        self.cancelled_count = 0
 
-    # Each turn, we go through the event queue to see if any are supposed to trigger this turn.
+    # Returns the pending events as a list of dictionaries, in the order they will trigger
+    def Serialize(self):
+        return [entry[2].Serialize() for entry in sorted(self.event_queue) if not entry[2].cancelled]
+
+    # Replaces the queue with a list of saved events
+    def Deserialize(self, events_list):
+        self.event_queue = []
+        self.named_events = {}
+        self.next_sequence = 0
+        self.cancelled_count = 0
+        for record in events_list:
+            self.ScheduleEvent(record if isinstance(record, Event) else Event.Deserialize(record))
+
+    # Each turn, we trigger the events at the front of the queue that are due this turn.
     def CheckEvents(self, turn_counter):
-        new_events = []
-        for event in self.events:
+        while self.event_queue and (self.event_queue[0][0] <= turn_counter):
+            event = heapq.heappop(self.event_queue)[2]
+            if event.cancelled:
+                self.cancelled_count -= 1
+                continue
             if event.trigger_turn == turn_counter:
-                event.event_func(context)
-            elif event.trigger_turn > turn_counter:
-                new_events.append(event)
-        self.events = new_events
-
-    # Add an event to the queue, happening in n moves
-    def CreateEventInNMoves(self, event_func, n):
-        self.events.append(Event(state.turn_counter + n, event_func))
+                if event.event_func != None:
+                    event.event_func(self.context)
+                else:
+                    self.context.Print(event.message)
+            if event.cancelled:
+                self.cancelled_count = max(0, self.cancelled_count - 1)
+            elif event.interval:
+                event.trigger_turn = turn_counter + event.interval
+                self.ScheduleEvent(event)
+            elif self.named_events.get(event.name) is event:
+                del self.named_events[event.name]
+
+    # Adds an event object to the queue. A named event replaces any pending event with the same name.
+    def ScheduleEvent(self, event):
+        if event.name != None:
+            existing = self.named_events.get(event.name)
+            if (existing != None) and (not existing is event):
+                self.CancelEvent(existing)
+            self.named_events[event.name] = event
+        heapq.heappush(self.event_queue, (event.trigger_turn, self.next_sequence, event))
+        self.next_sequence += 1
+        return event
+
+    # Add an event to the queue, happening in n moves. Returns the event, which can be passed to CancelEvent().
+    def CreateEventInNMoves(self, event_func, n, name = None):
+        return self.ScheduleEvent(Event(self.context.state.turn_counter + n, event_func, name))
+
+    # Add an event that happens in n moves and then again every interval moves, until it is cancelled
+    def CreateRecurringEvent(self, event_func, n, interval, name = None):
+        return self.ScheduleEvent(Event(self.context.state.turn_counter + n, event_func, name, max(1, interval)))
+
+    # Returns the pending event with this name (or None)
+    def GetEvent(self, name):
+        return self.named_events.get(name)
+
+    # Cancels a pending event, passed in either as the event returned when it was created or by name.
+    # Returns True if there was a pending event to cancel.
+    def CancelEvent(self, event):
+        if isinstance(event, str):
+            event = self.named_events.get(event)
+        if (event == None) or event.cancelled:
+            return False
+        event.cancelled = True
+        self.cancelled_count += 1
+        if (event.name != None) and (self.named_events.get(event.name) is event):
+            del self.named_events[event.name]
+
+        # Cancelled events are left in the queue and skipped when they come up; if they pile up, clear them out
+        if self.cancelled_count > 64 and self.cancelled_count * 2 > len(self.event_queue):
+            self.event_queue = [entry for entry in self.event_queue if not entry[2].cancelled]
+            heapq.heapify(self.event_queue)
+            self.cancelled_count = 0
+        return True
 
     # This is useful if you want to add a statement to the bottom of whatever will normally be printed.
     def PrintBelow(self, string):
-        self.CreateEventInNMoves(lambda x: Print("\n" + string), 0)
+        self.PrintStringInNMoves(string, 0)
 
     # This adds a simple event in N moves which prints a string
     def PrintStringInNMoves(self, string, n):
-        self.CreateEventInNMoves(lambda x: Print("\n" + string), n)
-
-
-######################### HELPER FUNCTIONS #########################
-
-def Print(string):
-    context.Print(string)
-
-def PrintItemInString(default_string, item):
-    context.PrintItemInString(default_string, item)
-
-######################### MAIN LOOP #########################
-
-# Set up the master object containers and the context container
-player = Player()
-locations = LocationsMaster()
-actions = ActionsMaster()
-items = ItemsMaster()
-events = EventsMaster()
-state = State()
-context = Context(player, locations, actions, items, state, events)
-action_handlers.Register(context)
-item_handlers.Register(context)
-location_handlers.Register(context)
+        return self.ScheduleEvent(Event(self.context.state.turn_counter + n, None, message = "\n" + string))
+
+
+######################### TRANSCRIPTS #########################
+
+
+# A session can record a transcript of its game: everything the player typed (including the answers to save and
+#  restore prompts), with the turn number and a short hash of the output of each turn. replay.py plays transcripts
+#  back and checks that each turn still prints the same thing, e.g. to re-run real players' games after a change, or
+#  to reproduce a bug that a player ran into.
+#
+# A transcript is a text file of JSON lines. The first line is the header:
+#   {"transcript": 1, "world": <hash of the world's source files>, "width": <output width>, "saves": {...}}
+#   "saves" holds the save files in the session's save directory when recording began (file name -> [modified time in
+#   nanoseconds, base64 data]), since the save slots a game lists and restores depend on them. If the game was
+#   already under way, "state" holds the session at that point (base64 Context.SerializeSession()).
+# Each line after that is one turn:
+#   {"start": true, "output": <hash>}                                 the introduction (from Context.StartGame())
+#   {"turn": 3, "input": "open door", "output": <hash>}               a command
+#   {"turn": 4, "input": "2", "prompt": true, "output": <hash>}       an answer to a save/restore prompt
+#   {"turn": 5, "input": "s", "crashed": true}                          a command that raised an exception
+#   (plus "width": <columns> whenever the session's output width has changed since the line before)
+# Each turn is appended to the file as soon as it is played, so a transcript is complete up to the last turn even if
+#  the process dies.
+TRANSCRIPT_VERSION = 1
+TRANSCRIPT_SUFFIX = ".transcript"
+
+# Returns the hash of a turn's output that transcripts keep (rather than the output itself)
+def OutputHash(output):
+    return hashlib.blake2b(output.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# Writes a session's transcript (Context.StartRecording() creates one)
+class TranscriptRecorder:
+    def __init__(self, path, width = DEFAULT_WIDTH):
+        self.path = Path(path)
+        self.width = width
+
+    # Starts the transcript file, with the session's state if its game has already begun
+    def WriteHeader(self, context, session_data = None):
+        header = {}
+        header["transcript"] = TRANSCRIPT_VERSION
+        header["world"] = world_bundle.SourceHash(context.engine.world_dir).hex() if context.engine != None else None
+        header["width"] = context.width
+        header["saves"] = self.ReadSaves(context)
+        if session_data != None:
+            header["state"] = base64.b64encode(session_data).decode("ascii")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(header, separators=(',', ':')) + "\n")
+
+    # Returns the save files in the session's save directory
+    def ReadSaves(self, context):
+        save_dir = Path.cwd() / "save_data" if context.save_dir == None else Path(context.save_dir)
+        saves = {}
+        if save_dir.is_dir():
+            for save_path in sorted(save_dir.glob("game_data*")):
+                saves[save_path.name] = [save_path.stat().st_mtime_ns, base64.b64encode(save_path.read_bytes()).decode("ascii")]
+        return saves
+
+    def RecordStart(self, context, output):
+        self.AppendEntry(context, {"start": True}, output)
+
+    def RecordTurn(self, context, turn_number, command, answered_prompt, output):
+        entry = {"turn": turn_number, "input": command}
+        if answered_prompt:
+            entry["prompt"] = True
+        self.AppendEntry(context, entry, output)
+
+    # (output is None for a turn that crashed)
+    def AppendEntry(self, context, entry, output):
+        if context.width != self.width:
+            entry["width"] = context.width
+            self.width = context.width
+        if output == None:
+            entry["crashed"] = True
+        else:
+            entry["output"] = OutputHash(output)
+        with open(self.path, "a") as transcript_file:
+            transcript_file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+# Reads a transcript file, returning its header and its list of turns (raises ValueError if it isn't a transcript)
+def ReadTranscript(path):
+    with open(path) as transcript_file:
+        lines = [line for line in transcript_file.read().splitlines() if line.strip()]
+    if len(lines) == 0:
+        raise ValueError("empty transcript")
+    header = json.loads(lines[0])
+    if (not isinstance(header, dict)) or (header.get("transcript") != TRANSCRIPT_VERSION):
+        raise ValueError("not a version " + str(TRANSCRIPT_VERSION) + " transcript")
+    return header, [json.loads(line) for line in lines[1:]]
+
+
+######################### ENGINE #########################
+
+# Converts freshly loaded masters into plain data for the world bundle cache (before any handlers are registered)
+def ExportWorld(player, locations, lexicon, actions, items):
+    world = {}
+    world["locations"] = {}
+    for loc_key in locations.locations_dictionary:
+        world["locations"][loc_key] = dict(locations[loc_key])
+    world["items"] = {}
+    for item_key in items.items_dictionary:
+        world["items"][item_key] = dict(items[item_key])
+    world["actions"] = actions.actions_dictionary
+    world["inventory"] = player.inventory
+    world["lexicon"] = lexicon.roles
+    world["word_index"] = items.word_index
+    world["item_order"] = items.item_order
+    world["holders"] = items.holders
+    world["nested_fields"] = {}
+    for section in ["locations", "items", "actions"]:
+        world["nested_fields"][section] = FindNestedFields(world[section])
+    world["dispatch_table"] = {}
+    for dispatch_key, dispatch in actions.dispatch_table.items():
+        world["dispatch_table"][dispatch_key] = dispatch.action_key
+    return world
+
+# This class loads the game world (the JSON files in world_dir) and creates independent game sessions from it.
+# Each session is a Context bound only to its own masters, so one process can run any number of games.
+#
+# Sessions are built from ready-made sets of masters (loaded, with their handlers registered). If StartWarmPool() has
+#  been called, a background thread keeps a pool of these topped up, so starting or restarting a game only has to
+#  take one from the pool.
+class Engine:
+    def __init__(self, world_dir = None):
+        self.world_dir = Path.cwd() if world_dir == None else Path(world_dir)
+        self.shared_dispatch_table = (None, None)
+        self.warm_pool = collections.deque()
+        self.warm_pool_size = 0
+        self.warm_pool_wanted = threading.Event()
+        self.warm_pool_thread = None
+        self.turn_timer = None
+        self.handler_profiler = None
+        self.record_dir = None
+        self.transcript_numbers = itertools.count(1)
+
+    # Turns on turn timing for every session of this engine (see TURN TIMING): turns slower than slow_turn_ms are
+    #  logged to log_path (or to stderr)
+    def EnableTurnTiming(self, slow_turn_ms = DEFAULT_SLOW_TURN_MS, log_path = None):
+        self.turn_timer = TurnTimer(slow_turn_ms, log_path)
+        return self.turn_timer
+
+    # Turns on handler profiling (see HANDLER PROFILING). Only sessions started from now on are profiled, so sessions
+    #  already waiting in the warm pool are thrown away (though one being built at that moment may still get through).
+    def EnableHandlerProfiling(self):
+        self.handler_profiler = HandlerProfiler()
+        self.warm_pool.clear()
+        if self.warm_pool_thread != None:
+            self.warm_pool_wanted.set()
+        return self.handler_profiler
+
+    # Records a transcript of every game started from now on (see TRANSCRIPTS), each in its own file in record_dir
+    def EnableRecording(self, record_dir):
+        self.record_dir = Path(record_dir)
+
+    # Returns a new file name for a transcript in record_dir
+    def NewTranscriptPath(self):
+        name = time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid()) + "-" + str(next(self.transcript_numbers))
+        return self.record_dir / (name + TRANSCRIPT_SUFFIX)
+
+    # Returns new master objects for a fresh game: player, locations, actions, items, state, events.
+    # Every game shares the compiled world from the bundle cache (compiling the JSON files first if the bundle isn't up
+    #  to date with them), and its masters only hold what that game changes.
+    def LoadMasters(self):
+        world = world_bundle.ReadBundle(self.world_dir)
+        if world == None:
+            self.CompileWorld()
+            world = world_bundle.ReadBundle(self.world_dir)
+        player = Player(list(world["inventory"]))
+        locations = LocationsMaster(world)
+        lexicon = Lexicon(world["lexicon"], shared = True)
+        source_hash, dispatch_table = self.shared_dispatch_table
+        actions = ActionsMaster(lexicon, world, dispatch_table = dispatch_table if source_hash == world["source_hash"] else None)
+        self.shared_dispatch_table = (world["source_hash"], actions.dispatch_table)
+        items = ItemsMaster(lexicon, world)
+        return player, locations, actions, items, State(), EventsMaster()
+
+    # Loads the world from the JSON files, places the items and writes the result to the bundle cache
+    def CompileWorld(self):
+        player = Player()
+        locations = LocationsMaster(world_dir = self.world_dir)
+        lexicon = Lexicon()
+        actions = ActionsMaster(lexicon, world_dir = self.world_dir)
+        items = ItemsMaster(lexicon, world_dir = self.world_dir)
+
+        # Items are placed in their locations and inventory through the context, so bind one while loading
+        Context(player, locations, actions, items, State(), EventsMaster())
+        items.PlaceInitialItems()
+        world_bundle.WriteBundle(self.world_dir, ExportWorld(player, locations, lexicon, actions, items))
+
+    # Returns the source hash of the world and a new set of masters for it, with the handlers registered
+    def BuildMasters(self):
+        source_hash = world_bundle.SourceHash(self.world_dir)
+        masters = self.LoadMasters()
+        self.RegisterHandlers(Context(*masters, engine = self))
+        return source_hash, masters
+
+    # Returns a set of masters for a new game, from the warm pool if it has any for the current version of the world
+    def TakeMasters(self):
+        if self.warm_pool_thread != None:
+            self.warm_pool_wanted.set()
+            source_hash = world_bundle.SourceHash(self.world_dir)
+            while True:
+                try:
+                    masters_hash, masters = self.warm_pool.popleft()
+                except IndexError:
+                    break
+                if masters_hash == source_hash:
+                    return masters
+        return self.BuildMasters()[1]
+
+    # Keeps size sets of masters ready in the background (size 0 stops making more)
+    def StartWarmPool(self, size):
+        self.warm_pool_size = size
+        if self.warm_pool_thread == None:
+            self.warm_pool_thread = threading.Thread(target=self.FillWarmPool, daemon=True)
+            self.warm_pool_thread.start()
+        self.warm_pool_wanted.set()
+
+    # Runs in the warm pool's thread: tops the pool up whenever a set of masters has been taken
+    def FillWarmPool(self):
+        while True:
+            self.warm_pool_wanted.wait()
+            self.warm_pool_wanted.clear()
+            while len(self.warm_pool) < self.warm_pool_size:
+                self.warm_pool.append(self.BuildMasters())
+
+    # Creates a new game session (call StartGame() on it to begin). Its output is written to io, if one is passed in,
+    #  and it saves to save_dir (or to save_data in the current directory).
+    def NewSession(self, io = None, save_dir = None):
+        context = Context(*self.TakeMasters(), engine = self, io = io, save_dir = save_dir)
+        if self.record_dir != None:
+            context.StartRecording(self.NewTranscriptPath(), from_start = True)
+        return context
+
+    # Recreates a session packed up by Context.SerializeSession() (raises save_format.SaveFormatError if the data is bad,
+    #  or doesn't fit this world, e.g. a session packed up by an older version of the game)
+    def LoadSession(self, data, io = None):
+        sections = save_format.DecodeSave(data)
+        session = sections.get("session", {})
+        prompt = session.get("prompt")
+        if (prompt != None) and (not prompt[0] in ["SaveToSlot", "RestoreFromSlot"]):
+            raise save_format.SaveFormatError("session is waiting on an unknown prompt: " + str(prompt[0]))
+        context = Context(*self.TakeMasters(), engine = self, io = io, save_dir = session.get("save_dir"))
+        globals.InitialSetup(context)
+        restore_package = [sections, sections["events"]]
+        context.CheckRestorePackage(restore_package)
+        context.ProcessRestorePackage(restore_package)
+        context.state.DeserializeTransient(session.get("state", {}))
+        context.width = session.get("width", DEFAULT_WIDTH)
+        if prompt != None:
+            context.pending_prompt = (getattr(context, prompt[0]), prompt[1])
+
+        # A session that was recording carries on with the same transcript
+        if session.get("transcript") != None:
+            context.transcript = TranscriptRecorder(session["transcript"], context.width)
+        return context
+
+    # Starts a session over with a fresh world (for a restart or a restore), keeping the same context object
+    def ResetSession(self, context):
+        context.SetMasters(*self.TakeMasters())
+
+    def RegisterHandlers(self, context):
+        action_handlers.Register(context)
+        item_handlers.Register(context)
+        location_handlers.Register(context)
 
 # Here is the MAIN LOOP
-def Play():
-    global player
-    global locations
-    global actions
-    global items
-    global events
-    global state
-    global context
-    restoring = False
-    restore_package = None
-    while not state.quit_confirmed:
-        globals.InitialSetup(context)
-        if restoring:
-            context.ProcessRestorePackage(restore_package)
-            restore_package = None
-            restoring = False
-        else:
-            globals.IntroText(context)
-
-        locations.DoLook()
-        while not (state.quit_confirmed or state.restart_confirmed or state.restore_requested):
-            print()
-            actions.ParseCommand(input("> "))
-            state.PostProcess()
-
-            if state.restore_requested:
-                restore_package = context.LoadRestorePackage()
-                if restore_package:
-                    restoring = True
-                else:
-                    state.restore_requested = False
-
-        # Handle restart or restore
-        if state.restart_confirmed or restoring:
-            player = Player()
-            locations = LocationsMaster()
-            actions = ActionsMaster()
-            items = ItemsMaster()
-            events = EventsMaster()
-            state = State()
-            context = Context(player, locations, actions, items, state, events)
-            action_handlers.Register(context)
-            item_handlers.Register(context)
-            location_handlers.Register(context)
+def Play(world_dir = None, io = None):
+    context = Engine(world_dir).NewSession(io if io != None else ConsoleIO())
+    context.StartGame()
+    while not context.IsFinished():
+        context.RunTurn(context.io.ReadLine(context.Prompt()))
 
 
 if __name__ == "__main__":
-   Play()
\ No newline at end of file
+   Play()
@@ -1,7 +1,7 @@
 # This function is called as the game is starting. Use it to print introduction text.
 def IntroText(context):
     context.Print("Welcome adventurer!")
-    print()
+    context.Print("")
 
 # This function is called as the game is starting. Use it to initialize game settings
 #  like the player's starting location.
@@ -0,0 +1,268 @@
+### THIS FILE SERVES THE GAME AS A STATELESS HTTP/JSON API ###
+
+# Run "python http_api.py" and POST turns to http://localhost:8000/turn. The server keeps nothing between requests:
+#  the whole game travels with each request and response, so any number of these servers can sit behind a load
+#  balancer with no sticky sessions.
+#
+# Request:  {"state": <state from the last response, or null to start a new game>, "command": "open door"}
+#           (plus "width": <columns> to wrap the output to a width other than game.DEFAULT_WIDTH; it is kept in the state)
+# Response: {"output": "...", "prompt": "\n> ", "finished": false, "state": "<new state>"}
+#
+# The state is Context.SerializeSession() (a compressed save_format file), signed with HMAC-SHA256 and encoded as
+#  base64 text. The signature stops players from editing their state, so the server only ever unpacks states it
+#  made itself. Every server behind the same load balancer needs the same secret (--secret, or the GAME_STATE_SECRET
+#  environment variable). The game's save slots live on the server's disk, so SAVE and RESTORE are turned off here:
+#  a client that wants to keep a game just keeps its state.
+#
+# With --slow-turn-ms, every turn is timed and the slow ones are logged (see TURN TIMING in game.py), and GET /stats
+#  returns the timings so far as JSON. With --profile-handlers FILE, every handler call is recorded (see HANDLER
+#  PROFILING in game.py), and the handlers' stacks are written to FILE for a flame graph when the server stops.
+#
+# "python http_api.py --bench 2000" times the full cycle of a request (unpack the state, run the turn, pack the new
+#  state) without the HTTP part.
+
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import http.server
+import json
+import os
+import secrets
+import time
+import traceback
+from pathlib import Path
+
+import game
+import save_format
+
+DEFAULT_PORT = 8000
+SECRET_VARIABLE = "GAME_STATE_SECRET"
+
+# Requests bigger than this are refused (a state is usually a few kilobytes)
+MAX_BODY_LENGTH = 1024 * 1024
+
+# The output widths a client can ask for
+MIN_WIDTH = 20
+MAX_WIDTH = 200
+
+SIGNATURE_LENGTH = hashlib.sha256().digest_size
+
+
+class StateError(Exception):
+    pass
+
+
+######################### STATELESS GAME #########################
+
+
+# Runs one turn at a time from a state, and packs up the state that follows it
+class StatelessGame:
+    def __init__(self, engine, secret):
+        self.engine = engine
+        self.secret = secret
+
+    # Returns the signed, base64 encoded state of a session
+    def EncodeState(self, context):
+        data = context.SerializeSession()
+        signature = hmac.new(self.secret, data, hashlib.sha256).digest()
+        return base64.b64encode(signature + data).decode("ascii")
+
+    # Recreates the session from a state made by EncodeState() (raises StateError if it isn't one of ours)
+    def DecodeState(self, state):
+        try:
+            raw = base64.b64decode(state, validate=True)
+        except (binascii.Error, ValueError):
+            raise StateError("state is not valid base64")
+        signature = raw[:SIGNATURE_LENGTH]
+        data = raw[SIGNATURE_LENGTH:]
+        if not hmac.compare_digest(signature, hmac.new(self.secret, data, hashlib.sha256).digest()):
+            raise StateError("state has a bad signature")
+        try:
+            return self.engine.LoadSession(data)
+        except save_format.SaveFormatError as e:
+            raise StateError("state can't be loaded: " + str(e))
+
+    # Runs a command in the game held by state (or starts a new game if state is empty), wrapping the output to width
+    #  columns if a width is given. Returns the response: the turn's output, the next prompt, whether the game is
+    #  over, and the new state.
+    def RunTurn(self, state, command, width = None):
+        if not state:
+            context = self.engine.NewSession()
+        else:
+            context = self.DecodeState(state)
+        context.saves_enabled = False
+        if width != None:
+            context.width = width
+        if not state:
+            output = context.StartGame()
+        else:
+            output = context.RunTurn(command)
+
+        response = {}
+        response["output"] = output
+        response["finished"] = context.IsFinished()
+        response["prompt"] = "" if response["finished"] else context.Prompt()
+        response["state"] = None if response["finished"] else self.EncodeState(context)
+        return response
+
+
+######################### HTTP #########################
+
+
+class TurnRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections open between requests, and send each response straight away (with Nagle's algorithm on, a
+    #  response written as headers then body waits for the client's delayed ACK, which costs tens of milliseconds)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    # Turn timings (only if the server is timing its turns)
+    def do_GET(self):
+        turn_timer = self.server.game.engine.turn_timer
+        if (self.path != "/stats") or (turn_timer == None):
+            self.SendJson(404, {"error": "not found"})
+            return
+        self.SendJson(200, turn_timer.Stats())
+
+    def do_POST(self):
+        if self.path != "/turn":
+            self.SendJson(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.SendJson(411, {"error": "Content-Length is required"})
+            return
+        if (length < 0) or (length > MAX_BODY_LENGTH):
+            self.close_connection = True
+            self.SendJson(413, {"error": "request is too large"})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(length))
+            state = request.get("state")
+            command = request.get("command", "")
+            width = request.get("width")
+            if ((state != None) and not isinstance(state, str)) or not isinstance(command, str):
+                raise ValueError("state must be a string or null, and command a string")
+            if (width != None) and ((not isinstance(width, int)) or (width < MIN_WIDTH) or (width > MAX_WIDTH)):
+                raise ValueError("width must be a whole number from " + str(MIN_WIDTH) + " to " + str(MAX_WIDTH))
+        except (ValueError, AttributeError) as e:
+            self.SendJson(400, {"error": "bad request: " + str(e)})
+            return
+
+        try:
+            response = self.server.game.RunTurn(state, command, width)
+        except StateError as e:
+            self.SendJson(400, {"error": str(e)})
+            return
+        except Exception:
+            print("ERROR: turn crashed:")
+            traceback.print_exc()
+            self.SendJson(500, {"error": "something went wrong with this game"})
+            return
+        self.SendJson(200, response)
+
+    def SendJson(self, status, body):
+        data = json.dumps(body, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Logging every request to stderr would cost more than the turn itself
+    def log_message(self, format, *args):
+        pass
+
+
+class TurnServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, stateless_game):
+        self.game = stateless_game
+        http.server.ThreadingHTTPServer.__init__(self, address, TurnRequestHandler)
+
+
+# Prints the handlers that took the most time, and writes the stacks for a flame graph
+def ReportHandlerProfile(handler_profiler, stacks_path):
+    handler_profile = handler_profiler.Profile()
+    print("Handler profile:\n" + game.FormatHandlerProfile(handler_profile))
+    Path(stacks_path).write_text(game.CollapsedStacks(handler_profile))
+    print("Handler stacks written to " + stacks_path)
+
+# Returns the secret for signing states (from the command line, the environment, or a random one for this run)
+def GetSecret(secret = None):
+    if secret == None:
+        secret = os.environ.get(SECRET_VARIABLE)
+    if not secret:
+        print("WARNING: no secret given (--secret or " + SECRET_VARIABLE + "), so states will only work with this server until it stops")
+        return secrets.token_bytes(32)
+    return secret.encode("utf-8")
+
+
+######################### BENCHMARK #########################
+
+
+BENCH_COMMANDS = ["look", "inventory", "open backpack", "examine coin", "take coin", "open door", "n", "examine jukebox", "s", "w", "e"]
+
+# Plays turns through StatelessGame (as a client would: each turn starts from the last state) and prints the timings
+def Bench(stateless_game, turns):
+    state = stateless_game.RunTurn(None, "")["state"]
+    timings = []
+    state_bytes = 0
+    for turn in range(turns):
+        start_time = time.perf_counter()
+        response = stateless_game.RunTurn(state, BENCH_COMMANDS[turn % len(BENCH_COMMANDS)])
+        timings.append(time.perf_counter() - start_time)
+        state = response["state"]
+        state_bytes += len(state)
+    timings.sort()
+    print(str(turns) + " turns: mean " + "%.0f" % (1000000 * sum(timings) / turns) + "us, p50 " + "%.0f" % (1000000 * timings[turns // 2]) + "us, p99 " +
+          "%.0f" % (1000000 * timings[min(turns - 1, turns * 99 // 100)]) + "us, mean state " + str(state_bytes // turns) + " bytes")
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Serve the game as a stateless HTTP/JSON API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--world", default=None, help="directory holding the world's JSON files (default: current directory)")
+    parser.add_argument("--secret", default=None, help="secret for signing game states (default: the " + SECRET_VARIABLE + " environment variable)")
+    parser.add_argument("--bench", type=int, default=0, help="time this many turns without serving, then exit")
+    parser.add_argument("--slow-turn-ms", type=float, default=None, help="time every turn, and log the turns slower than this (with a breakdown of where the time went)")
+    parser.add_argument("--slow-turn-log", default=None, help="file to log slow turns to (default: stderr)")
+    parser.add_argument("--profile-handlers", default=None, metavar="FILE", help="profile the handlers, and write their stacks for a flame graph to FILE when the server stops")
+    parser.add_argument("--warm-pool", type=int, default=0, help="sessions to keep ready in the background (every request builds a session, so this only helps if the server has spare CPU)")
+    args = parser.parse_args()
+
+    engine = game.Engine(args.world)
+    if args.slow_turn_ms != None:
+        engine.EnableTurnTiming(args.slow_turn_ms, args.slow_turn_log)
+    if args.profile_handlers != None:
+        engine.EnableHandlerProfiling()
+    if args.warm_pool > 0:
+        engine.StartWarmPool(args.warm_pool)
+    stateless_game = StatelessGame(engine, GetSecret(args.secret))
+    if args.bench > 0:
+        Bench(stateless_game, args.bench)
+        if engine.turn_timer != None:
+            print(game.FormatTimingStats(engine.turn_timer.Stats()))
+        if engine.handler_profiler != None:
+            ReportHandlerProfile(engine.handler_profiler, args.profile_handlers)
+        return
+
+    server = TurnServer((args.host, args.port), stateless_game)
+    print("Serving the game on http://" + args.host + ":" + str(args.port) + "/turn")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if engine.handler_profiler != None:
+            ReportHandlerProfile(engine.handler_profiler, args.profile_handlers)
+
+
+if __name__ == "__main__":
+    Main()
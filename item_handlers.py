@@ -35,6 +35,11 @@
 #    "do_not_list?" : true if the item shouldn't show up when the player does a LOOK
 #    "is_container?" : true if the item can be used as a container
 #   ...and you can arbitrarily assign attributes to items (see the jukebox in this example game)
+#
+# To give an item new words, or add a new item, while the game is running, use context.items.AddItemWord(),
+#  context.items.AddItemAdjective() and context.items.AddItem() rather than editing "words" directly,
+#  so that the parser can find the item. Likewise, use context.items.SetOpen(), SetLightSource() and MoveItemTo()
+#  to open/close items, toggle lights and move items around, so the game notices what the player can now see.
 
 def Coin(context, action, other_item, item_is_secondary):
     if ((action["key"] == "INSERT") or (action["key"] == "PUT_INTO")) and (not item_is_secondary):
@@ -52,7 +57,7 @@ def Coin(context, action, other_item, item_is_secondary):
             context.Print("You're not holding the coin.")
             return True    
         context.Print("The coin drops into the coin slot with a satisfying clunk. Lights on the numeric keypad on the jukebox begin to flash slowly.")
-        context.player.inventory.remove("COIN")
+        context.items.RemoveItemFromGame("COIN")
         context.items["KEYPAD"]["awaiting_input?"] = True
         return True
     return False
@@ -146,7 +151,7 @@ def Flashlight(context, action, other_item, item_is_secondary):
         if context.items["FLASHLIGHT"].get("light_source?"):
             context.Print("It's already on.")
         else:
-            context.items["FLASHLIGHT"]["light_source?"] = True
+            context.items.SetLightSource("FLASHLIGHT", True)
             context.Print("You switch on the flashlight.")
             if not context.locations[context.player.location]["touched?"]:
                 context.Print("")
@@ -154,7 +159,7 @@ def Flashlight(context, action, other_item, item_is_secondary):
         return True
     if action["key"] == "TURN_OFF":
         if context.items["FLASHLIGHT"].get("light_source?"):
-            context.items["FLASHLIGHT"]["light_source?"] = False
+            context.items.SetLightSource("FLASHLIGHT", False)
             context.Print("You switch off the flashlight.")
         else:
             context.Print("It's already off.")
@@ -0,0 +1,180 @@
+### THIS FILE REPLAYS RECORDED GAMES ###
+
+# Run "python replay.py transcripts/" to play back every transcript in a directory (see TRANSCRIPTS in game.py for
+#  how games are recorded, e.g. "python server.py --record-dir transcripts"). Each transcript is played headless
+#  (no console, no server) as fast as the engine can go, and the output of every turn is checked against the hash
+#  that was recorded. Transcripts are spread over worker processes (--workers), so a large batch of real players'
+#  games makes a quick regression test, and the turns per second make a benchmark.
+#
+# A transcript replays in a fresh session with a temporary save directory, holding the save files that the recorded
+#  session's directory held when recording began. If the transcript was recorded from a world other than --world, a
+#  warning is printed (the turns are still replayed and checked).
+#
+# For each transcript that doesn't match, the first few turns that printed something different are shown with what
+#  they printed now. A turn that crashed when it was recorded is expected to crash again, and ends its replay. The
+#  exit code is 1 if any transcript didn't match (or couldn't be replayed).
+
+import argparse
+import base64
+import concurrent.futures
+import os
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+import game
+import world_bundle
+
+# How many mismatched turns to keep the details of, per transcript
+MAX_REPORTED_MISMATCHES = 3
+
+
+######################### REPLAYING #########################
+
+
+# Creates a session ready to replay a transcript, in save_dir
+def StartReplaySession(engine, header, save_dir):
+    for name, (modified_time, data) in header.get("saves", {}).items():
+        save_path = Path(save_dir) / Path(name).name
+        save_path.write_bytes(base64.b64decode(data))
+        os.utime(save_path, ns=(modified_time, modified_time))
+
+    if header.get("state") != None:
+        context = engine.LoadSession(base64.b64decode(header["state"]))
+        context.save_dir = save_dir
+    else:
+        context = engine.NewSession(save_dir = save_dir)
+
+    # A replay is never recorded itself
+    context.transcript = None
+    context.width = header.get("width", game.DEFAULT_WIDTH)
+    return context
+
+# Replays one transcript and returns the results: the number of turns, how long they took, and the turns whose output
+#  didn't match (only the first few are kept in "mismatches", but all are counted)
+def ReplayTranscript(engine, path):
+    results = {"path": str(path), "turns": 0, "seconds": 0.0, "mismatch_count": 0, "mismatches": [], "warning": None, "error": None}
+    try:
+        header, entries = game.ReadTranscript(path)
+    except (OSError, ValueError) as e:
+        results["error"] = "can't read transcript: " + str(e)
+        return results
+    if (header.get("world") != None) and (header["world"] != world_bundle.SourceHash(engine.world_dir).hex()):
+        results["warning"] = "recorded from a different version of the world"
+
+    clock = time.perf_counter
+    with tempfile.TemporaryDirectory() as save_dir:
+        try:
+            context = StartReplaySession(engine, header, save_dir)
+        except Exception:
+            results["error"] = "can't start the session:\n" + traceback.format_exc()
+            return results
+        for index, entry in enumerate(entries):
+            if "width" in entry:
+                context.width = entry["width"]
+            start_time = clock()
+            try:
+                if entry.get("start"):
+                    output = context.StartGame()
+                else:
+                    output = context.RunTurn(entry["input"])
+            except Exception:
+                # A turn that crashed when it was recorded should crash again (and the game can't go on after it)
+                results["turns"] += 1
+                if not entry.get("crashed"):
+                    results["error"] = "line " + str(index + 2) + ", turn " + str(entry.get("turn")) + ", " + repr(entry.get("input")) + " crashed:\n" + traceback.format_exc()
+                break
+            results["seconds"] += clock() - start_time
+            results["turns"] += 1
+            if game.OutputHash(output) != entry.get("output"):
+                results["mismatch_count"] += 1
+                if len(results["mismatches"]) < MAX_REPORTED_MISMATCHES:
+                    results["mismatches"].append({"line": index + 2, "turn": entry.get("turn"), "input": entry.get("input"), "output": output})
+    return results
+
+
+######################### PARALLEL RUNNER #########################
+
+
+# Each worker process replays transcripts with its own engine
+worker_engine = None
+
+def InitializeWorker(world_dir):
+    global worker_engine
+    worker_engine = game.Engine(world_dir)
+
+def ReplayInWorker(path):
+    return ReplayTranscript(worker_engine, path)
+
+# Returns the transcript files named by paths (files, or directories to search for *.transcript files)
+def FindTranscripts(paths):
+    transcript_paths = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            transcript_paths.extend(sorted(path.rglob("*" + game.TRANSCRIPT_SUFFIX)))
+        else:
+            transcript_paths.append(path)
+    return transcript_paths
+
+# Replays transcripts over a number of worker processes (or in this process, if workers is 0), and returns the
+#  results of each one, in order
+def ReplayTranscripts(transcript_paths, world_dir = None, workers = None):
+    if workers == None:
+        workers = os.cpu_count() or 1
+
+    # Make sure the world bundle is up to date before the workers start, so they don't all rebuild it at once
+    engine = game.Engine(world_dir)
+    engine.LoadMasters()
+    if (workers <= 1) or (len(transcript_paths) <= 1):
+        return [ReplayTranscript(engine, path) for path in transcript_paths]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=InitializeWorker, initargs=(world_dir,)) as executor:
+        return list(executor.map(ReplayInWorker, transcript_paths, chunksize=max(1, len(transcript_paths) // (4 * workers))))
+
+
+######################### REPORTING #########################
+
+
+# Prints the transcripts that didn't replay cleanly and a summary. Returns True if they all matched.
+def PrintResults(all_results, elapsed):
+    failed = 0
+    for results in all_results:
+        if results["warning"] != None:
+            print("WARNING: " + results["path"] + ": " + results["warning"])
+        if (results["error"] == None) and (results["mismatch_count"] == 0):
+            continue
+        failed += 1
+        if results["error"] != None:
+            print("ERROR: " + results["path"] + ": " + results["error"])
+        if results["mismatch_count"] > 0:
+            print("MISMATCH: " + results["path"] + ": " + str(results["mismatch_count"]) + " of " + str(results["turns"]) + " turns printed something different")
+            for mismatch in results["mismatches"]:
+                command = "(start of game)" if mismatch["input"] == None else repr(mismatch["input"])
+                print("  line " + str(mismatch["line"]) + ", turn " + str(mismatch["turn"]) + ", " + command + " now prints:")
+                for line in mismatch["output"].splitlines():
+                    print("    | " + line)
+
+    turns = sum(results["turns"] for results in all_results)
+    turn_time = sum(results["seconds"] for results in all_results)
+    print(str(len(all_results)) + " transcripts, " + str(turns) + " turns in " + "%.2f" % elapsed + "s (" + "%.0f" % (turns / elapsed if elapsed > 0 else 0) +
+          " turns/s overall, " + "%.1f" % (1000000 * turn_time / turns if turns else 0) + "us per turn), " + str(failed) + " failed")
+    return failed == 0
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Replay recorded games and check that they still play the same")
+    parser.add_argument("paths", nargs="+", help="transcript files, or directories to search for *" + game.TRANSCRIPT_SUFFIX + " files")
+    parser.add_argument("--world", default=None, help="directory holding the world's JSON files (default: current directory)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU core; 0 replays in this process)")
+    args = parser.parse_args()
+
+    transcript_paths = FindTranscripts(args.paths)
+    start_time = time.perf_counter()
+    all_results = ReplayTranscripts(transcript_paths, args.world, args.workers)
+    if not PrintResults(all_results, time.perf_counter() - start_time):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    Main()
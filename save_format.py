@@ -0,0 +1,192 @@
+### THIS FILE READS AND WRITES SAVED GAME FILES ###
+
+# You probably don't need to modify this file unless you want to change the layout of save files.
+#
+# A save file is a small header followed by a body of length-prefixed sections:
+#   header : magic (4 bytes, "TAVS") | format version (uint16) | flags (uint16)
+#   body   : one or more sections, each = name length (uint8) | name | data length (uint32) | data
+# If the FLAG_COMPRESSED bit is set, the whole body is zlib-compressed.
+#
+# Section data is compact UTF-8 JSON, so loading a save never runs code (unlike pickle) and doesn't depend on how
+#  Python lays out the game's objects. SAVE_SCHEMA lists the sections and the type each must hold.
+#
+# Saves written before this format existed were two pickle.dump() calls. ReadSaveFile() still loads those, using an
+#  unpickler that only allows the game's Event class (and turns event function references into names), and
+#  upgrades them to the current layout. When the layout changes, bump FORMAT_VERSION and add a function to
+#  MIGRATIONS that upgrades sections from the previous version.
+
+import io
+import json
+import pickle
+import struct
+import zlib
+
+MAGIC = b"TAVS"
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 1
+
+# Bodies smaller than this aren't worth compressing
+COMPRESS_THRESHOLD = 256
+
+HEADER = struct.Struct("<4sHH")
+SECTION_NAME_LENGTH = struct.Struct("<B")
+SECTION_DATA_LENGTH = struct.Struct("<I")
+
+# The sections of a save file, and the type of data each one holds
+SAVE_SCHEMA = [
+    ("player", dict),
+    ("state", dict),
+    ("locations", dict),
+    ("items", dict),
+    ("events", list),
+]
+
+# A packed-up running session (see Context.SerializeSession) is a save with one more section
+SESSION_SCHEMA = SAVE_SCHEMA + [("session", dict)]
+
+# MIGRATIONS[n] upgrades the sections of a version n save to version n+1
+MIGRATIONS = {}
+
+
+class SaveFormatError(Exception):
+    pass
+
+
+# Turns a dictionary of sections (as described by SAVE_SCHEMA, or another schema) into the bytes of a save file
+def EncodeSave(sections, compress = True, schema = SAVE_SCHEMA):
+    body = bytearray()
+    for name, section_type in schema:
+        value = sections.get(name)
+        if not isinstance(value, section_type):
+            raise SaveFormatError("save section \"" + name + "\" must be a " + section_type.__name__)
+        try:
+            data = json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            raise SaveFormatError("save section \"" + name + "\" can't be saved: " + str(e))
+        name_bytes = name.encode("utf-8")
+        body += SECTION_NAME_LENGTH.pack(len(name_bytes))
+        body += name_bytes
+        body += SECTION_DATA_LENGTH.pack(len(data))
+        body += data
+
+    flags = 0
+    if compress and (len(body) >= COMPRESS_THRESHOLD):
+        body = zlib.compress(bytes(body))
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags) + bytes(body)
+
+
+# Turns the bytes of a save file back into a dictionary of sections (upgrading older versions as needed)
+def DecodeSave(data):
+    if len(data) < HEADER.size:
+        raise SaveFormatError("save file is truncated")
+    magic, version, flags = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SaveFormatError("not a save file")
+    if version > FORMAT_VERSION:
+        raise SaveFormatError("save file was written by a newer version of the game")
+
+    body = memoryview(data)[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        try:
+            body = memoryview(zlib.decompress(body))
+        except zlib.error as e:
+            raise SaveFormatError("save file is corrupt: " + str(e))
+
+    sections = {}
+    offset = 0
+    try:
+        while offset < len(body):
+            name_length = SECTION_NAME_LENGTH.unpack_from(body, offset)[0]
+            offset += SECTION_NAME_LENGTH.size
+            name = bytes(body[offset:offset + name_length]).decode("utf-8")
+            offset += name_length
+            data_length = SECTION_DATA_LENGTH.unpack_from(body, offset)[0]
+            offset += SECTION_DATA_LENGTH.size
+            if offset + data_length > len(body):
+                raise SaveFormatError("save file is truncated")
+            sections[name] = json.loads(bytes(body[offset:offset + data_length]).decode("utf-8"))
+            offset += data_length
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        raise SaveFormatError("save file is corrupt: " + str(e))
+
+    return CheckSchema(MigrateSections(sections, version))
+
+
+# Upgrades sections from an older format version, one version at a time
+def MigrateSections(sections, version):
+    while version < FORMAT_VERSION:
+        migration = MIGRATIONS.get(version)
+        if migration != None:
+            sections = migration(sections)
+        version += 1
+    return sections
+
+
+def CheckSchema(sections):
+    for name, section_type in SAVE_SCHEMA:
+        if not isinstance(sections.get(name), section_type):
+            raise SaveFormatError("save file is missing its \"" + name + "\" section")
+    return sections
+
+
+def IsLegacySave(data):
+    return not data.startswith(MAGIC)
+
+
+# Writes sections to a save file
+def WriteSaveFile(filepath, sections, compress = True):
+    data = EncodeSave(sections, compress)
+    with open(filepath, "wb") as f:
+        f.write(data)
+
+
+# Reads a save file (current format or an old pickle save) with a single read and returns its sections
+def ReadSaveFile(filepath):
+    with open(filepath, "rb") as f:
+        data = f.read()
+    if IsLegacySave(data):
+        return LoadLegacySave(data)
+    return DecodeSave(data)
+
+
+######################### LEGACY PICKLE SAVES #########################
+
+
+# Stand-in for the game's Event class while reading an old pickle save. The game turns these back into events.
+class LegacyEvent:
+    pass
+
+
+# Only lets an old save refer to the Event class and to functions in the game's handler modules.
+# Functions come back as their "module.name" so nothing from the file is ever imported or called here.
+class LegacyUnpickler(pickle.Unpickler):
+    handler_modules = ["action_handlers", "item_handlers", "location_handlers", "globals"]
+
+    def find_class(self, module, name):
+        if (module in ["game", "__main__"]) and (name == "Event"):
+            return LegacyEvent
+        if (module in self.handler_modules) and name.isidentifier():
+            return module + "." + name
+        raise SaveFormatError("save file refers to " + module + "." + name + ", which isn't allowed")
+
+
+# Old saves were pickle.dump(save_state) followed by pickle.dump(events_list)
+def LoadLegacySave(data):
+    stream = io.BytesIO(data)
+    try:
+        # Each pickle.dump() had its own memo, so each one needs a fresh unpickler
+        save_state = LegacyUnpickler(stream).load()
+        events_list = LegacyUnpickler(stream).load()
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError) as e:
+        raise SaveFormatError("save file is corrupt: " + str(e))
+    if not isinstance(save_state, dict) or not isinstance(events_list, list):
+        raise SaveFormatError("save file is corrupt")
+
+    # The old save_state dictionary had obfuscated keys, so pick out the sections by position
+    # (they were always written as player, locations, items, state)
+    values = list(save_state.values())
+    if len(values) != 4:
+        raise SaveFormatError("save file is corrupt")
+    sections = {"player": values[0], "locations": values[1], "items": values[2], "state": values[3], "events": events_list}
+    return CheckSchema(sections)
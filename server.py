@@ -0,0 +1,366 @@
+### THIS FILE SERVES THE GAME TO MANY PLAYERS OVER TCP/TELNET ###
+
+# Run "python server.py" and connect with "telnet localhost 4000" (or any line-based TCP client).
+#
+# Everything runs on one asyncio event loop. Each connection gets its own game session (a Context from game.Engine),
+#  with its own save directory under server_saves/. A turn's output is sent in one write, and the server waits for
+#  the client to read it (writer.drain()) before taking the next command, so a slow reader only holds up its own game.
+#  Players who stay idle for too long are disconnected. Whenever a game ends without the player quitting (a dropped
+#  connection, an idle timeout, or the server shutting down on Ctrl+C / SIGTERM), it is saved to autosave.sav in
+#  that session's directory.
+#
+# With --workers N, the games themselves run in N worker processes (see shard.py) and this process only handles the
+#  connections, so the server can use more than one CPU core. Add --preload to load the world once and fork the
+#  workers from it, so they share its memory.
+#
+# With --slow-turn-ms, every turn is timed: turns slower than that are logged with a breakdown of where their time
+#  went, and a table of the timings is printed when the server shuts down (see TURN TIMING in game.py).
+# With --profile-handlers FILE, every handler call is recorded: the handlers that took the most time are listed when
+#  the server shuts down, and FILE gets their stacks for a flame graph (see HANDLER PROFILING in game.py).
+# With --record-dir DIR, every game is recorded to a transcript file in DIR, which "python replay.py DIR" can play
+#  back (see TRANSCRIPTS in game.py).
+#
+# "python server.py --clients 300 --script commands.txt" runs a scripted load test instead: it opens that many
+#  connections to a running server and plays the script's commands (one per line) on each of them.
+
+import argparse
+import asyncio
+import re
+import signal
+import time
+import traceback
+from pathlib import Path
+
+import game
+import save_format
+import sessions
+import shard
+
+DEFAULT_PORT = 4000
+DEFAULT_IDLE_TIMEOUT = 600
+SAVE_ROOT = "server_saves"
+AUTOSAVE_FILENAME = "autosave.sav"
+
+# Commands longer than this are refused (and the connection is dropped)
+MAX_LINE_LENGTH = 1024
+
+# How many new connections can wait to be accepted (the default of 100 is easily overrun when lots of players connect at once)
+LISTEN_BACKLOG = 1024
+
+# A client that hasn't read a turn's output within this many seconds is treated as gone
+WRITE_TIMEOUT = 60
+
+# Telnet option negotiation (IAC sequences) that clients may send along with their commands
+TELNET_COMMAND = re.compile(rb"\xff[\xfb-\xfe].|\xff[\xf0-\xfa]", re.DOTALL)
+
+
+######################### BACKENDS #########################
+
+
+# The server runs games through a backend. Each backend method returns (output, prompt, finished) for a turn.
+
+# Runs the games in this process (a sessions.SessionManager hibernates idle ones if there is a memory budget)
+class LocalBackend:
+    def __init__(self, session_manager, handler_stacks_path = None):
+        self.session_manager = session_manager
+        self.handler_stacks_path = handler_stacks_path
+
+    async def NewSession(self, session_id, save_dir):
+        context = self.session_manager.NewSession(save_dir, session_id)[1]
+        return (context.StartGame(), context.Prompt(), context.IsFinished())
+
+    async def RunTurn(self, session_id, command):
+        try:
+            # (Looking the session up can rehydrate it from disk, which can fail too)
+            context = self.session_manager.GetContext(session_id)
+            return (context.RunTurn(command), context.Prompt(), context.IsFinished())
+        except Exception:
+            # A bug in one game mustn't take down the others. Its state may be broken, so it is dropped (not autosaved).
+            print("ERROR: session " + str(session_id) + " crashed:")
+            traceback.print_exc()
+            self.session_manager.CloseSession(session_id)
+            return ("\n\nSorry, something went wrong with your game and it has been ended.\n", "", True)
+
+    # Saves the game, unless the player has quit. Returns the save file (or None).
+    async def Autosave(self, session_id):
+        context = self.session_manager.GetContext(session_id)
+        if (context == None) or context.IsFinished():
+            return None
+        filepath = context.SaveDirectory() / AUTOSAVE_FILENAME
+        context.WriteSave(filepath)
+        return filepath
+
+    async def CloseSession(self, session_id):
+        self.session_manager.CloseSession(session_id)
+
+    def Shutdown(self):
+        print("Session stats: " + str(self.session_manager.Stats()))
+        if self.session_manager.engine.turn_timer != None:
+            print("Turn timing: " + game.FormatTimingStats(self.session_manager.engine.turn_timer.Stats()))
+        if self.session_manager.engine.handler_profiler != None:
+            ReportHandlerProfile(self.session_manager.engine.handler_profiler.Profile(), self.handler_stacks_path)
+
+
+# Runs the games in worker processes, through a shard.ShardRouter
+class ShardedBackend:
+    def __init__(self, router, handler_stacks_path = None):
+        self.router = router
+        self.handler_stacks_path = handler_stacks_path
+
+    async def NewSession(self, session_id, save_dir):
+        return await asyncio.wrap_future(self.router.SubmitNewSession(save_dir, session_id)[1])
+
+    async def RunTurn(self, session_id, command):
+        return await asyncio.wrap_future(self.router.SubmitTurn(session_id, command))
+
+    async def Autosave(self, session_id):
+        return await asyncio.wrap_future(self.router.SubmitAutosave(session_id))
+
+    async def CloseSession(self, session_id):
+        await asyncio.wrap_future(self.router.CloseSession(session_id))
+
+    def Shutdown(self):
+        try:
+            timing_stats = self.router.TimingReport()
+            handler_profile = self.router.HandlerProfile()
+        except shard.WorkerError:
+            timing_stats = None
+            handler_profile = None
+        if timing_stats != None:
+            print("Turn timing: " + game.FormatTimingStats(timing_stats))
+        if handler_profile != None:
+            ReportHandlerProfile(handler_profile, self.handler_stacks_path)
+        self.router.Shutdown()
+
+# Prints the handlers that took the most time, and writes the stacks for a flame graph
+def ReportHandlerProfile(handler_profile, stacks_path):
+    print("Handler profile:\n" + game.FormatHandlerProfile(handler_profile))
+    try:
+        Path(stacks_path).write_text(game.CollapsedStacks(handler_profile))
+        print("Handler stacks written to " + str(stacks_path))
+    except OSError as e:
+        print("ERROR: couldn't write the handler stacks: " + str(e))
+
+
+######################### SERVER #########################
+
+
+# One player's connection
+class Session:
+    def __init__(self, session_id, reader, writer):
+        self.session_id = session_id
+        self.reader = reader
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.closed = False
+        self.autosaved = False
+
+    # Sends text to the client and waits until it has been taken off our hands (this is the backpressure)
+    async def Send(self, text):
+        if self.closed:
+            return
+        self.writer.write(text.replace("\n", "\r\n").encode("utf-8"))
+        await asyncio.wait_for(self.writer.drain(), WRITE_TIMEOUT)
+
+    def Close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class GameServer:
+    def __init__(self, backend, host = "localhost", port = DEFAULT_PORT, idle_timeout = DEFAULT_IDLE_TIMEOUT, save_root = SAVE_ROOT):
+        self.backend = backend
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.save_root = Path(save_root)
+        self.sessions = {}
+        self.next_session_id = 1
+        self.server = None
+        self.shutting_down = False
+
+    async def Start(self):
+        self.server = await asyncio.start_server(self.HandleConnection, self.host, self.port, limit=MAX_LINE_LENGTH, backlog=LISTEN_BACKLOG)
+        print("Serving the game on " + self.host + ":" + str(self.port))
+
+    # Runs the game for one connection, from the introduction until the player quits or the connection ends
+    async def HandleConnection(self, reader, writer):
+        if self.shutting_down:
+            writer.close()
+            return
+        session_id = self.next_session_id
+        self.next_session_id += 1
+        session = Session(session_id, reader, writer)
+        self.sessions[session_id] = session
+
+        try:
+            output, prompt, finished = await self.backend.NewSession(session_id, self.save_root / ("session" + str(session_id)))
+            await session.Send(output + prompt)
+            while not finished:
+                command = await self.ReadCommand(session)
+                if command == None:
+                    break
+                output, prompt, finished = await self.backend.RunTurn(session_id, command)
+                await session.Send(output + ("" if finished else prompt))
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if not self.shutting_down:
+                if not session.autosaved:
+                    await self.Autosave(session)
+                await self.backend.CloseSession(session_id)
+            session.Close()
+            del self.sessions[session_id]
+
+    # Saves a session's game (unless the player has quit), returning the save file or None
+    async def Autosave(self, session):
+        try:
+            return await self.backend.Autosave(session.session_id)
+        except (save_format.SaveFormatError, OSError, shard.WorkerError) as e:
+            print("ERROR: couldn't autosave session " + str(session.session_id) + ": " + str(e))
+            return None
+
+    # Returns the client's next command, or None if the client has gone (or has been idle for too long)
+    async def ReadCommand(self, session):
+        try:
+            line = await asyncio.wait_for(session.reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            saved = await self.Autosave(session)
+            session.autosaved = True
+            message = "\n\nYou have been idle for too long, so you've been disconnected."
+            if saved != None:
+                message += " Your game has been saved."
+            await session.Send(message + "\n")
+            return None
+        except ValueError:
+            # The line was longer than the reader's limit
+            await session.Send("\nThat command is too long.\n")
+            return None
+        if not line:
+            return None
+        line = TELNET_COMMAND.sub(b"", line)
+        return line.decode("utf-8", errors="replace").strip()
+
+    # Stops taking new connections, saves every game in progress and says goodbye to the players
+    async def Shutdown(self):
+        self.shutting_down = True
+        if self.server != None:
+            self.server.close()
+        open_sessions = list(self.sessions.values())
+        for session in open_sessions:
+            saved = await self.Autosave(session)
+            message = "\n\nThe server is shutting down."
+            if saved != None:
+                message += " Your game has been saved."
+            try:
+                await session.Send(message + "\n")
+            except (ConnectionError, asyncio.TimeoutError):
+                pass
+            session.Close()
+
+        # Closing a connection ends its game's task; wait for them all to finish
+        if open_sessions:
+            await asyncio.wait([session.task for session in open_sessions], timeout=WRITE_TIMEOUT)
+        self.backend.Shutdown()
+        print("Shut down; closed " + str(len(open_sessions)) + " game(s).")
+
+    async def Serve(self):
+        await self.Start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                loop.add_signal_handler(signal_number, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await self.Shutdown()
+
+
+######################### SCRIPTED CLIENTS #########################
+
+
+# Plays a list of commands over one connection, and returns how many turns got a reply
+async def RunClient(host, port, commands):
+    reader, writer = await asyncio.open_connection(host, port)
+    replies = 0
+    try:
+        await reader.readuntil(b"> ")
+        for command in commands:
+            writer.write(command.encode("utf-8") + b"\r\n")
+            await writer.drain()
+            # Each reply ends with a prompt (either "> " or the save slot prompt ">> ")
+            await reader.readuntil(b"> ")
+            replies += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+    return replies
+
+# Opens many connections at once, each playing the same commands
+async def RunClients(host, port, connections, commands):
+    start_time = time.monotonic()
+    results = await asyncio.gather(*[RunClient(host, port, commands) for i in range(connections)], return_exceptions=True)
+    elapsed = time.monotonic() - start_time
+    failures = [result for result in results if isinstance(result, Exception)]
+    turns = sum(result for result in results if not isinstance(result, Exception))
+    print(str(connections) + " connections, " + str(turns) + " turns in " + "%.2f" % elapsed + "s, " + str(len(failures)) + " failed connection(s)")
+    for failure in failures[:5]:
+        print("  " + repr(failure))
+    return not failures
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Serve the game over TCP/telnet, or load test a running server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, help="seconds before an idle player is disconnected")
+    parser.add_argument("--world", default=None, help="directory holding the world's JSON files (default: current directory)")
+    parser.add_argument("--save-root", default=SAVE_ROOT, help="directory for the sessions' save directories")
+    parser.add_argument("--memory-budget", type=float, default=None, help="megabytes of game sessions to keep in memory; the least recently used are hibernated to disk")
+    parser.add_argument("--store", default="session_store", help="directory for hibernated sessions")
+    parser.add_argument("--workers", type=int, default=0, help="run the games in this many worker processes (default: in this process)")
+    parser.add_argument("--preload", action="store_true", help="with --workers, load the world once and fork the workers from it")
+    parser.add_argument("--warm-pool", type=int, default=8, help="sessions to keep ready in the background (per worker), so new games start at once")
+    parser.add_argument("--slow-turn-ms", type=float, default=None, help="time every turn, and log the turns slower than this (with a breakdown of where the time went)")
+    parser.add_argument("--slow-turn-log", default=None, help="file to log slow turns to (default: stderr)")
+    parser.add_argument("--profile-handlers", default=None, metavar="FILE", help="profile the handlers, and write their stacks for a flame graph to FILE on shutdown")
+    parser.add_argument("--record-dir", default=None, help="record a transcript of every game in this directory (see replay.py)")
+    parser.add_argument("--clients", type=int, default=0, help="run this many scripted clients against a running server instead")
+    parser.add_argument("--script", default=None, help="file of commands (one per line) for the scripted clients")
+    args = parser.parse_args()
+
+    if args.clients > 0:
+        commands = ["look", "inventory", "open backpack", "open door", "n", "s", "w", "e"]
+        if args.script != None:
+            commands = [line.strip() for line in Path(args.script).read_text().splitlines() if line.strip()]
+        if not asyncio.run(RunClients(args.host, args.port, args.clients, commands)):
+            raise SystemExit(1)
+        return
+
+    if args.workers > 0:
+        router = shard.ShardRouter(args.workers, args.world, args.preload, args.warm_pool, args.slow_turn_ms, args.slow_turn_log,
+                                   args.profile_handlers != None, args.record_dir)
+        backend = ShardedBackend(router, args.profile_handlers)
+    else:
+        memory_budget = None if args.memory_budget == None else int(args.memory_budget * 1024 * 1024)
+        engine = game.Engine(args.world)
+        backend = LocalBackend(sessions.SessionManager(engine, args.store, memory_budget), args.profile_handlers)
+        if args.slow_turn_ms != None:
+            engine.EnableTurnTiming(args.slow_turn_ms, args.slow_turn_log)
+        if args.profile_handlers != None:
+            engine.EnableHandlerProfiling()
+        if args.record_dir != None:
+            engine.EnableRecording(args.record_dir)
+        if args.warm_pool > 0:
+            engine.StartWarmPool(args.warm_pool)
+    server = GameServer(backend, args.host, args.port, args.idle_timeout, args.save_root)
+    asyncio.run(server.Serve())
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,169 @@
+### THIS FILE KEEPS A SERVER'S GAME SESSIONS WITHIN A MEMORY BUDGET ###
+
+# Every running session holds its own game state (its overlay on the shared world, its events and so on), but on a
+#  busy server most sessions are sitting idle at any moment. SessionManager keeps only as many sessions in memory as fit in its memory
+#  budget. When it needs room, it hibernates the least recently used sessions: each is packed up with
+#  Context.SerializeSession() (the same save_format sections that SaveGame writes, plus the pending parser state) and
+#  written to a file in the store directory. The next time that session is used it is loaded back in (rehydrated)
+#  without the player noticing anything but a short delay; Stats() reports how long that takes.
+#
+# The memory budget is turned into a number of resident sessions using an estimate of one session's size. It starts
+#  as the size of a freshly started session, measured with tracemalloc when the manager is created. Sessions grow as
+#  they are played, so every SIZE_SAMPLE_INTERVAL turns the session being played is measured too (see
+#  Context.MemorySize(), scaled to match tracemalloc on the fresh session), and the estimate becomes the average of the
+#  latest SIZE_SAMPLES measurements. If the sessions have grown, more of them are hibernated.
+
+import collections
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+# Measure a live session every this many turns, and average this many of the latest measurements
+SIZE_SAMPLE_INTERVAL = 100
+SIZE_SAMPLES = 50
+
+
+class SessionManager:
+    def __init__(self, engine, store_dir = "session_store", memory_budget = None):
+        self.engine = engine
+        self.store_dir = Path(store_dir)
+        self.memory_budget = memory_budget
+        self.resident = collections.OrderedDict()
+        self.hibernated = set()
+        self.next_session_id = 1
+        self.hibernation_count = 0
+        self.rehydration_count = 0
+        self.rehydration_time = 0.0
+        self.max_rehydration_time = 0.0
+        self.session_size = None
+        self.max_resident = None
+        self.size_scale = 1.0
+        self.size_samples = collections.deque(maxlen=SIZE_SAMPLES)
+        self.turns_until_sample = SIZE_SAMPLE_INTERVAL
+        if memory_budget != None:
+            self.session_size = self.EstimateSessionSize()
+            self.max_resident = max(1, memory_budget // self.session_size)
+
+    # Measures how much memory one freshly started session takes (in bytes), and how that compares to the session's
+    #  own idea of its size (size_scale)
+    def EstimateSessionSize(self):
+        # Load a session first, so one-off costs (like reading the world bundle) aren't counted
+        self.engine.NewSession().StartGame()
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            context = self.engine.NewSession()
+            context.StartGame()
+            size = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+        size = max(1, size)
+        self.size_scale = size / max(1, context.MemorySize())
+        return size
+
+    # Measures a session that is being played, and updates the estimate of a session's size (and so how many sessions
+    #  can stay resident) to the average of the latest measurements
+    def MeasureSession(self, context):
+        self.size_samples.append(context.MemorySize() * self.size_scale)
+        self.session_size = max(1, int(sum(self.size_samples) / len(self.size_samples)))
+        self.max_resident = max(1, self.memory_budget // self.session_size)
+
+    # Creates a new session and returns its id and context (call StartGame() on the context to begin).
+    # (The caller can choose the session's id; otherwise the manager numbers them.)
+    def NewSession(self, save_dir = None, session_id = None):
+        if session_id == None:
+            session_id = self.next_session_id
+            self.next_session_id += 1
+        context = self.engine.NewSession(save_dir = save_dir)
+        self.resident[session_id] = context
+        self.EnforceBudget(keep = session_id)
+        return session_id, context
+
+    # Returns a session's context, rehydrating it first if it has been hibernated (or None if there's no such session)
+    def GetContext(self, session_id):
+        context = self.resident.get(session_id)
+        if context != None:
+            self.resident.move_to_end(session_id)
+        elif session_id in self.hibernated:
+            context = self.Rehydrate(session_id)
+            self.EnforceBudget(keep = session_id)
+        else:
+            return None
+
+        if self.max_resident != None:
+            self.turns_until_sample -= 1
+            if self.turns_until_sample <= 0:
+                self.turns_until_sample = SIZE_SAMPLE_INTERVAL
+                self.MeasureSession(context)
+                self.EnforceBudget(keep = session_id)
+        return context
+
+    def HasSession(self, session_id):
+        return (session_id in self.resident) or (session_id in self.hibernated)
+
+    # Forgets a session (e.g. when the player disconnects)
+    def CloseSession(self, session_id):
+        self.resident.pop(session_id, None)
+        if session_id in self.hibernated:
+            self.hibernated.remove(session_id)
+            self.StorePath(session_id).unlink(missing_ok=True)
+
+    # Hibernates the least recently used sessions until the resident ones fit in the budget
+    def EnforceBudget(self, keep = None):
+        if self.max_resident == None:
+            return
+        while len(self.resident) > self.max_resident:
+            session_id = next(iter(self.resident))
+            if session_id == keep:
+                self.resident.move_to_end(session_id)
+                continue
+            self.Hibernate(session_id)
+
+    def StorePath(self, session_id):
+        return self.store_dir / ("session" + str(session_id) + ".hib")
+
+    # Writes a resident session to the store and drops it from memory
+    def Hibernate(self, session_id):
+        context = self.resident[session_id]
+        data = context.SerializeSession()
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        store_path = self.StorePath(session_id)
+        temp_path = store_path.with_suffix(".tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, store_path)
+        del self.resident[session_id]
+        self.hibernated.add(session_id)
+        self.hibernation_count += 1
+
+    # Loads a hibernated session back into memory
+    def Rehydrate(self, session_id):
+        start_time = time.perf_counter()
+        store_path = self.StorePath(session_id)
+        context = self.engine.LoadSession(store_path.read_bytes())
+        store_path.unlink()
+        self.hibernated.remove(session_id)
+        self.resident[session_id] = context
+        elapsed = time.perf_counter() - start_time
+        self.rehydration_count += 1
+        self.rehydration_time += elapsed
+        self.max_rehydration_time = max(self.max_rehydration_time, elapsed)
+        return context
+
+    # Returns counts of resident and hibernated sessions, and what rehydrating has cost so far
+    def Stats(self):
+        stats = {}
+        stats["resident"] = len(self.resident)
+        stats["hibernated"] = len(self.hibernated)
+        stats["max_resident"] = self.max_resident
+        stats["memory_budget"] = self.memory_budget
+        stats["estimated_session_bytes"] = self.session_size
+        stats["session_size_samples"] = len(self.size_samples)
+        stats["hibernations"] = self.hibernation_count
+        stats["rehydrations"] = self.rehydration_count
+        stats["mean_rehydration_ms"] = 1000 * self.rehydration_time / self.rehydration_count if self.rehydration_count else 0.0
+        stats["max_rehydration_ms"] = 1000 * self.max_rehydration_time
+        return stats
@@ -0,0 +1,425 @@
+### THIS FILE SPREADS GAME SESSIONS ACROSS WORKER PROCESSES ###
+
+# The parser and the handlers are pure Python, so one process can only ever use one CPU core. ShardRouter starts
+#  a worker process per core; each worker has its own game.Engine and owns the Context objects of the sessions
+#  routed to it. Routing is sticky: a session's commands always go to the worker that holds it, until the session
+#  is moved. Moving a session packs it up with Context.SerializeSession() in its old worker and unpacks it with
+#  Engine.LoadSession() in the new one, which is how Rebalance() evens out the load.
+#
+# Requests to a worker are answered in the order they were sent, so each worker has a thread that reads the answers
+#  and completes a concurrent.futures.Future for each request. Callers can block on the future (future.result()),
+#  await it from asyncio (asyncio.wrap_future(future)), or send requests to several workers before waiting, which is
+#  what lets N workers run N turns at the same time. RunTurns() also batches the turns for each worker into one
+#  message, to keep the cost of talking to the workers small next to the cost of a turn.
+#
+# With preload set, the router loads the world (and the handler modules) itself, freezes the garbage collector's view
+#  of everything loaded so far (gc.freeze()), and then forks the workers, so they all share the parent's copy of the
+#  world rather than each loading their own. Freezing matters because a collection walks every object it tracks and
+#  writes to each one's GC header, which would make the kernel copy nearly every page of the world into every worker.
+#  (Reading an object still updates its reference count, so pages the workers use a lot do get copied in the end.)
+#  MemoryReport() shows how much of each worker's memory is private and how much is shared, to check on this.
+#
+# "python shard.py --workers 4" runs a quick throughput test of 1, 2, ... up to 4 workers.
+
+import argparse
+import collections
+import concurrent.futures
+import gc
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import game
+
+AUTOSAVE_FILENAME = "autosave.sav"
+
+
+class WorkerError(Exception):
+    pass
+
+
+######################### WORKER #########################
+
+
+# The requests a worker understands. Each takes the worker's engine and sessions, plus the request's arguments.
+def WorkerNewSession(engine, sessions, session_id, save_dir = None):
+    context = engine.NewSession(save_dir = save_dir)
+    sessions[session_id] = context
+    return (context.StartGame(), context.Prompt(), context.IsFinished())
+
+# A turn that crashes ends only its own session (its state may be broken), not the rest of the batch
+def WorkerRunTurns(engine, sessions, turns):
+    results = []
+    for session_id, command in turns:
+        context = sessions[session_id]
+        try:
+            results.append((context.RunTurn(command), context.Prompt(), context.IsFinished()))
+        except Exception:
+            print("ERROR: session " + str(session_id) + " crashed:")
+            traceback.print_exc()
+            del sessions[session_id]
+            results.append(("\n\nSorry, something went wrong with your game and it has been ended.\n", "", True))
+    return results
+
+def WorkerExportSession(engine, sessions, session_id):
+    return sessions.pop(session_id).SerializeSession()
+
+def WorkerImportSession(engine, sessions, session_id, data):
+    sessions[session_id] = engine.LoadSession(data)
+
+def WorkerAutosave(engine, sessions, session_id):
+    context = sessions.get(session_id)
+    if (context == None) or context.IsFinished():
+        return None
+    filepath = context.SaveDirectory() / AUTOSAVE_FILENAME
+    context.WriteSave(filepath)
+    return str(filepath)
+
+def WorkerCloseSession(engine, sessions, session_id):
+    sessions.pop(session_id, None)
+
+def WorkerCountSessions(engine, sessions):
+    return len(sessions)
+
+def WorkerMemoryUsage(engine, sessions):
+    usage = ReadMemoryUsage()
+    if usage != None:
+        usage["sessions"] = len(sessions)
+    return usage
+
+def WorkerTurnTiming(engine, sessions):
+    return engine.turn_timer.Stats() if engine.turn_timer != None else None
+
+def WorkerHandlerProfile(engine, sessions):
+    return engine.handler_profiler.Profile() if engine.handler_profiler != None else None
+
+WORKER_REQUESTS = {
+    "new": WorkerNewSession,
+    "turns": WorkerRunTurns,
+    "export": WorkerExportSession,
+    "import": WorkerImportSession,
+    "autosave": WorkerAutosave,
+    "close": WorkerCloseSession,
+    "count": WorkerCountSessions,
+    "memory": WorkerMemoryUsage,
+    "timing": WorkerTurnTiming,
+    "handlers": WorkerHandlerProfile,
+}
+
+# The main loop of a worker process: answer requests (request name, arguments) until told to stop.
+# Each answer is (True, result), or (False, error text) if the request failed.
+# (A worker forked from a preloading router is handed the router's engine, with the world already loaded.)
+def WorkerMain(connection, world_dir, engine = None, warm_pool = 0, slow_turn_ms = None, slow_turn_log = None, profile_handlers = False,
+               record_dir = None):
+    # Ctrl+C in a terminal sends SIGINT to every process in the group. The front end stops the workers itself, once
+    #  it has autosaved their games, so a worker must not die first.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if engine == None:
+        engine = game.Engine(world_dir)
+    else:
+        gc.enable()
+    if slow_turn_ms != None:
+        engine.EnableTurnTiming(slow_turn_ms, slow_turn_log)
+    if profile_handlers:
+        engine.EnableHandlerProfiling()
+    if record_dir != None:
+        engine.EnableRecording(record_dir)
+    if warm_pool > 0:
+        engine.StartWarmPool(warm_pool)
+    sessions = {}
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request[0] == "stop":
+            connection.send((True, None))
+            break
+        try:
+            answer = (True, WORKER_REQUESTS[request[0]](engine, sessions, *request[1]))
+        except Exception:
+            answer = (False, traceback.format_exc())
+        connection.send(answer)
+    connection.close()
+
+
+######################### ROUTER #########################
+
+
+# The front end's handle on one worker process. Its reader thread isn't started until all the workers have been,
+#  so that no threads are running while workers are being forked.
+class WorkerHandle:
+    def __init__(self, index, world_dir, engine = None, warm_pool = 0, slow_turn_ms = None, slow_turn_log = None, profile_handlers = False,
+                 record_dir = None):
+        self.index = index
+        process_context = multiprocessing.get_context("fork") if engine != None else multiprocessing
+        self.connection, worker_connection = process_context.Pipe()
+        worker_args = (worker_connection, world_dir, engine, warm_pool, slow_turn_ms, slow_turn_log, profile_handlers, record_dir)
+        self.process = process_context.Process(target=WorkerMain, args=worker_args, daemon=True)
+        self.process.start()
+        worker_connection.close()
+        self.pending = collections.deque()
+        self.send_lock = threading.Lock()
+        self.session_count = 0
+        self.reader = threading.Thread(target=self.ReadAnswers, daemon=True)
+
+    # Sends a request and returns a Future for its answer (raises WorkerError if the worker can't be reached)
+    def Send(self, request_name, *args):
+        future = concurrent.futures.Future()
+        with self.send_lock:
+            self.pending.append(future)
+            try:
+                self.connection.send((request_name, args))
+            except OSError as e:
+                raise WorkerError("worker " + str(self.index) + " can't be reached: " + str(e))
+        return future
+
+    # Runs in the reader thread: completes the futures in the order their requests were sent
+    def ReadAnswers(self):
+        while True:
+            try:
+                ok, result = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            future = self.pending.popleft()
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(WorkerError("worker " + str(self.index) + " failed:\n" + result))
+        while self.pending:
+            self.pending.popleft().set_exception(WorkerError("worker " + str(self.index) + " has stopped"))
+
+
+# (Each worker keeps warm_pool sessions ready to start; see game.Engine.StartWarmPool(). If slow_turn_ms is set, each
+#  worker times its turns and logs the slow ones; see game.Engine.EnableTurnTiming(). If profile_handlers is set, each
+#  worker profiles its handlers; see game.Engine.EnableHandlerProfiling(). If record_dir is set, each worker records
+#  its games' transcripts there; see game.Engine.EnableRecording().)
+class ShardRouter:
+    def __init__(self, workers = None, world_dir = None, preload = False, warm_pool = 0, slow_turn_ms = None, slow_turn_log = None,
+                 profile_handlers = False, record_dir = None):
+        if workers == None:
+            workers = os.cpu_count() or 1
+        if world_dir != None:
+            world_dir = str(world_dir)
+        if preload and not "fork" in multiprocessing.get_all_start_methods():
+            print("ERROR: this platform can't fork worker processes, so the world won't be preloaded")
+            preload = False
+
+        if preload:
+            engine = PreloadWorld(world_dir)
+        else:
+            # Make sure the world bundle is up to date before the workers start, so they don't all rebuild it at once
+            game.Engine(world_dir).LoadMasters()
+            engine = None
+
+        self.workers = [WorkerHandle(i, world_dir, engine, warm_pool, slow_turn_ms, slow_turn_log, profile_handlers, record_dir)
+                        for i in range(max(1, workers))]
+        if preload:
+            gc.enable()
+        for worker in self.workers:
+            worker.reader.start()
+        self.routes = {}
+        self.next_session_id = 1
+
+    # Returns the worker that holds this session
+    def WorkerFor(self, session_id):
+        return self.workers[self.routes[session_id]]
+
+    # Starts a new session on the least busy worker. Returns its id and a Future for (output, prompt, finished).
+    # (The caller can choose the session's id; otherwise the router numbers them.)
+    def SubmitNewSession(self, save_dir = None, session_id = None):
+        if session_id == None:
+            session_id = self.next_session_id
+            self.next_session_id += 1
+        worker = min(self.workers, key=lambda w: w.session_count)
+        worker.session_count += 1
+        self.routes[session_id] = worker.index
+        return session_id, worker.Send("new", session_id, None if save_dir == None else str(save_dir))
+
+    def NewSession(self, save_dir = None):
+        session_id, future = self.SubmitNewSession(save_dir)
+        return session_id, future.result()
+
+    # Runs a turn in a session. Returns a Future for (output, prompt, finished).
+    def SubmitTurn(self, session_id, command):
+        future = concurrent.futures.Future()
+        batch_future = self.WorkerFor(session_id).Send("turns", [(session_id, command)])
+        batch_future.add_done_callback(lambda done: CopyFirstResult(done, future))
+        return future
+
+    def RunTurn(self, session_id, command):
+        return self.SubmitTurn(session_id, command).result()
+
+    # Runs a batch of turns, given as (session id, command) pairs, and returns their (output, prompt, finished)
+    #  results in the same order. The workers run their share of the batch at the same time.
+    def RunTurns(self, turns):
+        batches = {}
+        for position, (session_id, command) in enumerate(turns):
+            batches.setdefault(self.routes[session_id], []).append((position, session_id, command))
+        futures = []
+        for worker_index, batch in batches.items():
+            futures.append((batch, self.workers[worker_index].Send("turns", [(session_id, command) for position, session_id, command in batch])))
+        results = [None] * len(turns)
+        for batch, future in futures:
+            for (position, session_id, command), result in zip(batch, future.result()):
+                results[position] = result
+        return results
+
+    # Saves a session to the autosave file in its save directory (unless the player has quit). Returns a Future.
+    def SubmitAutosave(self, session_id):
+        return self.WorkerFor(session_id).Send("autosave", session_id)
+
+    def CloseSession(self, session_id):
+        worker = self.WorkerFor(session_id)
+        del self.routes[session_id]
+        worker.session_count -= 1
+        return worker.Send("close", session_id)
+
+    # Moves a session to another worker (through its serialized state)
+    def MigrateSession(self, session_id, worker_index):
+        old_worker = self.WorkerFor(session_id)
+        new_worker = self.workers[worker_index]
+        if old_worker is new_worker:
+            return
+        data = old_worker.Send("export", session_id).result()
+        new_worker.Send("import", session_id, data).result()
+        self.routes[session_id] = worker_index
+        old_worker.session_count -= 1
+        new_worker.session_count += 1
+
+    # Moves sessions from the busiest workers to the least busy ones until they hold about the same number.
+    # Returns how many sessions were moved.
+    def Rebalance(self):
+        sessions_by_worker = [[] for worker in self.workers]
+        for session_id, worker_index in self.routes.items():
+            sessions_by_worker[worker_index].append(session_id)
+        moved = 0
+        while True:
+            busiest = max(self.workers, key=lambda w: w.session_count)
+            quietest = min(self.workers, key=lambda w: w.session_count)
+            if busiest.session_count - quietest.session_count <= 1:
+                return moved
+            session_id = sessions_by_worker[busiest.index].pop()
+            self.MigrateSession(session_id, quietest.index)
+            sessions_by_worker[quietest.index].append(session_id)
+            moved += 1
+
+    def SessionCounts(self):
+        return [worker.session_count for worker in self.workers]
+
+    # Returns each worker's memory use (see ReadMemoryUsage()), or Nones where it can't be measured
+    def MemoryReport(self):
+        futures = [worker.Send("memory") for worker in self.workers]
+        return [future.result() for future in futures]
+
+    # Returns the turn timings of all the workers added together (see game.MergeTimingStats()), or None if the workers
+    #  aren't timing their turns
+    def TimingReport(self):
+        futures = [worker.Send("timing") for worker in self.workers]
+        return game.MergeTimingStats([future.result() for future in futures])
+
+    # Returns the handler profiles of all the workers added together (see game.MergeHandlerProfiles()), or None if
+    #  the workers aren't profiling their handlers
+    def HandlerProfile(self):
+        futures = [worker.Send("handlers") for worker in self.workers]
+        return game.MergeHandlerProfiles([future.result() for future in futures])
+
+    def Shutdown(self):
+        for worker in self.workers:
+            try:
+                worker.Send("stop").result(timeout=10)
+            except (WorkerError, OSError, concurrent.futures.TimeoutError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.connection.close()
+
+# Loads the world and everything a session needs into an engine, ready for forking workers from. The garbage
+#  collector is left disabled, with everything loaded so far frozen; call gc.enable() once the workers are forked.
+def PreloadWorld(world_dir):
+    gc.disable()
+    engine = game.Engine(world_dir)
+
+    # Starting a session loads the world bundle and the verb table, and imports the handler modules
+    engine.NewSession().StartGame()
+    gc.freeze()
+    return engine
+
+# Returns this process's memory use in kilobytes, split into what it shares with other processes (e.g. pages
+#  inherited from a preloading router) and what is its own. Returns None where /proc/self/smaps_rollup isn't available.
+def ReadMemoryUsage():
+    try:
+        lines = Path("/proc/self/smaps_rollup").read_text().splitlines()
+    except OSError:
+        return None
+    fields = {}
+    for line in lines[1:]:
+        name, value = line.split(":", 1)
+        fields[name] = int(value.split()[0])
+    usage = {}
+    usage["rss_kb"] = fields.get("Rss", 0)
+    usage["pss_kb"] = fields.get("Pss", 0)
+    usage["shared_kb"] = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    usage["private_kb"] = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return usage
+
+# Completes future with the first result of a batch (or with the batch's error)
+def CopyFirstResult(batch_future, future):
+    if batch_future.exception() != None:
+        future.set_exception(batch_future.exception())
+    else:
+        future.set_result(batch_future.result()[0])
+
+
+######################### THROUGHPUT TEST #########################
+
+
+TEST_COMMANDS = ["look", "inventory", "open backpack", "examine coin", "take coin", "open door", "n", "examine jukebox", "s", "w", "e"]
+
+# Runs rounds of turns (one turn in every session per round). Returns commands per second, and the workers' memory
+#  use at the end (see ShardRouter.MemoryReport()).
+def MeasureThroughput(workers, sessions, rounds, world_dir = None, preload = False):
+    router = ShardRouter(workers, world_dir, preload)
+    try:
+        session_ids = [router.SubmitNewSession()[0] for i in range(sessions)]
+        router.RunTurns([(session_id, "look") for session_id in session_ids])
+        start_time = time.perf_counter()
+        for round_number in range(rounds):
+            command = TEST_COMMANDS[round_number % len(TEST_COMMANDS)]
+            router.RunTurns([(session_id, command) for session_id in session_ids])
+        elapsed = time.perf_counter() - start_time
+        memory_report = router.MemoryReport()
+    finally:
+        router.Shutdown()
+    return sessions * rounds / elapsed, memory_report
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Measure how game throughput scales with worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--world", default=None, help="directory holding the world's JSON files (default: current directory)")
+    parser.add_argument("--preload", action="store_true", help="load the world once and fork the workers from it")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in range(1, args.workers + 1):
+        rate, memory_report = MeasureThroughput(workers, args.sessions, args.rounds, args.world, args.preload)
+        if baseline == None:
+            baseline = rate
+        print(str(workers) + " worker(s): " + "%.0f" % rate + " commands/sec (" + "%.2f" % (rate / baseline) + "x)")
+        for index, usage in enumerate(memory_report):
+            if usage != None:
+                print("  worker " + str(index) + ": " + str(usage["sessions"]) + " sessions, " + str(usage["private_kb"]) + " kB private, " +
+                      str(usage["shared_kb"]) + " kB shared (rss " + str(usage["rss_kb"]) + " kB, pss " + str(usage["pss_kb"]) + " kB)")
+
+
+if __name__ == "__main__":
+    Main()
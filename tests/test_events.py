@@ -0,0 +1,105 @@
+### THIS FILE TESTS THE EVENT SCHEDULER ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+
+
+class EventTests(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.TemporaryDirectory()
+        self.engine = game.Engine(GAME_DIR)
+        self.context = self.engine.NewSession(save_dir = self.save_dir.name)
+        self.context.StartGame()
+        self.events = self.context.events
+        self.fired = []
+
+    def tearDown(self):
+        self.save_dir.cleanup()
+
+    # Returns an event function that records its label and the turn it fired on
+    def Recorder(self, label):
+        def RecordEvent(context):
+            self.fired.append((label, context.state.turn_counter))
+        return RecordEvent
+
+    def Wait(self, turns):
+        for turn in range(turns):
+            self.context.RunTurn("wait")
+
+    def test_events_fire_on_their_turn(self):
+        start = self.context.state.turn_counter
+        self.events.CreateEventInNMoves(self.Recorder("later"), 3)
+        self.events.CreateEventInNMoves(self.Recorder("sooner"), 1)
+        self.Wait(4)
+        self.assertEqual(self.fired, [("sooner", start + 1), ("later", start + 3)])
+
+    def test_events_on_the_same_turn_fire_in_the_order_they_were_created(self):
+        for label in ["first", "second", "third"]:
+            self.events.CreateEventInNMoves(self.Recorder(label), 2)
+        self.Wait(3)
+        self.assertEqual([label for label, turn in self.fired], ["first", "second", "third"])
+
+    def test_named_event_replaces_the_pending_one(self):
+        self.events.CreateEventInNMoves(self.Recorder("old"), 1, name = "ALARM")
+        new_event = self.events.CreateEventInNMoves(self.Recorder("new"), 2, name = "ALARM")
+        self.assertIs(self.events.GetEvent("ALARM"), new_event)
+        self.Wait(3)
+        self.assertEqual([label for label, turn in self.fired], ["new"])
+        self.assertEqual(self.events.GetEvent("ALARM"), None)
+
+    def test_recurring_event(self):
+        start = self.context.state.turn_counter
+        self.events.CreateRecurringEvent(self.Recorder("tick"), 1, 2, name = "TICK")
+        self.Wait(6)
+        self.assertEqual([turn - start for label, turn in self.fired], [1, 3, 5])
+        self.assertTrue(self.events.CancelEvent("TICK"))
+        self.Wait(4)
+        self.assertEqual(len(self.fired), 3)
+
+    def test_cancelled_events(self):
+        event = self.events.CreateEventInNMoves(self.Recorder("cancelled"), 1)
+        self.events.CreateEventInNMoves(self.Recorder("named"), 1, name = "NAMED")
+        self.events.CreateEventInNMoves(self.Recorder("kept"), 1)
+        self.assertTrue(self.events.CancelEvent(event))
+        self.assertFalse(self.events.CancelEvent(event))
+        self.assertTrue(self.events.CancelEvent("NAMED"))
+        self.assertFalse(self.events.CancelEvent("NAMED"))
+        self.Wait(2)
+        self.assertEqual([label for label, turn in self.fired], ["kept"])
+
+    def test_many_cancelled_events_are_cleared_out(self):
+        events = [self.events.CreateEventInNMoves(self.Recorder(str(n)), 5) for n in range(200)]
+        for event in events[:150]:
+            self.events.CancelEvent(event)
+        self.assertLess(len(self.events.event_queue), 200)
+        self.Wait(6)
+        self.assertEqual([label for label, turn in self.fired], [str(n) for n in range(150, 200)])
+
+    # Pending events are saved in the order they will fire, and carry on after a restore
+    def test_events_are_saved_and_restored(self):
+        self.events.PrintStringInNMoves("Second message.", 2)
+        self.events.PrintStringInNMoves("First message.", 1)
+        self.context.RunTurn("save")
+        self.context.RunTurn("1")
+        self.assertEqual([record["message"] for record in self.events.Serialize()], ["\nFirst message.", "\nSecond message."])
+
+        restored = self.engine.NewSession(save_dir = self.save_dir.name)
+        restored.StartGame()
+        restored.RunTurn("restore")
+        restored.RunTurn("1")
+        self.assertEqual(restored.events.Serialize(), self.events.Serialize())
+        output = "".join(restored.RunTurn("wait") for turn in range(3))
+        self.assertLess(output.index("First message."), output.index("Second message."))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+### THIS FILE TESTS THE INDEX OF WHERE EACH ITEM IS (ITEM HOLDERS) ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+
+
+class HoldersTests(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.TemporaryDirectory()
+        self.engine = game.Engine(GAME_DIR)
+        self.context = self.engine.NewSession(save_dir = self.save_dir.name)
+        self.context.StartGame()
+        self.items = self.context.items
+
+    def tearDown(self):
+        self.save_dir.cleanup()
+
+    # Checks the index against a scan of every place an item can be
+    def assertHoldersMatchWorld(self, context):
+        scanned = {}
+        for item_key in context.player.inventory:
+            scanned.setdefault(item_key, []).append("PLAYER")
+        for location_key in context.locations.locations_dictionary:
+            for item_key in context.locations[location_key]["items"]:
+                scanned.setdefault(item_key, []).append(location_key)
+        for container_key in context.items.items_dictionary:
+            for item_key in context.items[container_key].get("contents", []):
+                scanned.setdefault(item_key, []).append(container_key)
+        for item_key in context.items.items_dictionary:
+            self.assertEqual(sorted(context.items.GetItemHolders(item_key)), sorted(scanned.get(item_key, [])), item_key)
+
+    def test_initial_holders(self):
+        self.assertEqual(sorted(self.items.GetItemHolders("DINER_DOOR")), ["DINER_INTERIOR", "OUTSIDE_DINER"])
+        self.assertEqual(self.items.GetItemHolders("COIN"), ["BACKPACK"])
+        self.assertHoldersMatchWorld(self.context)
+
+    def test_moves(self):
+        self.items.MoveItemTo("COIN", "PLAYER")
+        self.assertEqual(self.items.GetItemHolders("COIN"), ["PLAYER"])
+        self.items.MoveItemTo("COIN", "BOXING_GYM")
+        self.assertEqual(self.items.GetItemHolders("COIN"), ["BOXING_GYM"])
+        self.items.MoveItemTo("PUNCHING_BAG", "BACKPACK")
+        self.assertEqual(self.items.GetItemHolders("PUNCHING_BAG"), ["BACKPACK"])
+        self.assertHoldersMatchWorld(self.context)
+
+    def test_removals(self):
+        self.items.RemoveItemFromHolder("YELLOW_FLOWERS", "DINER_CORNER")
+        self.assertEqual(self.items.GetItemHolders("YELLOW_FLOWERS"), ["OUTSIDE_DINER"])
+        self.items.RemoveItemFromGame("DINER_DOOR")
+        self.assertEqual(self.items.GetItemHolders("DINER_DOOR"), [])
+        self.assertNotIn("DINER_DOOR", self.context.locations["OUTSIDE_DINER"]["items"])
+        self.items.PlaceItemIn("DINER_DOOR", "BOXING_GYM")
+        self.assertEqual(self.items.GetItemHolders("DINER_DOOR"), ["BOXING_GYM"])
+        self.assertHoldersMatchWorld(self.context)
+
+    def test_commands_keep_holders_in_step(self):
+        for command in ["open backpack", "take coin", "drop coin", "w", "drop backpack", "e"]:
+            self.context.RunTurn(command)
+        self.assertEqual(self.items.GetItemHolders("COIN"), ["OUTSIDE_DINER"])
+        self.assertEqual(self.items.GetItemHolders("BACKPACK"), ["DINER_CORNER"])
+        self.assertHoldersMatchWorld(self.context)
+
+    def test_holders_are_rebuilt_on_restore(self):
+        self.items.MoveItemTo("COIN", "BOXING_GYM")
+        self.items.RemoveItemFromGame("BLUE_FLOWERS")
+        self.context.RunTurn("save")
+        self.context.RunTurn("1")
+
+        restored = self.engine.NewSession(save_dir = self.save_dir.name)
+        restored.StartGame()
+        restored.RunTurn("restore")
+        restored.RunTurn("1")
+        self.assertEqual(restored.items.GetItemHolders("COIN"), ["BOXING_GYM"])
+        self.assertEqual(restored.items.GetItemHolders("BLUE_FLOWERS"), [])
+        self.assertHoldersMatchWorld(restored)
+
+    # One game's moves don't show in another's
+    def test_sessions_have_their_own_holders(self):
+        self.items.RemoveItemFromGame("DINER_DOOR")
+        other = self.engine.NewSession(save_dir = self.save_dir.name)
+        other.StartGame()
+        self.assertEqual(sorted(other.items.GetItemHolders("DINER_DOOR")), ["DINER_INTERIOR", "OUTSIDE_DINER"])
+        self.assertHoldersMatchWorld(other)
+
+
+if __name__ == "__main__":
+    unittest.main()
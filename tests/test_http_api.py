@@ -0,0 +1,85 @@
+### THIS FILE TESTS THE STATELESS HTTP/JSON API ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import base64
+import hashlib
+import hmac
+import http.client
+import json
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+import http_api
+import save_format
+
+SECRET = b"test secret"
+
+
+class HttpApiTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = game.Engine(GAME_DIR)
+        cls.server = http_api.TurnServer(("localhost", 0), http_api.StatelessGame(cls.engine, SECRET))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    # Posts a turn, returning the status and the decoded response
+    def PostTurn(self, state, command = ""):
+        connection = http.client.HTTPConnection("localhost", self.server.server_address[1])
+        try:
+            connection.request("POST", "/turn", json.dumps({"state": state, "command": command}))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    # Signs session data the way the server does
+    def SignState(self, data):
+        return base64.b64encode(hmac.new(SECRET, data, hashlib.sha256).digest() + data).decode("ascii")
+
+    def test_turns_carry_on_from_the_state(self):
+        status, response = self.PostTurn(None)
+        self.assertEqual(status, 200)
+        self.assertIn("Outside Diner", response["output"])
+        status, response = self.PostTurn(response["state"], "w")
+        self.assertEqual(status, 200)
+        self.assertIn("Diner Corner", response["output"])
+        status, response = self.PostTurn(response["state"], "e")
+        self.assertIn("Outside Diner", response["output"])
+
+    def test_tampered_state(self):
+        status, response = self.PostTurn(None)
+        raw = bytearray(base64.b64decode(response["state"]))
+        raw[-1] ^= 1
+        status, response = self.PostTurn(base64.b64encode(bytes(raw)).decode("ascii"), "look")
+        self.assertEqual(status, 400)
+        self.assertIn("bad signature", response["error"])
+
+    # A state signed by a server running another version of the world (e.g. during a rolling deploy) is refused
+    def test_state_from_another_world(self):
+        sections = save_format.DecodeSave(self.engine.NewSession().SerializeSession())
+        sections["player"]["location"] = "NO_SUCH_PLACE"
+        status, response = self.PostTurn(self.SignState(save_format.EncodeSave(sections, True, save_format.SESSION_SCHEMA)), "look")
+        self.assertEqual(status, 400)
+        self.assertIn("NO_SUCH_PLACE", response["error"])
+
+    def test_state_waiting_on_unknown_prompt(self):
+        sections = save_format.DecodeSave(self.engine.NewSession().SerializeSession())
+        sections["session"]["prompt"] = ["NoSuchPrompt", False]
+        status, response = self.PostTurn(self.SignState(save_format.EncodeSave(sections, True, save_format.SESSION_SCHEMA)), "1")
+        self.assertEqual(status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+### THIS FILE TESTS READING AND WRITING SAVED GAME FILES ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+import save_format
+
+# A save made by the original (pickle saving) game: the player is in the diner with the jukebox playing, so both the
+#  JukeboxSound and PlayJukebox events are pending
+BASELINE_SAVE = Path(__file__).resolve().parent / "data" / "baseline_save.pickle"
+
+
+class LegacySaveTests(unittest.TestCase):
+    def test_read_baseline_save_with_several_events(self):
+        sections = save_format.ReadSaveFile(BASELINE_SAVE)
+        self.assertEqual(len(sections["events"]), 2)
+        for event in sections["events"]:
+            self.assertIsInstance(event, save_format.LegacyEvent)
+
+    def test_restore_baseline_save(self):
+        with tempfile.TemporaryDirectory() as save_dir:
+            shutil.copyfile(BASELINE_SAVE, Path(save_dir) / "game_data01.pickle")
+            context = game.Engine(GAME_DIR).NewSession(save_dir = save_dir)
+            context.StartGame()
+            context.RunTurn("restore")
+            output = context.RunTurn("1")
+            self.assertNotIn("Restore failed", output)
+            self.assertEqual(context.player.location, "DINER_INTERIOR")
+            self.assertEqual(len(context.events.Serialize()), 2)
+
+            # The restored PlayJukebox event carries on with the song
+            output = context.RunTurn("wait")
+            self.assertIn("The jukebox is playing a loud song", output)
+
+
+class SaveTests(unittest.TestCase):
+    # A list changed in place (rather than set with entry[field] = ...) is still saved
+    def test_list_changed_in_place_is_saved(self):
+        with tempfile.TemporaryDirectory() as save_dir:
+            engine = game.Engine(GAME_DIR)
+            context = engine.NewSession(save_dir = save_dir)
+            context.StartGame()
+            context.items["BACKPACK"]["contents"].append("PUNCHING_BAG")
+            context.RunTurn("save")
+            self.assertIn("Game saved.", context.RunTurn("1"))
+
+            restored = engine.NewSession(save_dir = save_dir)
+            restored.StartGame()
+            restored.RunTurn("restore")
+            restored.RunTurn("1")
+            self.assertEqual(list(restored.items["BACKPACK"]["contents"]), ["COIN", "PUNCHING_BAG"])
+
+            # The shared world is untouched
+            self.assertEqual(list(engine.NewSession(save_dir = save_dir).items["BACKPACK"]["contents"]), ["COIN"])
+
+
+# Saves that don't fit the current world (e.g. made by another version of the game) fail to restore and leave the game
+#  as it was
+class MismatchedSaveTests(unittest.TestCase):
+    def RestoreChangedSave(self, change_sections):
+        with tempfile.TemporaryDirectory() as save_dir:
+            context = game.Engine(GAME_DIR).NewSession(save_dir = save_dir)
+            context.StartGame()
+            sections = context.SaveSections()
+            change_sections(sections)
+            encrypted = {}
+            for section_name in sections:
+                encrypted[section_name] = context.EncryptObject(sections[section_name])
+            save_format.WriteSaveFile(Path(save_dir) / "game_data01.sav", encrypted)
+
+            context.RunTurn("w")
+            context.RunTurn("restore")
+            output = context.RunTurn("1")
+            self.assertIn("Restore failed", output)
+            self.assertEqual(context.player.location, "DINER_CORNER")
+            self.assertIn("Diner Corner", context.RunTurn("look"))
+            return output
+
+    def test_unknown_event_function(self):
+        output = self.RestoreChangedSave(lambda sections: sections["events"].append({"trigger_turn": 5, "function": "globals.NoSuchFunc"}))
+        self.assertIn("globals.NoSuchFunc", output)
+
+    def test_unknown_location(self):
+        output = self.RestoreChangedSave(lambda sections: sections["locations"].update({"NO_SUCH_PLACE": {"visited?": True}}))
+        self.assertIn("NO_SUCH_PLACE", output)
+
+    def test_unknown_item(self):
+        output = self.RestoreChangedSave(lambda sections: sections["player"].update({"inventory": ["COIN", "NO_SUCH_ITEM"]}))
+        self.assertIn("NO_SUCH_ITEM", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+### THIS FILE TESTS THE PER-TURN SCOPE (WHAT THE PLAYER CAN SEE AND REACH) ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+
+
+class ScopeTests(unittest.TestCase):
+    def setUp(self):
+        self.save_dir = tempfile.TemporaryDirectory()
+        self.context = game.Engine(GAME_DIR).NewSession(save_dir = self.save_dir.name)
+        self.context.StartGame()
+        self.items = self.context.items
+
+    def tearDown(self):
+        self.save_dir.cleanup()
+
+    def test_scope_is_kept_between_lookups(self):
+        scope = self.items.GetScope()
+        self.assertTrue(self.items.TestIfItemIsHere("STREETLAMP"))
+        self.assertIs(self.items.GetScope(), scope)
+
+    def test_opening_a_container_refreshes_the_scope(self):
+        self.assertFalse(self.items.TestIfItemIsHere("COIN"))
+        self.items.SetOpen("BACKPACK", True)
+        self.assertTrue(self.items.TestIfItemIsHere("COIN"))
+        self.items.SetOpen("BACKPACK", False)
+        self.assertFalse(self.items.TestIfItemIsHere("COIN"))
+
+    def test_moving_an_item_refreshes_the_scope(self):
+        self.assertFalse(self.items.TestIfItemIsHere("PUNCHING_BAG"))
+        self.items.MoveItemTo("PUNCHING_BAG", "OUTSIDE_DINER")
+        self.assertTrue(self.items.TestIfItemIsHere("PUNCHING_BAG"))
+        self.items.MoveItemTo("PUNCHING_BAG", "BOXING_GYM")
+        self.assertFalse(self.items.TestIfItemIsHere("PUNCHING_BAG"))
+
+    def test_light_source_refreshes_darkness(self):
+        self.context.player.SetPlayerLocation("BOXING_GYM")
+        self.assertTrue(self.context.locations.IsDark())
+        self.assertFalse(self.items.TestIfItemIsHere("PUNCHING_BAG"))
+
+        self.items.MoveItemTo("FLASHLIGHT", "PLAYER")
+        self.assertTrue(self.context.locations.IsDark())
+        self.items.SetLightSource("FLASHLIGHT", True)
+        self.assertFalse(self.context.locations.IsDark())
+        self.assertTrue(self.items.TestIfItemIsHere("PUNCHING_BAG"))
+
+        self.items.SetLightSource("FLASHLIGHT", False)
+        self.assertTrue(self.context.locations.IsDark())
+        self.assertTrue(self.items.TestIfItemIsHere("FLASHLIGHT"))
+
+    def test_commands_see_the_refreshed_scope(self):
+        self.assertIn("You can't see any coin here", self.context.RunTurn("take coin"))
+        self.context.RunTurn("open backpack")
+        self.assertIn("Taken", self.context.RunTurn("take coin"))
+        self.assertIn("COIN", self.context.player.inventory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+### THIS FILE TESTS THE TCP/TELNET SERVER ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+import server
+import sessions
+
+
+class ServerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.engine = game.Engine(GAME_DIR)
+
+    async def asyncTearDown(self):
+        if self.game_server.server != None:
+            self.game_server.server.close()
+            await self.game_server.server.wait_closed()
+        self.temp_dir.cleanup()
+
+    # Starts a server on a free port (memory_budget in bytes, or None to keep every session in memory)
+    async def StartServer(self, idle_timeout = server.DEFAULT_IDLE_TIMEOUT, memory_budget = None):
+        session_manager = sessions.SessionManager(self.engine, Path(self.temp_dir.name) / "store", memory_budget)
+        self.game_server = server.GameServer(server.LocalBackend(session_manager), "localhost", 0, idle_timeout,
+                                             Path(self.temp_dir.name) / "saves")
+        await self.game_server.Start()
+        self.port = self.game_server.server.sockets[0].getsockname()[1]
+
+    async def Connect(self):
+        reader, writer = await asyncio.open_connection("localhost", self.port)
+        intro = (await reader.readuntil(b"> ")).decode("utf-8")
+        self.assertIn("Outside Diner", intro)
+        return reader, writer
+
+    async def PlayTurn(self, reader, writer, command):
+        writer.write(command.encode("utf-8") + b"\r\n")
+        await writer.drain()
+        return (await reader.readuntil(b"> ")).decode("utf-8")
+
+    async def test_scripted_client(self):
+        await self.StartServer()
+        commands = ["look", "inventory", "open backpack", "w", "e"]
+        self.assertEqual(await server.RunClient("localhost", self.port, commands), len(commands))
+
+    async def test_turns_are_played(self):
+        await self.StartServer()
+        reader, writer = await self.Connect()
+        self.assertIn("Diner Corner", await self.PlayTurn(reader, writer, "w"))
+        self.assertIn("backpack", await self.PlayTurn(reader, writer, "inventory"))
+        writer.close()
+
+    # An idle player is told that their game was saved only once it has been
+    async def test_idle_player_is_saved_then_disconnected(self):
+        await self.StartServer(idle_timeout = 0.2)
+        reader, writer = await self.Connect()
+        await self.PlayTurn(reader, writer, "w")
+        message = (await reader.read()).decode("utf-8")
+        self.assertIn("You have been idle for too long", message)
+        self.assertIn("Your game has been saved.", message)
+        self.assertTrue((Path(self.temp_dir.name) / "saves" / "session1" / server.AUTOSAVE_FILENAME).exists())
+        writer.close()
+
+    # A session that can't be rehydrated ends with the usual message, and the other sessions carry on
+    async def test_session_that_cant_be_rehydrated(self):
+        await self.StartServer(memory_budget = 1)
+        first_reader, first_writer = await self.Connect()
+        second_reader, second_writer = await self.Connect()
+        store_path = self.game_server.backend.session_manager.StorePath(1)
+        self.assertTrue(store_path.exists())
+        store_path.write_bytes(b"not a session")
+
+        first_writer.write(b"look\r\n")
+        await first_writer.drain()
+        message = (await first_reader.read()).decode("utf-8")
+        self.assertIn("something went wrong with your game", message)
+        self.assertIn("Diner Corner", await self.PlayTurn(second_reader, second_writer, "w"))
+        first_writer.close()
+        second_writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+### THIS FILE TESTS HIBERNATING AND REHYDRATING SESSIONS ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+import sessions
+
+COMMANDS = ["open backpack", "take coin", "w", "drop backpack", "inventory", "e", "look", "save", "1", "n", "open door", "n",
+            "examine jukebox", "put coin in slot", "wait", "wait", "s", "w", "take backpack", "look"]
+
+
+class SessionManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.engine = game.Engine(GAME_DIR)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def SaveDir(self, name):
+        save_dir = Path(self.temp_dir.name) / name
+        save_dir.mkdir()
+        return save_dir
+
+    # Plays the commands in a session that stays in memory, returning the output of each turn
+    def PlayResident(self, commands):
+        context = self.engine.NewSession(save_dir = self.SaveDir("resident"))
+        outputs = [context.StartGame()]
+        for command in commands:
+            outputs.append(context.RunTurn(command))
+        return outputs
+
+    # A session that is hibernated between every turn (even with a save prompt pending) plays the same game
+    def test_hibernated_session_plays_the_same(self):
+        manager = sessions.SessionManager(self.engine, Path(self.temp_dir.name) / "store", memory_budget = 1)
+        self.assertEqual(manager.max_resident, 1)
+        session_id, context = manager.NewSession(self.SaveDir("hibernated"))
+        outputs = [context.StartGame()]
+        other_id, other = manager.NewSession(self.SaveDir("other"))
+        other.StartGame()
+        for command in COMMANDS:
+            self.assertFalse(session_id in manager.resident)
+            outputs.append(manager.GetContext(session_id).RunTurn(command))
+            manager.GetContext(other_id).RunTurn("look")
+
+        self.assertEqual(outputs, self.PlayResident(COMMANDS))
+        stats = manager.Stats()
+        self.assertGreaterEqual(stats["rehydrations"], len(COMMANDS))
+
+    def test_closed_session_is_forgotten(self):
+        manager = sessions.SessionManager(self.engine, Path(self.temp_dir.name) / "store", memory_budget = 1)
+        first_id, first = manager.NewSession(self.SaveDir("first"))
+        manager.NewSession(self.SaveDir("second"))
+        store_path = manager.StorePath(first_id)
+        self.assertTrue(store_path.exists())
+        manager.CloseSession(first_id)
+        self.assertFalse(store_path.exists())
+        self.assertFalse(manager.HasSession(first_id))
+        self.assertEqual(manager.GetContext(first_id), None)
+
+    # The estimate of a session's size follows the sessions being played
+    def test_live_sessions_are_measured(self):
+        manager = sessions.SessionManager(self.engine, Path(self.temp_dir.name) / "store", memory_budget = 100 * 1024 * 1024)
+        session_id, context = manager.NewSession(self.SaveDir("measured"))
+        context.StartGame()
+        for turn in range(sessions.SIZE_SAMPLE_INTERVAL):
+            manager.GetContext(session_id).RunTurn("look")
+        self.assertEqual(len(manager.size_samples), 1)
+        self.assertEqual(manager.max_resident, manager.memory_budget // manager.session_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+### THIS FILE TESTS RECORDING TRANSCRIPTS AND REPLAYING THEM ###
+
+# Run "python -m pytest tests" from the top directory of the game.
+
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+GAME_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(GAME_DIR))
+
+import game
+import replay
+
+COMMANDS = ["open backpack", "take coin", "save", "1", "w", "drop coin", "e", "restore", "1", "inventory", "look"]
+
+
+class TranscriptTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_dir = Path(self.temp_dir.name) / "saves"
+        self.save_dir.mkdir()
+        self.engine = game.Engine(GAME_DIR)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    # Plays the commands in a session recording to path
+    def Record(self, path, commands, from_start = True):
+        context = self.engine.NewSession(save_dir = self.save_dir)
+        if from_start:
+            context.StartRecording(path, from_start = True)
+        context.StartGame()
+        for command in commands:
+            if command == None:
+                context.StartRecording(path)
+            else:
+                context.RunTurn(command)
+        return context
+
+    def test_recorded_game_replays(self):
+        path = Path(self.temp_dir.name) / ("game" + game.TRANSCRIPT_SUFFIX)
+        self.Record(path, COMMANDS)
+        header, entries = game.ReadTranscript(path)
+        self.assertEqual(len(entries), len(COMMANDS) + 1)
+        self.assertTrue(entries[0].get("start"))
+        self.assertTrue(entries[4].get("prompt"))
+
+        results = replay.ReplayTranscript(self.engine, path)
+        self.assertEqual(results["error"], None)
+        self.assertEqual(results["turns"], len(COMMANDS) + 1)
+        self.assertEqual(results["mismatch_count"], 0)
+
+    # A transcript started part way through a game (after a save) replays from the session as it was then
+    def test_transcript_started_mid_game_replays(self):
+        path = Path(self.temp_dir.name) / ("game" + game.TRANSCRIPT_SUFFIX)
+        self.Record(path, ["open backpack", "take coin", "save", "1", "w", None, "drop coin", "e", "restore", "1", "look"], from_start = False)
+        header, entries = game.ReadTranscript(path)
+        self.assertIn("state", header)
+        self.assertEqual(len(header["saves"]), 1)
+
+        results = replay.ReplayTranscript(self.engine, path)
+        self.assertEqual(results["error"], None)
+        self.assertEqual(results["turns"], 5)
+        self.assertEqual(results["mismatch_count"], 0)
+
+    def test_changed_output_is_reported(self):
+        path = Path(self.temp_dir.name) / ("game" + game.TRANSCRIPT_SUFFIX)
+        self.Record(path, ["look", "w"])
+        lines = path.read_text().splitlines()
+        entry = json.loads(lines[2])
+        entry["output"] = game.OutputHash("something else")
+        lines[2] = json.dumps(entry)
+        path.write_text("\n".join(lines) + "\n")
+
+        results = replay.ReplayTranscript(self.engine, path)
+        self.assertEqual(results["mismatch_count"], 1)
+        self.assertEqual(results["mismatches"][0]["input"], "look")
+
+    def test_directory_of_transcripts_replays(self):
+        record_dir = Path(self.temp_dir.name) / "transcripts"
+        self.engine.EnableRecording(record_dir)
+        for commands in [["look"], ["w", "e"], ["open backpack", "take coin"]]:
+            context = self.engine.NewSession(save_dir = self.save_dir)
+            context.StartGame()
+            for command in commands:
+                context.RunTurn(command)
+        transcript_paths = replay.FindTranscripts([record_dir])
+        self.assertEqual(len(transcript_paths), 3)
+        for results in replay.ReplayTranscripts(transcript_paths, GAME_DIR, workers = 0):
+            self.assertEqual(results["error"], None)
+            self.assertEqual(results["mismatch_count"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
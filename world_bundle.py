@@ -0,0 +1,117 @@
+### THIS FILE CACHES THE COMPILED WORLD ###
+
+# You probably don't need to modify this file.
+#
+# Starting (or restarting) a game means parsing locations.json, items.json and actions.json and then working out
+#  everything derived from them: the lexicon, the item word index, the verb table, where every item starts, and so on.
+#  This file stores the result as a single marshal file (.world_cache/world.bundle), so later starts can load it in
+#  one read instead. The bundle is keyed by a hash of the source files (and of the bundle layout and Python
+#  version), so it is rebuilt automatically whenever one of them changes.
+#
+# The compiled world is loaded once per process and shared by every game: each game's locations, items and actions
+#  are overlays that keep only that game's changes (see WorldEntry in game.py), so nothing may ever change the
+#  shared world itself.
+#
+# The cache works a lot like __pycache__: it is safe to delete at any time.
+
+import hashlib
+import marshal
+import sys
+import time
+from pathlib import Path
+
+# Bump this whenever the layout of the compiled world changes
+BUNDLE_VERSION = 4
+
+MAGIC = b"TAVW"
+SOURCE_FILES = ["locations.json", "items.json", "actions.json"]
+CACHE_DIRECTORY = ".world_cache"
+BUNDLE_FILENAME = "world.bundle"
+
+# world directory -> (source file stats, source hash, time of the check), so a restart only re-hashes the sources if
+#  they've been touched
+source_hash_cache = {}
+
+# Once the source files have been checked, trust that check for this many seconds (a busy server starts many
+#  sessions a second, and checking the files each time would cost more than loading the bundle)
+SOURCE_CHECK_INTERVAL = 1.0
+
+# world directory -> (source hash, compiled world), so a restart doesn't even need to read the bundle from disk
+bundle_cache = {}
+
+
+# Returns a hash of the world's source files (plus everything else that affects the compiled layout)
+def SourceHash(world_dir):
+    world_dir = Path(world_dir)
+    cached = source_hash_cache.get(world_dir)
+    now = time.monotonic()
+    if (cached != None) and (now - cached[2] < SOURCE_CHECK_INTERVAL):
+        return cached[1]
+
+    stats = []
+    for filename in SOURCE_FILES:
+        file_stat = (world_dir / filename).stat()
+        stats.append((filename, file_stat.st_size, file_stat.st_mtime_ns))
+    if (cached != None) and (cached[0] == stats):
+        source_hash_cache[world_dir] = (stats, cached[1], now)
+        return cached[1]
+
+    source_hash = hashlib.sha256()
+    source_hash.update(repr((BUNDLE_VERSION, marshal.version, sys.version_info[:2])).encode("utf-8"))
+    for filename in SOURCE_FILES:
+        source_hash.update(filename.encode("utf-8"))
+        source_hash.update((world_dir / filename).read_bytes())
+    source_hash = source_hash.digest()
+    source_hash_cache[world_dir] = (stats, source_hash, now)
+    return source_hash
+
+
+def BundlePath(world_dir):
+    return Path(world_dir) / CACHE_DIRECTORY / BUNDLE_FILENAME
+
+
+# Returns the compiled world if the bundle is up to date with the source files, otherwise None.
+# The same objects are returned to every caller until the source files change, so callers must never change them.
+#  The world's "source_hash" identifies the version of the world it came from.
+def ReadBundle(world_dir):
+    world_dir = Path(world_dir)
+    source_hash = SourceHash(world_dir)
+    cached = bundle_cache.get(world_dir)
+    if (cached != None) and (cached[0] == source_hash):
+        return cached[1]
+    try:
+        data = BundlePath(world_dir).read_bytes()
+    except OSError:
+        return None
+    header = MAGIC + source_hash
+    if not data.startswith(header):
+        return None
+    try:
+        world = marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+        return None
+    world["source_hash"] = source_hash
+    bundle_cache[world_dir] = (source_hash, world)
+    return world
+
+
+# Stores the compiled world (which must only hold dicts, lists, sets, tuples, strings, numbers, booleans and None)
+def WriteBundle(world_dir, world):
+    world_dir = Path(world_dir)
+    source_hash = SourceHash(world_dir)
+    payload = marshal.dumps(world)
+
+    # The cached copy is loaded from the payload, so it doesn't share any objects with the caller's world
+    cached_world = marshal.loads(payload)
+    cached_world["source_hash"] = source_hash
+    bundle_cache[world_dir] = (source_hash, cached_world)
+
+    # If the cache can't be written (e.g. a read-only install), the game still runs; it just compiles at each start
+    bundle_path = BundlePath(world_dir)
+    try:
+        bundle_path.parent.mkdir(exist_ok=True)
+        temp_path = bundle_path.with_suffix(".tmp")
+        temp_path.write_bytes(MAGIC + source_hash + payload)
+        temp_path.replace(bundle_path)
+    except OSError:
+        pass
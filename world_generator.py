@@ -0,0 +1,274 @@
+### THIS FILE GENERATES LARGE WORLDS FOR SCALING TESTS ###
+
+# Run "python world_generator.py --rooms 10000 --items 100000 --output generated_world" to write a world directory
+#  (locations.json, items.json and actions.json) that loads like any other world:
+#   python game.py (from inside generated_world), or "python benchmark.py --world generated_world"
+#
+# The generated world is the sample world (copied from --base, with its actions.json, so all of the handlers still
+#  find their items and locations) plus a grid of generated rooms that starts east of OUTSIDE_DINER. The generated part
+#  has what a big world has and the sample world doesn't:
+#   - rooms joined to their neighbours, some through doors ("ROOM_12|DOOR_3"), some of them closed
+#   - dark rooms (--dark), most with a lit lamp somewhere nearby and some with one inside
+#   - chains of containers nested --container-depth deep, with items in the innermost ones
+#   - items named from a small vocabulary (--nouns, --adjectives), so many items share their words
+# The same arguments (and --seed) always make the same world.
+
+import argparse
+import json
+import math
+import random
+import shutil
+from pathlib import Path
+
+DEFAULT_OUTPUT = "generated_world"
+
+# The sample world's exit that leads into the generated rooms (and the way back)
+ENTRANCE_LOCATION = "OUTSIDE_DINER"
+ENTRANCE_DIRECTION = "east"
+
+DIRECTIONS = ["north", "south", "east", "west", "northeast", "northwest", "southeast", "southwest", "up", "down", "in", "out"]
+
+# Grid steps: direction -> (the opposite direction, x step, y step)
+GRID_STEPS = {"east": ("west", 1, 0), "south": ("north", 0, 1)}
+
+NOUNS = ["BOX", "BOOK", "CUP", "KEY", "COIN", "RING", "LAMP", "STONE", "BOTTLE", "CARD", "SPOON", "PEN", "CANDLE",
+         "BELL", "STATUE", "PLATE", "ROPE", "SHELL", "FEATHER", "MAP", "SCROLL", "GLOVE", "HAT", "BOOT", "CLOCK",
+         "MIRROR", "VASE", "BRUSH", "COMB", "DIE", "MARBLE", "NAIL", "PIPE", "TICKET", "WHISTLE", "BADGE", "BUTTON",
+         "LEAF", "BONE", "SOCK", "JAR", "TIN", "FORK", "KNIFE", "BOWL", "BRICK", "FLOWER", "POT", "BAG", "RECORD"]
+
+ADJECTIVES = ["RED", "BLUE", "GREEN", "YELLOW", "BLACK", "WHITE", "SILVER", "GOLD", "BRASS", "WOODEN", "GLASS",
+              "OLD", "NEW", "SHINY", "DUSTY", "SMALL", "LARGE", "HEAVY", "LIGHT", "BROKEN", "CRACKED", "CHIPPED",
+              "ROUND", "SQUARE", "TINY", "HUGE", "STRANGE", "PLAIN", "FANCY", "RUSTY"]
+
+CONTAINER_NOUNS = ["BOX", "CHEST", "CRATE", "BAG", "CASE", "TIN", "JAR", "CABINET"]
+
+ROOM_NAMES = ["Storeroom", "Hallway", "Office", "Workshop", "Gallery", "Cellar", "Library", "Kitchen", "Attic",
+              "Studio", "Lobby", "Closet", "Pantry", "Vault", "Courtyard", "Landing"]
+
+
+######################### GENERATING #########################
+
+
+# This class builds the generated part of a world: its locations and items, as they'd appear in the JSON files
+class WorldGenerator:
+    def __init__(self, rooms, items, container_depth = 3, container_fraction = 0.1, dark_fraction = 0.05,
+                 door_fraction = 0.1, nouns = len(NOUNS), adjectives = len(ADJECTIVES), seed = 0):
+        self.room_count = max(1, rooms)
+        self.item_count = max(0, items)
+        self.container_depth = max(1, container_depth)
+        self.container_fraction = container_fraction
+        self.dark_fraction = dark_fraction
+        self.door_fraction = door_fraction
+        self.nouns = NOUNS[:max(1, min(nouns, len(NOUNS)))]
+        self.adjectives = ADJECTIVES[:max(1, min(adjectives, len(ADJECTIVES)))]
+        self.random = random.Random(seed)
+        self.locations = {}
+        self.items = {}
+        self.room_keys = []
+        self.grid_width = int(math.ceil(math.sqrt(self.room_count)))
+
+    def RoomKey(self, index):
+        return "ROOM_" + str(index)
+
+    # Builds everything, returning (locations, items)
+    def Generate(self):
+        self.GenerateRooms()
+        self.GenerateExits()
+        self.GenerateLights()
+        self.GenerateContainers()
+        self.GenerateItems()
+        for loc_key in self.room_keys:
+            self.DescribeRoom(loc_key)
+        return self.locations, self.items
+
+    # Items can be made until the --items budget runs out
+    def ItemsLeft(self):
+        return self.item_count - len(self.items)
+
+    def GenerateRooms(self):
+        for index in range(self.room_count):
+            loc_key = self.RoomKey(index)
+            location = {}
+            location["brief_desc"] = self.random.choice(ROOM_NAMES) + " " + str(index)
+            location["long_desc"] = ""
+            location["dark?"] = self.random.random() < self.dark_fraction
+            for direction in DIRECTIONS:
+                location[direction] = ""
+            self.locations[loc_key] = location
+            self.room_keys.append(loc_key)
+
+    # Joins each room to its east and south neighbours on the grid. Every room is joined to the room west of it (or,
+    #  at the start of a row, to the room north of it), so all of them can be reached; the other joins are random.
+    #  Some joins go through doors.
+    def GenerateExits(self):
+        for index in range(self.room_count):
+            x = index % self.grid_width
+            y = index // self.grid_width
+            for direction, (opposite, x_step, y_step) in GRID_STEPS.items():
+                if (x + x_step >= self.grid_width):
+                    continue
+                neighbour_index = (y + y_step) * self.grid_width + x + x_step
+                if neighbour_index >= self.room_count:
+                    continue
+                needed = (direction == "east") or (x == 0)
+                if (not needed) and (self.random.random() < 0.5):
+                    continue
+                self.JoinRooms(self.RoomKey(index), direction, self.RoomKey(neighbour_index), opposite)
+
+    def JoinRooms(self, loc_key, direction, other_key, opposite):
+        if (self.ItemsLeft() > 0) and (self.random.random() < self.door_fraction):
+            door_key = self.AddDoor(loc_key, other_key)
+            self.locations[loc_key][direction] = other_key + "|" + door_key
+            self.locations[other_key][opposite] = loc_key + "|" + door_key
+        else:
+            self.locations[loc_key][direction] = other_key
+            self.locations[other_key][opposite] = loc_key
+
+    def AddDoor(self, loc_key, other_key):
+        door_key = "DOOR_" + str(len(self.items))
+        adjective = self.random.choice(self.adjectives)
+        door = {}
+        door["name"] = str.lower(adjective) + " door"
+        door["words"] = ["DOOR"]
+        door["adjectives"] = [adjective]
+        door["init_loc"] = [loc_key, other_key]
+        door["openable?"] = True
+        door["is_open?"] = self.random.random() < 0.75
+        door["do_not_list?"] = True
+        self.items[door_key] = door
+        return door_key
+
+    # Gives most dark rooms a lit lamp: usually in a lit room next door (to carry in), sometimes in the dark room itself
+    def GenerateLights(self):
+        for loc_key in self.room_keys:
+            if (not self.locations[loc_key]["dark?"]) or (self.ItemsLeft() <= 0) or (self.random.random() < 0.2):
+                continue
+            lamp_loc = loc_key
+            if self.random.random() < 0.7:
+                neighbours = [self.locations[loc_key][direction].split("|")[0] for direction in DIRECTIONS
+                              if self.locations[loc_key][direction]]
+                neighbours = [neighbour for neighbour in neighbours if not self.locations[neighbour]["dark?"]]
+                if len(neighbours) > 0:
+                    lamp_loc = self.random.choice(neighbours)
+            adjective = self.random.choice(self.adjectives)
+            lamp = {}
+            lamp["name"] = str.lower(adjective) + " lamp"
+            lamp["words"] = ["LAMP", "LIGHT"]
+            lamp["adjectives"] = [adjective]
+            lamp["takeable?"] = True
+            lamp["light_source?"] = True
+            lamp["init_loc"] = lamp_loc
+            self.items["LAMP_" + str(len(self.items))] = lamp
+
+    # Places chains of containers, each container_depth deep, using about container_fraction of the items
+    def GenerateContainers(self):
+        chains = int(self.ItemsLeft() * self.container_fraction) // (self.container_depth + 1)
+        for chain in range(chains):
+            holder_key = self.random.choice(self.room_keys)
+            for depth in range(self.container_depth):
+                holder_key = self.AddContainer(holder_key, takeable = (depth > 0))
+            self.AddPlainItem(holder_key)
+
+    def AddContainer(self, holder_key, takeable):
+        container_key = "CONTAINER_" + str(len(self.items))
+        adjective = self.random.choice(self.adjectives)
+        noun = self.random.choice(CONTAINER_NOUNS)
+        container = {}
+        container["name"] = str.lower(adjective + " " + noun)
+        container["words"] = [noun]
+        container["adjectives"] = [adjective]
+        container["is_container?"] = True
+        container["openable?"] = True
+        container["is_open?"] = self.random.random() < 0.5
+        container["takeable?"] = takeable
+        container["init_loc"] = holder_key
+        self.items[container_key] = container
+        return container_key
+
+    # Uses up the rest of the items on plain ones, spread over the rooms (the player starts with just the sample
+    #  world's inventory)
+    def GenerateItems(self):
+        while self.ItemsLeft() > 0:
+            self.AddPlainItem(self.random.choice(self.room_keys))
+
+    # Adds an item named by one or two nouns and one or two adjectives from the vocabulary
+    def AddPlainItem(self, holder_key):
+        item_key = "ITEM_" + str(len(self.items))
+        words = self.random.sample(self.nouns, min(len(self.nouns), self.random.randint(1, 2)))
+        adjectives = self.random.sample(self.adjectives, min(len(self.adjectives), self.random.randint(1, 2)))
+        item = {}
+        item["name"] = str.lower(" ".join(adjectives) + " " + words[0])
+        item["words"] = words
+        item["adjectives"] = adjectives
+        item["examine_string"] = "It's an ordinary " + item["name"] + "."
+        item["takeable?"] = self.random.random() < 0.8
+        item["init_loc"] = holder_key
+        self.items[item_key] = item
+
+    def DescribeRoom(self, loc_key):
+        location = self.locations[loc_key]
+        exits = [direction for direction in DIRECTIONS if location[direction]]
+        description = "You are in a generated room"
+        if location["dark?"]:
+            description += " that would be pitch black without a light"
+        location["long_desc"] = description + ". Exits lead " + ", ".join(exits) + "."
+
+
+######################### WRITING #########################
+
+
+# Writes the sample world from base_dir plus a generated part into output_dir, and returns (locations, items) counts
+def WriteWorld(generator, output_dir, base_dir = "."):
+    base_dir = Path(base_dir)
+    output_dir = Path(output_dir)
+    with open(base_dir / "locations.json") as data_file:
+        locations = json.load(data_file)
+    with open(base_dir / "items.json") as data_file:
+        items = json.load(data_file)
+
+    generated_locations, generated_items = generator.Generate()
+    for key in generated_locations:
+        if (key in locations) or (key in items):
+            print("ERROR: generated key " + key + " is already in the base world")
+    for key in generated_items:
+        if (key in locations) or (key in items):
+            print("ERROR: generated key " + key + " is already in the base world")
+
+    # Open the way from the sample world into the generated rooms
+    first_room = generator.RoomKey(0)
+    locations[ENTRANCE_LOCATION][ENTRANCE_DIRECTION] = first_room
+    generated_locations[first_room]["west"] = ENTRANCE_LOCATION
+    generator.DescribeRoom(first_room)
+
+    locations.update(generated_locations)
+    items.update(generated_items)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / "locations.json").write_text(json.dumps(locations, indent=2) + "\n")
+    (output_dir / "items.json").write_text(json.dumps(items, indent=2) + "\n")
+    shutil.copyfile(base_dir / "actions.json", output_dir / "actions.json")
+    return len(locations), len(items)
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Generate a large world for scaling tests")
+    parser.add_argument("--rooms", type=int, default=10000, help="generated rooms")
+    parser.add_argument("--items", type=int, default=100000, help="generated items (doors, lamps and containers included)")
+    parser.add_argument("--container-depth", type=int, default=3, help="how deep containers are nested")
+    parser.add_argument("--containers", type=float, default=0.1, help="fraction of the items in container chains")
+    parser.add_argument("--dark", type=float, default=0.05, help="fraction of the rooms that are dark")
+    parser.add_argument("--doors", type=float, default=0.1, help="fraction of the exits that go through doors")
+    parser.add_argument("--nouns", type=int, default=len(NOUNS), help="size of the noun vocabulary (smaller means more items share nouns)")
+    parser.add_argument("--adjectives", type=int, default=len(ADJECTIVES), help="size of the adjective vocabulary")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base", default=".", help="directory holding the sample world to build on")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="directory to write the world to")
+    args = parser.parse_args()
+
+    generator = WorldGenerator(args.rooms, args.items, args.container_depth, args.containers, args.dark, args.doors,
+                               args.nouns, args.adjectives, args.seed)
+    location_count, item_count = WriteWorld(generator, args.output, args.base)
+    print("Wrote " + args.output + ": " + str(location_count) + " locations, " + str(item_count) + " items")
+
+
+if __name__ == "__main__":
+    Main()